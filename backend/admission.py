@@ -0,0 +1,155 @@
+# Kiểm soát tải cho các endpoint tốn tài nguyên (tải video/ffprobe, phân tích ảnh,
+# băm mật khẩu pbkdf2).
+#
+# Mỗi nhóm endpoint có một AdmissionController: tối đa max_active request chạy cùng lúc
+# (semaphore), thêm tối đa max_queue request được xếp hàng chờ, mỗi request chờ không
+# quá queue_timeout giây. Trước khi vào hàng, mỗi người dùng (hoặc IP) phải lấy một
+# token từ token bucket riêng (rate token/giây, tối đa burst token) và không được giữ quá
+# max_per_key chỗ (kể cả chỗ đang chờ), nên một người mở thư viện ảnh với hàng chục
+# request cùng lúc, hay giữ vài stream dài, không chiếm hết chỗ của người khác.
+# Bị từ chối thì ném AdmissionRejected kèm số giây nên chờ (cho header Retry-After)
+# ngay lập tức, thay vì để request treo tới timeout.
+#
+# Request đang chờ trong hàng cũng giữ một luồng của worker, nên max_active + max_queue
+# phải nhỏ hơn số luồng mỗi worker để các request khác vẫn có luồng. Giới hạn tính theo
+# từng process: với gunicorn, tổng cả server là workers x max_active.
+import math
+import threading
+import time
+
+from cache import LRUCache
+
+
+class AdmissionRejected(Exception):
+    # reason: rate_limited | too_many_active | queue_full | queue_timeout
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        # Trả về 0 nếu lấy được token, ngược lại là số giây tới khi có token
+        # now có thể lấy trước khi bucket được tạo: không để thời gian trôi âm trừ mất token
+        self.tokens = min(self.burst, self.tokens + max(now - self.updated, 0.0) * self.rate)
+        self.updated = max(now, self.updated)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    def __init__(self, name, max_active, max_queue=0, queue_timeout=10.0, rate=0, burst=0, max_per_key=0,
+                 active_gauge=None, queued_gauge=None, rejected_counter=None, wait_histogram=None):
+        # rate=0, max_per_key=0: không giới hạn theo người dùng. Các tham số *_gauge/_counter/
+        # _histogram là metric (metrics.py) có nhãn pool, để /api/metrics báo độ dài hàng đợi
+        # và số lần từ chối.
+        self.name = name
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_per_key = max_per_key
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = {'rate_limited': 0, 'too_many_active': 0, 'queue_full': 0, 'queue_timeout': 0}
+        # Số chỗ (đang chạy + đang chờ) mỗi người dùng/IP đang giữ
+        self._held = {}
+        # Thời gian giữ chỗ trung bình (EWMA), để ước lượng Retry-After khi hàng đợi đầy
+        self.average_hold = 1.0
+        self._buckets = LRUCache(maxsize=10000, ttl=max(self.burst / rate, 60) if rate else None)
+        self._cond = threading.Condition()
+        self._active_gauge = active_gauge
+        self._queued_gauge = queued_gauge
+        self._rejected_counter = rejected_counter
+        self._wait_histogram = wait_histogram
+
+    def _reject(self, reason, retry_after):
+        self.rejected[reason] += 1
+        if self._rejected_counter:
+            self._rejected_counter.inc(pool=self.name, reason=reason)
+        return AdmissionRejected(reason, retry_after)
+
+    def _queue_wait_estimate(self):
+        return self.average_hold * (self.queued + 1) / self.max_active
+
+    def _set_gauges(self):
+        if self._active_gauge:
+            self._active_gauge.set(self.active, pool=self.name)
+        if self._queued_gauge:
+            self._queued_gauge.set(self.queued, pool=self.name)
+
+    def _unhold(self, key):
+        if key is None:
+            return
+        count = self._held.get(key, 0) - 1
+        if count > 0:
+            self._held[key] = count
+        else:
+            self._held.pop(key, None)
+
+    def acquire(self, key=None):
+        # Chờ tới khi có chỗ; trả về thời điểm bắt đầu giữ chỗ (truyền lại cho release cùng key)
+        started = time.monotonic()
+        with self._cond:
+            if self.rate and key is not None:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = TokenBucket(self.rate, self.burst)
+                    self._buckets.set(key, bucket)
+                wait = bucket.take(started)
+                if wait:
+                    raise self._reject('rate_limited', wait)
+            if self.max_per_key and key is not None and self._held.get(key, 0) >= self.max_per_key:
+                raise self._reject('too_many_active', self.average_hold)
+            if self.active >= self.max_active and self.queued >= self.max_queue:
+                raise self._reject('queue_full', self._queue_wait_estimate())
+            if key is not None:
+                self._held[key] = self._held.get(key, 0) + 1
+            if self.active >= self.max_active:
+                self.queued += 1
+                self._set_gauges()
+                try:
+                    deadline = started + self.queue_timeout
+                    while self.active >= self.max_active:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._unhold(key)
+                            raise self._reject('queue_timeout', self._queue_wait_estimate())
+                        self._cond.wait(remaining)
+                finally:
+                    self.queued -= 1
+                    self._set_gauges()
+            self.active += 1
+            self.admitted += 1
+            self._set_gauges()
+        admitted_at = time.monotonic()
+        if self._wait_histogram:
+            self._wait_histogram.observe(admitted_at - started, pool=self.name)
+        return admitted_at
+
+    def release(self, admitted_at, key=None):
+        held = time.monotonic() - admitted_at
+        with self._cond:
+            self.active -= 1
+            self._unhold(key)
+            self.average_hold = 0.8 * self.average_hold + 0.2 * held
+            self._set_gauges()
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {'pool': self.name, 'max_active': self.max_active, 'max_queue': self.max_queue,
+                    'max_per_key': self.max_per_key,
+                    'active': self.active, 'queued': self.queued, 'admitted': self.admitted,
+                    'rejected': dict(self.rejected), 'average_hold_seconds': round(self.average_hold, 3)}
@@ -1,42 +1,309 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g, has_app_context, has_request_context, make_response
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import and_, or_, event, inspect, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
 import os
 import requests
 # --- CÁC THƯ VIỆN KHÔNG CÒN CẦN THIẾT ĐÃ ĐƯỢC XÓA ---
-# import imagehash
-# from PIL import Image
 # import face_recognition
-# import numpy as np
 import io
 import sys
-import subprocess
 import json
-import tempfile
+import csv
+import base64
+import hashlib
+import threading
+import time
+import socket
+import uuid
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
 # Thư viện cho Auth
 import jwt
 import datetime
 from functools import wraps
 from werkzeug.security import generate_password_hash, check_password_hash
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
+
+import video_probe
+from cache import LRUCache
+from schedule_index import ScheduleIndex, parse_timestamp, parse_date
+from google_verifier import GoogleTokenVerifier
+import schedule_import
+import hash_index
+import drive_client
+import drive_auth
+import organize_jobs
+import metrics
+import admission
+import fast_json
+import compression
 
 app = Flask(__name__)
 
 # --- Cấu hình CORS và Database ---
 # THAY ĐỔI 1: Cập nhật cấu hình CORS để chỉ cho phép các request đến /api/*
 # và thêm URL của Render vào danh sách origins được phép.
-CORS(app, resources={r"/api/*": {"origins": ["http://localhost:5173", "https://teachersupportapp.onrender.com"]}})
+CORS(app, resources={r"/api/*": {"origins": ["http://localhost:5173", "https://teachersupportapp.onrender.com"]}},
+     expose_headers=['ETag', 'X-Next-Cursor', 'X-Change-Version'])
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your_default_secret_key')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Pool kết nối: pool_pre_ping bỏ kết nối đã bị Postgres/proxy đóng khi rảnh, pool_recycle
+# thay kết nối cũ hơn DB_POOL_RECYCLE giây. Mỗi worker gunicorn có pool riêng nên tổng số
+# kết nối tối đa là workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW), phải nhỏ hơn max_connections.
+# DB_POOL_SIZE nên bằng số luồng mỗi worker (GUNICORN_THREADS) để request không phải chờ kết nối.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', os.environ.get('GUNICORN_THREADS', '8')))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '4'))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', '10'))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+# Cột JSON (days_of_week của lịch định kỳ...) đọc/ghi bằng fast_json thay vì json chuẩn
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True, 'pool_recycle': DB_POOL_RECYCLE,
+                                           'json_serializer': fast_json.dumps_text, 'json_deserializer': fast_json.loads}
+if not (app.config['SQLALCHEMY_DATABASE_URI'] or 'sqlite').startswith('sqlite'):
+    # SQLite không dùng QueuePool nên không nhận các tham số kích thước pool
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update(
+        pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
 db = SQLAlchemy(app)
 
+# --- Cấu hình số liệu theo dõi (Prometheus) ---
+# /api/metrics trả số liệu dạng Prometheus. METRICS_DIR là thư mục chung để gộp số liệu
+# của các worker gunicorn; METRICS_TOKEN nếu đặt thì scraper phải gửi "Bearer <token>".
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+metrics_registry = metrics.Registry()
+metrics_exporter = metrics.MetricsExporter(metrics_registry, METRICS_DIR or None)
+HTTP_REQUESTS = metrics_registry.counter(
+    'http_requests_total', 'Số request theo endpoint và mã trạng thái', ('method', 'endpoint', 'status'))
+HTTP_LATENCY = metrics_registry.histogram(
+    'http_request_duration_seconds', 'Thời gian xử lý request, tính tới khi gửi xong body', ('method', 'endpoint'))
+HTTP_IN_FLIGHT = metrics_registry.gauge('http_requests_in_flight', 'Số request đang xử lý', ('method', 'endpoint'))
+HTTP_DB_QUERIES = metrics_registry.histogram(
+    'http_request_db_queries', 'Số câu SQL trong mỗi request', ('endpoint',),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 250, 1000))
+HTTP_DB_SECONDS = metrics_registry.histogram('http_request_db_seconds', 'Tổng thời gian SQL trong mỗi request', ('endpoint',))
+# context: request hoặc background (job sắp xếp, luồng nền)
+DB_QUERIES = metrics_registry.counter('db_queries_total', 'Số câu SQL đã chạy', ('context',))
+DB_SECONDS = metrics_registry.counter('db_query_seconds_total', 'Tổng thời gian chạy SQL', ('context',))
+VIDEO_PROBE_SECONDS = metrics_registry.histogram(
+    'video_probe_duration_seconds', 'Thời gian đọc creation_time video theo bước (range_probe, ffprobe)', ('stage',))
+DRIVE_DOWNLOAD_SECONDS = metrics_registry.histogram(
+    'drive_download_duration_seconds', 'Thời gian tải cả file từ Drive (video cho ffprobe, ảnh để phân tích)', ('kind',))
+
+# --- Cấu hình nén response và mã hoá JSON ---
+# Response JSON từ COMPRESS_MIN_BYTES byte được nén gzip (hoặc brotli nếu đã cài gói
+# brotli) khi client gửi Accept-Encoding; RESPONSE_COMPRESSION=0 để tắt (ví dụ khi proxy
+# phía trước đã nén). Danh sách lịch không phân trang được stream theo từng khối
+# JSON_STREAM_CHUNK dòng.
+RESPONSE_COMPRESSION = os.environ.get('RESPONSE_COMPRESSION', '1') not in ('0', 'false')
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', '6'))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', '4'))
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/csv')
+JSON_STREAM_CHUNK = int(os.environ.get('JSON_STREAM_CHUNK', '1000'))
+# stage: raw (trước khi nén) hoặc sent (sau khi nén)
+HTTP_COMPRESSION_BYTES = metrics_registry.counter(
+    'http_response_compression_bytes_total', 'Số byte body response trước và sau khi nén', ('encoding', 'stage'))
+
+# --- Cấu hình xử lý metadata video ---
+# Số luồng tối đa dùng chung cho mọi request lấy metadata video, để một thư mục
+# nhiều video không chiếm hết worker của gunicorn.
+VIDEO_METADATA_WORKERS = int(os.environ.get('VIDEO_METADATA_WORKERS', '8'))
+VIDEO_METADATA_BATCH_LIMIT = int(os.environ.get('VIDEO_METADATA_BATCH_LIMIT', '500'))
+video_metadata_executor = ThreadPoolExecutor(max_workers=VIDEO_METADATA_WORKERS, thread_name_prefix='video-metadata')
+
+# Session dùng chung để giữ kết nối keep-alive tới Drive thay vì mở kết nối mới mỗi lần.
+# Pool đủ lớn cho metadata video, tải ảnh phân tích và các job sắp xếp chạy cùng lúc.
+DRIVE_HTTP_POOL_SIZE = int(os.environ.get('DRIVE_HTTP_POOL_SIZE', '32'))
+drive_http = requests.Session()
+drive_http.mount('https://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=DRIVE_HTTP_POOL_SIZE))
+
+# Cache metadata video: LRU trong bộ nhớ phía trước bảng MediaMetadata.
+# Khoá gồm fileId và md5Checksum/modifiedTime nên file bị sửa sẽ tự động miss.
+MEDIA_METADATA_TTL = int(os.environ.get('MEDIA_METADATA_TTL_DAYS', '90')) * 24 * 3600
+media_metadata_cache = LRUCache(maxsize=int(os.environ.get('MEDIA_METADATA_CACHE_SIZE', '10000')), ttl=MEDIA_METADATA_TTL)
+media_metadata_counters = {'db_hits': 0, 'probes': 0}
+
+# --- Cấu hình tra cứu lịch học ---
+# Múi giờ mặc định khi thời điểm gửi lên có kèm múi giờ (UTC+7)
+APP_UTC_OFFSET_MINUTES = int(os.environ.get('APP_UTC_OFFSET_MINUTES', '420'))
+SCHEDULE_MATCH_LIMIT = int(os.environ.get('SCHEDULE_MATCH_LIMIT', '20000'))
+SCHEDULE_IMPORT_LIMIT = int(os.environ.get('SCHEDULE_IMPORT_LIMIT', '20000'))
+# Số cặp trùng tối đa trả về trong một lần rà /api/schedules/conflicts
+SCHEDULE_CONFLICT_LIMIT = int(os.environ.get('SCHEDULE_CONFLICT_LIMIT', '1000'))
+schedule_index = ScheduleIndex()
+schedule_index_lock = threading.Lock()
+# Lịch đã bung theo khoảng ngày cho trang lịch tháng/tuần, khoá (from, to, revision)
+CALENDAR_MAX_DAYS = int(os.environ.get('CALENDAR_MAX_DAYS', '93'))
+calendar_cache = LRUCache(maxsize=int(os.environ.get('CALENDAR_CACHE_SIZE', '256')))
+
+# --- Cấu hình kiểm soát tải (admission control) ---
+# heavy: metadata video (tải file cho ffprobe) và phân tích ảnh; login: đăng nhập admin
+# (băm pbkdf2). Mỗi nhóm: số request chạy cùng lúc, số request được xếp hàng chờ, thời
+# gian chờ tối đa (giây), và token bucket (token/giây, burst) theo người dùng với heavy,
+# theo IP với login. Vượt giới hạn thì trả 429 kèm Retry-After ngay. Tính theo từng worker.
+# Request đang chạy hay đang chờ đều giữ một luồng gthread, nên mặc định suy ra từ
+# GUNICORN_THREADS:
+# - heavy chạy tối đa một nửa số luồng, mỗi người dùng tối đa một nửa số đó. Hàng chờ cố ý
+#   ngắn (1 với 8 luồng) và chờ ít: request heavy giữ chỗ hàng giây, frontend
+#   (fetchWithRetry) tự gửi lại theo Retry-After nên từ chối sớm rẻ hơn giữ luồng chờ.
+# - login (pbkdf2, vài chục tới vài trăm ms) chạy tối đa một phần tư số luồng, hàng chờ
+#   ít nhất 4 để cả phòng giáo viên đăng nhập cùng lúc buổi sáng được xếp hàng và xong
+#   trong khoảng một giây thay vì nhận 429. Hàng chờ login được mượn luồng còn trống vì
+#   mỗi request chờ rất ngắn.
+# - events: stream SSE tiến độ job sắp xếp, giữ luồng suốt kết nối nên không có hàng chờ,
+#   mỗi người dùng một stream, và mỗi stream tự đóng sau ORGANIZE_SSE_MAX_SECONDS để
+#   client nối lại (Last-Event-ID), nhường chỗ cho người khác.
+# heavy (chạy + chờ) hoặc heavy cộng login đang chạy, thêm các stream events, luôn chừa
+# luồng cho request thường.
+WORKER_THREADS = max(1, int(os.environ.get('GUNICORN_THREADS', '8')))
+HEAVY_MAX_ACTIVE = int(os.environ.get('HEAVY_MAX_ACTIVE', str(max(1, WORKER_THREADS // 2))))
+HEAVY_MAX_QUEUE = int(os.environ.get('HEAVY_MAX_QUEUE', str(WORKER_THREADS // 8)))
+HEAVY_QUEUE_TIMEOUT = float(os.environ.get('HEAVY_QUEUE_TIMEOUT', '2'))
+HEAVY_USER_MAX_ACTIVE = int(os.environ.get('HEAVY_USER_MAX_ACTIVE', str(max(1, HEAVY_MAX_ACTIVE // 2))))
+HEAVY_USER_RATE = float(os.environ.get('HEAVY_USER_RATE', '4'))
+HEAVY_USER_BURST = int(os.environ.get('HEAVY_USER_BURST', '20'))
+LOGIN_MAX_ACTIVE = int(os.environ.get('LOGIN_MAX_ACTIVE', str(max(1, min(os.cpu_count() or 2, WORKER_THREADS // 4)))))
+LOGIN_MAX_QUEUE = int(os.environ.get('LOGIN_MAX_QUEUE', str(max(4, WORKER_THREADS // 2))))
+LOGIN_QUEUE_TIMEOUT = float(os.environ.get('LOGIN_QUEUE_TIMEOUT', '3'))
+LOGIN_IP_RATE = float(os.environ.get('LOGIN_IP_RATE', '0.5'))
+LOGIN_IP_BURST = int(os.environ.get('LOGIN_IP_BURST', '10'))
+EVENTS_MAX_ACTIVE = int(os.environ.get('EVENTS_MAX_ACTIVE', str(max(1, WORKER_THREADS // 8))))
+EVENTS_USER_MAX_ACTIVE = int(os.environ.get('EVENTS_USER_MAX_ACTIVE', '1'))
+ADMISSION_ACTIVE = metrics_registry.gauge('admission_active', 'Số request đang giữ chỗ', ('pool',))
+ADMISSION_QUEUED = metrics_registry.gauge('admission_queued', 'Số request đang xếp hàng chờ', ('pool',))
+ADMISSION_REJECTED = metrics_registry.counter(
+    'admission_rejected_total', 'Số request bị từ chối (rate_limited, too_many_active, queue_full, queue_timeout)',
+    ('pool', 'reason'))
+ADMISSION_WAIT_SECONDS = metrics_registry.histogram('admission_wait_seconds', 'Thời gian chờ trong hàng đợi', ('pool',))
+admission_metrics = {'active_gauge': ADMISSION_ACTIVE, 'queued_gauge': ADMISSION_QUEUED,
+                     'rejected_counter': ADMISSION_REJECTED, 'wait_histogram': ADMISSION_WAIT_SECONDS}
+heavy_admission = admission.AdmissionController(
+    'heavy', HEAVY_MAX_ACTIVE, HEAVY_MAX_QUEUE, HEAVY_QUEUE_TIMEOUT, HEAVY_USER_RATE, HEAVY_USER_BURST,
+    max_per_key=HEAVY_USER_MAX_ACTIVE, **admission_metrics)
+login_admission = admission.AdmissionController(
+    'login', LOGIN_MAX_ACTIVE, LOGIN_MAX_QUEUE, LOGIN_QUEUE_TIMEOUT, LOGIN_IP_RATE, LOGIN_IP_BURST, **admission_metrics)
+events_admission = admission.AdmissionController(
+    'events', EVENTS_MAX_ACTIVE, max_per_key=EVENTS_USER_MAX_ACTIVE, **admission_metrics)
+
+# --- Cấu hình cache xác thực ---
+# Giữ kết quả giải mã token và thông tin user trong thời gian ngắn để các request
+# liên tiếp không phải truy vấn DB. Xoá user/đổi quyền/đổi mật khẩu tăng bộ đếm thu hồi
+# AUTH_REVISION_ID (cùng transaction). Mỗi worker đọc lại bộ đếm này (một dòng, theo khoá
+# chính) nhiều nhất một lần mỗi AUTH_REVISION_CHECK_SECONDS, không phải mỗi request, và bỏ
+# mọi user trong cache được nạp trước lần thu hồi gần nhất: thu hồi có hiệu lực ngay ở
+# worker xử lý nó và sau tối đa AUTH_REVISION_CHECK_SECONDS ở các worker khác. Đổi mật
+# khẩu còn tăng User.token_version để token cũ hết hiệu lực.
+AUTH_REVISION_ID = 3
+AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL', '30'))
+AUTH_REVISION_CHECK_SECONDS = float(os.environ.get('AUTH_REVISION_CHECK_SECONDS', '1'))
+auth_token_cache = LRUCache(maxsize=4096, ttl=AUTH_CACHE_TTL)
+auth_user_cache = LRUCache(maxsize=1024, ttl=AUTH_CACHE_TTL)
+auth_revision_state = {'version': 0, 'checked_at': None}
+auth_cache_counters = {'db_lookups': 0, 'revision_checks': 0, 'stale_after_revocation': 0}
+
+# --- Cấu hình cache cài đặt và xác thực Google ---
+# Cài đặt gần như không đổi nhưng được đọc ở mỗi lần tải trang và mỗi lần đăng nhập Google.
+# Lưu cài đặt tăng bộ đếm SETTINGS_REVISION_ID; như cache xác thực, mỗi worker đọc lại bộ
+# đếm nhiều nhất một lần mỗi SETTINGS_REVISION_CHECK_SECONDS và bỏ bản cache cũ hơn, nên
+# mọi worker thấy cài đặt mới sau tối đa chừng ấy giây.
+SETTINGS_REVISION_ID = 4
+SETTINGS_CACHE_TTL = int(os.environ.get('SETTINGS_CACHE_TTL', '300'))
+SETTINGS_REVISION_CHECK_SECONDS = float(os.environ.get('SETTINGS_REVISION_CHECK_SECONDS', '1'))
+settings_cache = LRUCache(maxsize=1, ttl=SETTINGS_CACHE_TTL)
+settings_revision_state = {'version': 0, 'checked_at': None}
+google_verifier = GoogleTokenVerifier()
+
+# --- Cấu hình token Google Drive phía server ---
+# Client secret của OAuth client (cùng Client ID trong Cài đặt). Khi có secret, trình
+# duyệt xin quyền bằng authorization code để server giữ refresh token và tự làm mới
+# access token; không có thì vẫn dùng access token trình duyệt gửi lên như trước.
+GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET', '')
+
+# --- Cấu hình lọc ảnh trùng ---
+# Chỉ mục hash theo (thư mục đích, thuật toán) được giữ trong bộ nhớ, nạp từ bảng PhotoHash
+# khi cần. Hash chỉ được so với hash cùng thuật toán (hash_index.ALGORITHMS): pHash DCT của
+# image_analysis (job sắp xếp, /api/image-analysis/batch) và phash-js phía trình duyệt cho
+# ra hash khác nhau với cùng một ảnh nên khoảng cách Hamming giữa chúng vô nghĩa.
+PHOTO_HASH_INDEXES_CACHED = int(os.environ.get('PHOTO_HASH_INDEXES_CACHED', '64'))
+PHOTO_HASH_QUERY_LIMIT = int(os.environ.get('PHOTO_HASH_QUERY_LIMIT', '5000'))
+photo_hash_indexes = LRUCache(maxsize=PHOTO_HASH_INDEXES_CACHED)
+photo_hash_lock = threading.Lock()
+
+# --- Cấu hình phân tích chất lượng ảnh ---
+# Ảnh được tải từ Drive bằng thread pool, rồi giải mã và tính toán theo từng lô nhỏ
+# trên process pool để tận dụng mọi nhân CPU mà không bị GIL giới hạn. Mỗi worker
+# gunicorn có pool riêng, nên mặc định chia số nhân cho số worker (WEB_CONCURRENCY, do
+# gunicorn.conf.py đặt) để tổng số process phân tích không vượt số nhân của máy.
+WEB_CONCURRENCY = max(1, int(os.environ.get('WEB_CONCURRENCY', '1')))
+IMAGE_ANALYSIS_PROCESSES = int(os.environ.get(
+    'IMAGE_ANALYSIS_PROCESSES', str(max(1, (os.cpu_count() or 2) // WEB_CONCURRENCY))))
+IMAGE_ANALYSIS_DOWNLOAD_WORKERS = int(os.environ.get('IMAGE_ANALYSIS_DOWNLOAD_WORKERS', '8'))
+IMAGE_ANALYSIS_CHUNK = int(os.environ.get('IMAGE_ANALYSIS_CHUNK', '16'))
+IMAGE_ANALYSIS_BATCH_LIMIT = int(os.environ.get('IMAGE_ANALYSIS_BATCH_LIMIT', '500'))
+IMAGE_ANALYSIS_MAX_BYTES = int(os.environ.get('IMAGE_ANALYSIS_MAX_MB', '50')) * 1024 * 1024
+image_download_executor = ThreadPoolExecutor(max_workers=IMAGE_ANALYSIS_DOWNLOAD_WORKERS, thread_name_prefix='image-download')
+# Process pool chỉ được tạo khi có yêu cầu phân tích đầu tiên
+image_analysis_pool = None
+image_analysis_pool_lock = threading.Lock()
+
+# --- Cấu hình job sắp xếp ảnh phía server ---
+# Job và trạng thái từng file được lưu trong DB. Worker đang chạy job giữ "lease"
+# (owner + heartbeat_at); worker bị tắt/khởi động lại thì lease hết hạn và job được
+# chạy tiếp từ các file còn dang dở ở lần gọi API job kế tiếp.
+ORGANIZE_MAX_JOBS = int(os.environ.get('ORGANIZE_MAX_JOBS', '2'))
+ORGANIZE_DEFAULT_WORKERS = int(os.environ.get('ORGANIZE_DEFAULT_WORKERS', '5'))
+ORGANIZE_MAX_WORKERS = int(os.environ.get('ORGANIZE_MAX_WORKERS', '16'))
+ORGANIZE_HEARTBEAT_SECONDS = int(os.environ.get('ORGANIZE_HEARTBEAT_SECONDS', '15'))
+ORGANIZE_LEASE_SECONDS = int(os.environ.get('ORGANIZE_LEASE_SECONDS', '60'))
+ORGANIZE_SSE_POLL_SECONDS = float(os.environ.get('ORGANIZE_SSE_POLL_SECONDS', '2'))
+# Một kết nối SSE giữ một luồng worker: đóng sau chừng ấy giây, client nối lại và nhận tiếp
+ORGANIZE_SSE_MAX_SECONDS = float(os.environ.get('ORGANIZE_SSE_MAX_SECONDS', '30'))
+# Lệnh di chuyển file được gom thành batch Drive (tối đa 100 lệnh), chờ tối đa chừng này giây
+ORGANIZE_MOVE_LINGER_SECONDS = float(os.environ.get('ORGANIZE_MOVE_LINGER_SECONDS', '0.5'))
+DRIVE_MOVE_BATCH_LIMIT = int(os.environ.get('DRIVE_MOVE_BATCH_LIMIT', '1000'))
+# Ngưỡng lọc mặc định, mỗi job đặt lại được (minSharpness, minBrightness). Số đo là của
+# image_analysis trên cả khung ảnh thu về 256x256, khác bộ phân tích cũ trên trình duyệt:
+# - brightness: độ sáng trung bình (luma 0-255) của cả ảnh, trình duyệt cũng đo trên cả ảnh
+#   nên giữ ngưỡng 85 như cũ.
+# - sharpness: phương sai Laplacian. Trình duyệt đo trên vùng khuôn mặt ở độ phân giải gốc
+#   (ngưỡng 50); ở 256x256 cùng ngưỡng đó gần như không loại ảnh nào. Đo trên ảnh thật làm
+#   nhoè dần: ảnh nét cho 450-2000, nhoè 0,5 px (ở 256x256, khoảng 8 px ở ảnh 12MP) còn
+#   120-480, nhoè 1 px còn 20-85, nên mặc định 100 loại ảnh nhoè thấy rõ khi xem thu nhỏ.
+#   Ảnh chỉ hơi mềm ở độ phân giải gốc thì số đo này không phân biệt được.
+# Bộ phân tích cũ còn bỏ qua ảnh không tìm thấy khuôn mặt (face-api); server không có bộ
+# nhận diện khuôn mặt nên không còn lọc này.
+ORGANIZE_MIN_SHARPNESS = float(os.environ.get('ORGANIZE_MIN_SHARPNESS', '100'))
+ORGANIZE_MIN_BRIGHTNESS = float(os.environ.get('ORGANIZE_MIN_BRIGHTNESS', '85'))
+ORGANIZE_SELECTED_FOLDER = 'Selected Items'
+organize_runner = organize_jobs.JobRunner(ORGANIZE_MAX_JOBS)
+organize_state = {'resume_checked_at': 0.0, 'resumer': None}
+
+# --- Cấu hình chỉ mục file Drive ---
+# Danh sách file của các thư mục đã mở được lưu trong DB và cập nhật qua changes feed
+# của Drive (vị trí đọc lưu theo từng người dùng), nên các lần sau chỉ đọc phần thay
+# đổi thay vì liệt kê lại cả thư mục.
+DRIVE_SYNC_MIN_SECONDS = float(os.environ.get('DRIVE_SYNC_MIN_SECONDS', '5'))
+# thumbnailLink của Drive chỉ dùng được trong vài giờ
+DRIVE_THUMBNAIL_TTL_SECONDS = int(os.environ.get('DRIVE_THUMBNAIL_TTL_SECONDS', '3600'))
+# Không đọc changes feed của cùng người dùng song song. Số khoá cố định, người dùng chia
+# khoá theo hash(user_id): hai người trùng khoá chỉ phải đồng bộ lần lượt, bộ nhớ không
+# tăng theo số người dùng.
+DRIVE_SYNC_LOCK_STRIPES = int(os.environ.get('DRIVE_SYNC_LOCK_STRIPES', '64'))
+drive_sync_locks = [threading.Lock() for _ in range(DRIVE_SYNC_LOCK_STRIPES)]
+
 # --- Hàm trợ giúp ---
 def print_to_stderr(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
 
+def fast_jsonify(value, status=200):
+    # Như jsonify nhưng mã hoá bằng fast_json (orjson nếu có) cho các response lớn
+    return Response(fast_json.dumps(value), status=status, mimetype='application/json')
+
 # --- Models ---
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -47,6 +314,9 @@ class User(db.Model):
     google_id = db.Column(db.String(100), unique=True, nullable=True)
     drive_access_token = db.Column(db.String(500), nullable=True) 
     drive_refresh_token = db.Column(db.String(500), nullable=True) 
+    drive_token_expires_at = db.Column(db.DateTime, nullable=True)
+    # Ghi vào token (tv); tăng khi đổi mật khẩu để mọi token cấp trước đó bị từ chối
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
 class Setting(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -61,17 +331,208 @@ class RecurringSchedule(db.Model):
     days_of_week = db.Column(db.JSON, nullable=False)
     start_time = db.Column(db.String(5), nullable=False)
     end_time = db.Column(db.String(5), nullable=False)
-    expiry_date = db.Column(db.String(10), nullable=True)
+    expiry_date = db.Column(db.Date, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_recurring_schedule_school_class', 'school_name', 'class_name'),
+        db.Index('ix_recurring_schedule_expiry_date', 'expiry_date'),
+    )
 
 class OneOffSchedule(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     school_name = db.Column(db.String(100), nullable=False)
     class_name = db.Column(db.String(100), nullable=False)
-    date = db.Column(db.String(10), nullable=False)
+    date = db.Column(db.Date, nullable=False)
     start_time = db.Column(db.String(5), nullable=False)
     end_time = db.Column(db.String(5), nullable=False)
 
+    __table_args__ = (
+        db.Index('ix_one_off_schedule_date_start', 'date', 'start_time'),
+        db.Index('ix_one_off_schedule_school_class', 'school_name', 'class_name'),
+    )
+
+# Bộ đếm tăng mỗi khi lịch học thay đổi, để mọi worker biết chỉ mục lịch của mình đã cũ.
+# Dòng CHANGE_LOG_REVISION_ID là bộ đếm version của nhật ký thay đổi (ChangeLog);
+# AUTH_REVISION_ID và SETTINGS_REVISION_ID báo cho các worker bỏ cache xác thực, cài đặt.
+class ScheduleRevision(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+# Nhật ký thay đổi cho đồng bộ delta (?since=<version>): mỗi dòng lịch/user chỉ giữ một
+# bản ghi với version của lần ghi gần nhất, deleted=True là dấu đã xoá. Bảng không phình
+# theo số lần ghi mà theo số dòng từng tồn tại.
+class ChangeLog(db.Model):
+    entity = db.Column(db.String(20), primary_key=True)
+    entity_id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+
+    __table_args__ = (
+        db.Index('ix_change_log_entity_version', 'entity', 'version'),
+    )
+
+class MediaMetadata(db.Model):
+    file_id = db.Column(db.String(200), primary_key=True)
+    checksum = db.Column(db.String(64), nullable=True)
+    modified_time = db.Column(db.String(40), nullable=True)
+    creation_time = db.Column(db.String(40), nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow, index=True)
+
+# Perceptual hash 64 bit (lưu dạng số có dấu) của các ảnh đã xếp vào từng thư mục đích,
+# kèm thuật toán tạo ra hash (một trong hash_index.ALGORITHMS)
+class PhotoHash(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    folder_id = db.Column(db.String(200), nullable=False)
+    algorithm = db.Column(db.String(20), nullable=False)
+    file_id = db.Column(db.String(200), nullable=False)
+    hash = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('folder_id', 'algorithm', 'file_id', name='uq_photo_hash_folder_algorithm_file'),
+        db.Index('ix_photo_hash_folder_algorithm_row', 'folder_id', 'algorithm', 'id'),
+    )
+
+# Job sắp xếp ảnh chạy nền; status: queued, running, cancelling, completed, failed, cancelled
+class OrganizeJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    source_folder_id = db.Column(db.String(200), nullable=False)
+    options = db.Column(db.JSON, nullable=False)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String(500), nullable=True)
+    owner = db.Column(db.String(100), nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_organize_job_status', 'status'),
+    )
+
+# Từng file của job; status: pending, done, error. seq là thứ tự xử lý xong trong job,
+# dùng làm id sự kiện SSE để client kết nối lại không bị mất/lặp sự kiện.
+class OrganizeJobFile(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(32), nullable=False)
+    file_id = db.Column(db.String(200), nullable=False)
+    name = db.Column(db.String(500), nullable=False)
+    mime_type = db.Column(db.String(100), nullable=False)
+    meta = db.Column(db.JSON, nullable=True)
+    status = db.Column(db.String(10), nullable=False, default='pending')
+    outcome = db.Column(db.String(20), nullable=True)
+    message = db.Column(db.String(500), nullable=True)
+    destination_folder_id = db.Column(db.String(200), nullable=True)
+    seq = db.Column(db.Integer, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('job_id', 'file_id', name='uq_organize_job_file'),
+        db.Index('ix_organize_job_file_status', 'job_id', 'status'),
+        db.Index('ix_organize_job_file_seq', 'job_id', 'seq'),
+    )
+
+# Vị trí đã đọc tới trong changes feed Drive của từng người dùng
+class DriveChangeCursor(db.Model):
+    user_id = db.Column(db.Integer, primary_key=True)
+    page_token = db.Column(db.String(200), nullable=False)
+    synced_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+# Thư mục người dùng đã mở; listed_at rỗng nghĩa là cần liệt kê lại từ đầu
+class DriveFolderWatch(db.Model):
+    user_id = db.Column(db.Integer, primary_key=True)
+    folder_id = db.Column(db.String(200), primary_key=True)
+    listed_at = db.Column(db.DateTime, nullable=True)
+    thumbnails_at = db.Column(db.DateTime, nullable=True)
+
+# Chỉ mục ảnh, video và thư mục con trực tiếp của các thư mục đang theo dõi, riêng cho
+# từng người dùng: mỗi người chỉ thấy những gì token Drive của chính họ thấy, và việc liệt
+# kê lại hay changes feed của một người không xoá được chỉ mục của người khác.
+class DriveFile(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    folder_id = db.Column(db.String(200), nullable=False)
+    file_id = db.Column(db.String(200), nullable=False)
+    name = db.Column(db.String(500), nullable=False)
+    mime_type = db.Column(db.String(100), nullable=False)
+    created_time = db.Column(db.String(40), nullable=True)
+    modified_time = db.Column(db.String(40), nullable=True)
+    exif_time = db.Column(db.String(40), nullable=True)
+    md5_checksum = db.Column(db.String(64), nullable=True)
+    thumbnail_link = db.Column(db.Text, nullable=True)
+    parents = db.Column(db.JSON, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'folder_id', 'file_id', name='uq_drive_file_user_folder_file'),
+        db.Index('ix_drive_file_user_file', 'user_id', 'file_id'),
+    )
+
 # --- Logic Bảo mật (Authentication & Authorization) ---
+# Bản chụp các trường của User mà phần xác thực/phân quyền cần; handler cần ghi
+# vào User thì tự tải bản ghi ORM bằng current_user.id.
+AuthenticatedUser = namedtuple('AuthenticatedUser', ['id', 'email', 'name', 'role', 'token_version'])
+
+def issue_api_token(user):
+    return jwt.encode({
+        'user_id': user.id,
+        'tv': user.token_version or 0,
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)
+    }, app.config['SECRET_KEY'], algorithm="HS256")
+
+def decode_api_token(token):
+    payload = auth_token_cache.get(token)
+    if payload is None:
+        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
+        # Không giữ token trong cache lâu hơn thời hạn của chính nó
+        ttl = min(AUTH_CACHE_TTL, payload.get('exp', 0) - time.time())
+        if ttl > 0:
+            auth_token_cache.set(token, payload, ttl=ttl)
+    return payload
+
+def poll_revision(state, revision_id, interval):
+    # Bộ đếm revision_id, đọc lại từ DB khi bản trong process (state) đã cũ hơn interval
+    # giây. Trả về (version, có truy vấn DB hay không).
+    now = time.monotonic()
+    checked_at = state['checked_at']
+    if checked_at is not None and now - checked_at < interval:
+        return state['version'], False
+    version = db.session.query(ScheduleRevision.version).filter_by(id=revision_id).scalar() or 0
+    state['version'] = max(state['version'], version)
+    state['checked_at'] = now
+    return state['version'], True
+
+def current_auth_revision():
+    revision, queried = poll_revision(auth_revision_state, AUTH_REVISION_ID, AUTH_REVISION_CHECK_SECONDS)
+    if queried:
+        auth_cache_counters['revision_checks'] += 1
+    return revision
+
+def get_authenticated_user(user_id):
+    # Đọc bộ đếm thu hồi trước khi nạp user: nếu có thu hồi xen vào giữa, bản nạp được
+    # gắn revision cũ và lần kiểm tra bộ đếm sau sẽ nạp lại
+    revision = current_auth_revision()
+    cached = auth_user_cache.get(user_id)
+    if cached is not None:
+        if cached[0] == revision:
+            return cached[1]
+        auth_cache_counters['stale_after_revocation'] += 1
+    auth_cache_counters['db_lookups'] += 1
+    row = User.query.get(user_id)
+    if not row:
+        auth_user_cache.pop(user_id)
+        return None
+    user = AuthenticatedUser(row.id, row.email, row.name, row.role, row.token_version or 0)
+    auth_user_cache.set(user_id, (revision, user))
+    return user
+
+def revoke_authenticated_user(user_id):
+    # Gọi trước commit, cùng transaction với thao tác xoá user/đổi quyền/đổi mật khẩu.
+    # Worker này thấy bộ đếm mới ngay (nếu transaction không commit thì chỉ làm cache nạp lại).
+    revision = _bump_revision(db.session, AUTH_REVISION_ID)
+    auth_revision_state['version'] = max(auth_revision_state['version'], revision)
+    auth_user_cache.pop(user_id)
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -79,10 +540,12 @@ def token_required(f):
         if not token:
             return jsonify({'error': 'Token is missing'}), 401
         try:
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = User.query.get(data['user_id'])
+            data = decode_api_token(token)
+            current_user = get_authenticated_user(data['user_id'])
             if not current_user:
                 return jsonify({'error': 'User not found'}), 404
+            if data.get('tv', 0) != current_user.token_version:
+                return jsonify({'error': 'Token has been revoked'}), 401
         except jwt.ExpiredSignatureError:
             return jsonify({'error': 'Token has expired'}), 401
         except jwt.InvalidTokenError:
@@ -98,6 +561,139 @@ def admin_required(f):
         return f(current_user, *args, **kwargs)
     return decorated
 
+def admission_controlled(controller, per='user'):
+    # Giới hạn tải cho endpoint tốn tài nguyên. per='user' đặt sau token_required (khoá là
+    # id người dùng), per='ip' cho endpoint chưa đăng nhập. Response dạng stream (NDJSON)
+    # trả chỗ ngay khi sinh xong phần tử cuối (hoặc khi client ngắt và response bị đóng).
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            key = args[0].id if per == 'user' else request.access_route[0] if request.access_route else None
+            try:
+                admitted_at = controller.acquire(key)
+            except admission.AdmissionRejected as e:
+                response = jsonify({'error': 'Máy chủ đang bận, vui lòng thử lại sau.', 'reason': e.reason,
+                                    'retryAfter': e.retry_after})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(e.retry_after)
+                return response
+            try:
+                response = make_response(f(*args, **kwargs))
+            except BaseException:
+                controller.release(admitted_at, key)
+                raise
+            if response.is_streamed:
+                released = []
+
+                def release_once():
+                    if not released:
+                        released.append(True)
+                        controller.release(admitted_at, key)
+                response.response = _release_when_done(response.response, release_once)
+                response.call_on_close(release_once)
+            else:
+                controller.release(admitted_at, key)
+            return response
+        return decorated
+    return decorator
+
+def _release_when_done(body, release):
+    try:
+        yield from body
+    finally:
+        release()
+
+# --- Số liệu theo dõi ---
+def _metrics_endpoint():
+    # Dùng mẫu route (/api/organize-jobs/<job_id>) để số nhãn không tăng theo id
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_request_metrics():
+    metrics_exporter.start()
+    g.metrics = {"started": time.perf_counter(), "endpoint": _metrics_endpoint(), "db_queries": 0, "db_seconds": 0.0}
+    HTTP_IN_FLIGHT.inc(method=request.method, endpoint=g.metrics['endpoint'])
+
+@app.after_request
+def finish_request_metrics(response):
+    state = g.get('metrics')
+    if state is None:
+        return response
+    method, status = request.method, str(response.status_code)
+
+    # Response dạng stream (NDJSON, SSE) chỉ xong khi server đóng body
+    def finish():
+        endpoint = state['endpoint']
+        HTTP_IN_FLIGHT.dec(method=method, endpoint=endpoint)
+        HTTP_REQUESTS.inc(method=method, endpoint=endpoint, status=status)
+        HTTP_LATENCY.observe(time.perf_counter() - state['started'], method=method, endpoint=endpoint)
+        HTTP_DB_QUERIES.observe(state['db_queries'], endpoint=endpoint)
+        HTTP_DB_SECONDS.observe(state['db_seconds'], endpoint=endpoint)
+    response.call_on_close(finish)
+    return response
+
+@app.after_request
+def compress_response(response):
+    if not RESPONSE_COMPRESSION or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if (request.method == 'HEAD' or response.status_code != 200 or 'Content-Encoding' in response.headers
+            or response.direct_passthrough):
+        return response
+    encoding = compression.negotiate(request.accept_encodings)
+    if encoding is None:
+        return response
+    level = COMPRESS_BROTLI_QUALITY if encoding == 'br' else COMPRESS_GZIP_LEVEL
+
+    def count(raw, sent):
+        HTTP_COMPRESSION_BYTES.inc(raw, encoding=encoding, stage='raw')
+        HTTP_COMPRESSION_BYTES.inc(sent, encoding=encoding, stage='sent')
+
+    if response.is_streamed:
+        response.response = compression.compress_stream(response.response, encoding, level, on_done=count)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_BYTES:
+            return response
+        compressed = compression.compress(data, encoding, level)
+        count(len(data), len(compressed))
+        response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    # Body đã khác theo từng kiểu nén nên ETag chỉ còn là weak ETag (so sánh If-None-Match
+    # dùng contains_weak)
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info.pop('query_started', time.perf_counter())
+    state = g.get('metrics') if has_request_context() else None
+    if state is not None:
+        state['db_queries'] += 1
+        state['db_seconds'] += elapsed
+    kind = 'request' if state is not None else 'background'
+    DB_QUERIES.inc(context=kind)
+    DB_SECONDS.inc(elapsed, context=kind)
+
+def observe_video_probe(stage, seconds):
+    if stage == 'download':
+        DRIVE_DOWNLOAD_SECONDS.observe(seconds, kind='video')
+    else:
+        VIDEO_PROBE_SECONDS.observe(seconds, stage=stage)
+
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    return Response(metrics_exporter.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # --- API Endpoints ---
 # THAY ĐỔI 2: Thêm tiền tố /api vào tất cả các route để nhất quán
 @app.route('/api/save_drive_token', methods=['POST'])
@@ -112,11 +708,14 @@ def save_drive_token(current_user):
         return jsonify({'error': 'Missing access token'}), 400
 
     try:
-        current_user.drive_access_token = token
+        user = User.query.get(current_user.id)
+        user.drive_access_token = token
+        user.drive_token_expires_at = drive_token_expiry(data.get('expires_in'))
         if refresh_token:
-            current_user.drive_refresh_token = refresh_token
+            user.drive_refresh_token = refresh_token
             
         db.session.commit()
+        drive_tokens.set(current_user.id, token, data.get('expires_in'))
         print_to_stderr(f"Lưu Access Token Drive thành công cho user: {current_user.email}. Refresh token provided: {bool(refresh_token)}")
         return jsonify({'message': 'Drive token saved successfully'}), 200
     except Exception as e:
@@ -124,6 +723,118 @@ def save_drive_token(current_user):
         db.session.rollback()
         return jsonify({'error': 'Failed to save drive token'}), 500
 
+# --- Token Google Drive phía server ---
+def drive_token_expiry(expires_in):
+    try:
+        return datetime.datetime.utcnow() + datetime.timedelta(seconds=int(expires_in)) if expires_in else None
+    except (TypeError, ValueError):
+        return None
+
+# Đọc/ghi token bằng kết nối riêng thay vì db.session: token có thể được làm mới từ
+# luồng nền không có app context (như luồng gom batch di chuyển file).
+def _load_drive_token(user_id):
+    with db.get_engine(app).connect() as conn:
+        row = conn.execute(select(User.drive_access_token, User.drive_refresh_token, User.drive_token_expires_at)
+                           .where(User.id == user_id)).first()
+    if row is None:
+        return None, None, None
+    expires_at = row[2].replace(tzinfo=datetime.timezone.utc).timestamp() if row[2] else None
+    return row[0], row[1], expires_at
+
+def _save_drive_token(user_id, access_token, expires_at):
+    expires = datetime.datetime.utcfromtimestamp(expires_at) if expires_at else None
+    with db.get_engine(app).begin() as conn:
+        conn.execute(User.__table__.update().where(User.id == user_id).values(
+            drive_access_token=access_token, drive_token_expires_at=expires))
+
+def _drive_credentials():
+    if has_app_context():
+        return get_cached_settings()['client_id'], GOOGLE_CLIENT_SECRET
+    with db.get_engine(app).connect() as conn:
+        return conn.execute(select(Setting.client_id).limit(1)).scalar(), GOOGLE_CLIENT_SECRET
+
+drive_tokens = drive_auth.DriveTokenManager(_load_drive_token, _save_drive_token, _drive_credentials, http=drive_http)
+
+def user_drive_token(user_id, fallback=None):
+    # Access token Drive còn hạn của người dùng (tự làm mới nếu sắp hết hạn). fallback là
+    # token trình duyệt gửi kèm request, chỉ dùng khi server không có token nào dùng được.
+    try:
+        return drive_tokens.get(user_id)
+    except drive_auth.DriveAuthError:
+        if fallback:
+            return fallback
+        raise
+
+def save_user_drive_token(user_id, access_token):
+    # Token trình duyệt gửi kèm job. Bỏ qua nếu server tự làm mới được token của người
+    # dùng này, để token cũ hơn trong trình duyệt không ghi đè token vừa làm mới.
+    user = User.query.get(user_id)
+    if user.drive_access_token == access_token or (user.drive_refresh_token and GOOGLE_CLIENT_SECRET):
+        return
+    user.drive_access_token = access_token
+    user.drive_token_expires_at = None
+    db.session.commit()
+    drive_tokens.set(user_id, access_token)
+
+@app.route('/api/drive/token', methods=['POST'])
+@token_required
+def refresh_drive_token(current_user):
+    # Trình duyệt gặp 401 với token Drive của mình: lấy token mới từ server (làm mới bằng
+    # refresh token nếu có) thay vì bắt người dùng cấp quyền lại giữa chừng.
+    data = request.get_json(silent=True) or {}
+    if data.get('staleToken'):
+        drive_tokens.invalidate(current_user.id, data['staleToken'])
+    try:
+        access_token = drive_tokens.get(current_user.id)
+    except drive_auth.DriveAuthError as e:
+        return jsonify({"error": str(e)}), 401
+    if access_token == data.get('staleToken'):
+        return jsonify({"error": "Token Google Drive hết hạn, hãy cấp quyền lại"}), 401
+    _, _, expires_at = _load_drive_token(current_user.id)
+    return jsonify({"accessToken": access_token,
+                    "expiresIn": int(expires_at - time.time()) if expires_at else None}), 200
+
+@app.route('/api/drive/oauth-code', methods=['POST'])
+@token_required
+def exchange_drive_code(current_user):
+    # Đổi authorization code từ Google Identity Services lấy access + refresh token
+    data = request.get_json(silent=True) or {}
+    client_id, client_secret = _drive_credentials()
+    if not data.get('code'):
+        return jsonify({"error": "Thiếu code"}), 400
+    if not client_id or not client_secret:
+        return jsonify({"error": "Server chưa cấu hình GOOGLE_CLIENT_SECRET"}), 400
+    try:
+        tokens = drive_auth.exchange_code(data['code'], client_id, client_secret, http=drive_http)
+    except drive_auth.DriveAuthError as e:
+        print_to_stderr(f"LỖI đổi authorization code Drive cho user {current_user.email}: {e}")
+        return jsonify({"error": str(e)}), 400
+    user = User.query.get(current_user.id)
+    user.drive_access_token = tokens['access_token']
+    user.drive_token_expires_at = drive_token_expiry(tokens.get('expires_in'))
+    if tokens.get('refresh_token'):
+        user.drive_refresh_token = tokens['refresh_token']
+    db.session.commit()
+    drive_tokens.set(current_user.id, tokens['access_token'], tokens.get('expires_in'))
+    print_to_stderr(f"Lưu token Drive (authorization code) cho user: {current_user.email}. "
+                    f"Refresh token provided: {bool(tokens.get('refresh_token'))}")
+    return jsonify({"accessToken": tokens['access_token'], "expiresIn": tokens.get('expires_in')}), 200
+
+def get_cached_settings():
+    revision, _ = poll_revision(settings_revision_state, SETTINGS_REVISION_ID, SETTINGS_REVISION_CHECK_SECONDS)
+    cached = settings_cache.get('settings')
+    if cached is not None and cached[0] == revision:
+        return cached[1]
+    row = Setting.query.first()
+    settings = {
+        "client_id": row.client_id if row else "",
+        "api_key": row.api_key if row else "",
+        "source_folder_id": row.source_folder_id if row else "",
+        "drive_offline_access": bool(GOOGLE_CLIENT_SECRET),
+    }
+    settings_cache.set('settings', (revision, settings))
+    return settings
+
 @app.route('/api/settings', methods=['GET', 'POST'])
 def handle_settings():
     if request.method == 'POST':
@@ -132,8 +843,8 @@ def handle_settings():
         if not auth_header:
             return jsonify({'error': 'Token is missing for saving settings'}), 401
         try:
-            data = jwt.decode(auth_header, app.config['SECRET_KEY'], algorithms=["HS256"])
-            user = User.query.get(data['user_id'])
+            data = decode_api_token(auth_header)
+            user = get_authenticated_user(data['user_id'])
             if not user or user.role != 'Admin':
                 return jsonify({'error': 'Admin role required to save settings'}), 403
         except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
@@ -148,21 +859,21 @@ def handle_settings():
             settings.client_id = data.get('client_id')
             settings.api_key = data.get('api_key')
             settings.source_folder_id = data.get('source_folder_id')
+        revision = _bump_revision(db.session, SETTINGS_REVISION_ID)
         db.session.commit()
+        settings_revision_state['version'] = max(settings_revision_state['version'], revision)
+        settings_cache.clear()
         return jsonify({"message": "Settings saved successfully"}), 200
 
     if request.method == 'GET':
-        settings = Setting.query.first()
-        if not settings:
-            return jsonify({ "client_id": "", "api_key": "", "source_folder_id": "" }), 200
-        return jsonify({ "client_id": settings.client_id, "api_key": settings.api_key, "source_folder_id": settings.source_folder_id }), 200
+        return jsonify(get_cached_settings()), 200
 
 # --- API Authentication ---
 @app.route('/api/auth/login', methods=['POST'])
+@admission_controlled(login_admission, per='ip')
 def admin_login():
     data = request.get_json()
     print_to_stderr("--- ADMIN LOGIN ATTEMPT ---")
-    print_to_stderr(f"Received data: {data}")
 
     if not data or not data.get('username') or not data.get('password'):
         return jsonify({'error': 'Missing username or password'}), 400
@@ -188,10 +899,7 @@ def admin_login():
         return jsonify({'error': 'Sai tên đăng nhập hoặc mật khẩu.'}), 401
     
     print_to_stderr("DEBUG: Password check successful. Generating token...")
-    token = jwt.encode({
-        'user_id': user.id,
-        'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)
-    }, app.config['SECRET_KEY'], algorithm="HS256")
+    token = issue_api_token(user)
     
     print_to_stderr("DEBUG: Token generated. Login successful.")
     return jsonify({'name': user.name, 'role': user.role, 'apiToken': token})
@@ -205,15 +913,15 @@ def google_login():
         print_to_stderr("ERROR: Missing token in request data.")
         return jsonify({'error': 'Token is missing'}), 400
     
-    settings = Setting.query.first()
-    if not settings or not settings.client_id:
+    settings = get_cached_settings()
+    if not settings.get('client_id'):
         print_to_stderr("ERROR: Client ID is not configured in Settings.")
         return jsonify({'error': 'Google Client ID chưa được cấu hình trên server.'}), 500
     
-    CLIENT_ID = settings.client_id
+    CLIENT_ID = settings['client_id']
     
     try:
-        id_info = id_token.verify_oauth2_token(data['token'], google_requests.Request(), audience=CLIENT_ID)
+        id_info = google_verifier.verify(data['token'], CLIENT_ID)
         
         google_id = id_info.get('sub')
         user_email = id_info.get('email')
@@ -243,16 +951,15 @@ def google_login():
 
         try:
             db.session.commit()
+            # Chỉ đổi tên/google_id, không phải thu hồi: xoá cache của worker này là đủ
+            auth_user_cache.pop(user.id)
             print_to_stderr("User record updated/created successfully in DB.")
         except Exception as db_error:
             db.session.rollback()
             print_to_stderr(f"DB ERROR: Failed to commit user {user_email}: {db_error}")
             return jsonify({'error': f'Lỗi cơ sở dữ liệu khi tạo/cập nhật tài khoản: {str(db_error)}'}), 500
 
-        token = jwt.encode({
-            'user_id': user.id,
-            'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)
-        }, app.config['SECRET_KEY'], algorithm="HS256")
+        token = issue_api_token(user)
         
         print_to_stderr(f"SUCCESS: User {user.id} logged in. Token generated.")
         return jsonify({'name': user.name, 'role': user.role, 'apiToken': token})
@@ -264,7 +971,100 @@ def google_login():
         print_to_stderr(f"UNHANDLED ERROR: Unhandled exception during Google login: {e}")
         return jsonify({'error': 'Lỗi máy chủ không xác định khi đăng nhập Google.'}), 500
 
+# --- Nhật ký thay đổi (đồng bộ delta) ---
+# Mọi thay đổi lịch/user qua ORM được ghi tự động: after_flush gom id các dòng đã thêm,
+# sửa, xoá trong transaction; before_commit tăng bộ đếm version (khoá dòng bộ đếm nên các
+# transaction ghi nhận version theo đúng thứ tự commit) rồi ghi ChangeLog. Ghi hàng loạt
+# (bulk_*) không qua ORM nên phải gọi note_changes.
+CHANGE_LOG_REVISION_ID = 2
+CHANGE_LOG_CHUNK = 500
+
+def _change_tracked():
+    # entity -> (model, các cột client thấy; None là mọi cột)
+    return {
+        'recurring': (RecurringSchedule, None),
+        'one-off': (OneOffSchedule, None),
+        'user': (User, ('email', 'name', 'role', 'google_id')),
+    }
+
+def note_changes(session, entity, ids, deleted=False):
+    pending = session.info.setdefault('pending_changes', {})
+    for entity_id in ids:
+        pending[(entity, entity_id)] = deleted
+
+@event.listens_for(db.session, 'after_flush')
+def collect_changes(session, flush_context):
+    tracked = _change_tracked()
+    for entity, (model, fields) in tracked.items():
+        for obj in session.new:
+            if isinstance(obj, model):
+                note_changes(session, entity, [obj.id])
+        for obj in session.dirty:
+            if isinstance(obj, model) and session.is_modified(obj, include_collections=False):
+                state = inspect(obj)
+                if fields is None or any(state.attrs[field].history.has_changes() for field in fields):
+                    note_changes(session, entity, [obj.id])
+        for obj in session.deleted:
+            if isinstance(obj, model):
+                note_changes(session, entity, [obj.id], deleted=True)
+
+@event.listens_for(db.session, 'before_commit')
+def write_change_log(session):
+    # commit() chỉ flush sau before_commit; flush trước để after_flush gom đủ thay đổi
+    session.flush()
+    pending = session.info.pop('pending_changes', None)
+    if not pending:
+        return
+    version = _bump_revision(session, CHANGE_LOG_REVISION_ID)
+    by_entity = {}
+    for (entity, entity_id), deleted in pending.items():
+        by_entity.setdefault(entity, {})[entity_id] = deleted
+    for entity, changes in by_entity.items():
+        ids = list(changes)
+        existing = set()
+        for start in range(0, len(ids), CHANGE_LOG_CHUNK):
+            existing.update(row.entity_id for row in session.query(ChangeLog.entity_id).filter(
+                ChangeLog.entity == entity, ChangeLog.entity_id.in_(ids[start:start + CHANGE_LOG_CHUNK])))
+        rows = [{'entity': entity, 'entity_id': entity_id, 'version': version, 'deleted': deleted}
+                for entity_id, deleted in changes.items()]
+        session.bulk_update_mappings(ChangeLog, [row for row in rows if row['entity_id'] in existing])
+        session.bulk_insert_mappings(ChangeLog, [row for row in rows if row['entity_id'] not in existing])
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_changes(session, previous_transaction):
+    session.info.pop('pending_changes', None)
+
+def change_log_version():
+    return db.session.query(ScheduleRevision.version).filter_by(id=CHANGE_LOG_REVISION_ID).scalar() or 0
+
+def delta_response(entity, serializer, sort_columns, columns):
+    # ?since=<version>: chỉ các dòng thay đổi/bị xoá sau version đó. since=0 (chưa đồng bộ)
+    # hoặc lớn hơn version hiện tại (DB đã bị tạo lại) thì trả toàn bộ với full=true.
+    # columns: các cột client thấy, đọc dạng tuple thay vì object ORM.
+    model = _change_tracked()[entity][0]
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({"error": "since phải là số nguyên"}), 400
+    # Đọc version trước dữ liệu: dòng ghi xen vào giữa sẽ được gửi lại ở lần sau (upsert
+    # theo id nên gửi trùng không sao), không bị bỏ sót
+    version = change_log_version()
+    if since <= 0 or since > version:
+        rows = db.session.query(*columns).order_by(*sort_columns).all()
+        return fast_jsonify({"version": version, "full": True, "upserts": [serializer(r) for r in rows], "deleted": []})
+    changes = ChangeLog.query.filter(ChangeLog.entity == entity, ChangeLog.version > since).all()
+    changed_ids = [c.entity_id for c in changes if not c.deleted]
+    upserts = []
+    for start in range(0, len(changed_ids), CHANGE_LOG_CHUNK):
+        upserts.extend(db.session.query(*columns).filter(model.id.in_(changed_ids[start:start + CHANGE_LOG_CHUNK])))
+    upserts.sort(key=lambda r: tuple(getattr(r, c.key) for c in sort_columns))
+    return fast_jsonify({"version": version, "full": False, "upserts": [serializer(r) for r in upserts],
+                         "deleted": [c.entity_id for c in changes if c.deleted]})
+
 # --- API Quản lý Người dùng (Admin) ---
+# Các cột client thấy: danh sách đọc tuple theo thứ tự này (serialize_user_row) thay vì
+# dựng cả object ORM
+USER_LIST_COLUMNS = (User.id, User.email, User.name, User.role, User.google_id)
+
 def serialize_user(user):
     return {
         'id': user.id,
@@ -274,14 +1074,30 @@ def serialize_user(user):
         'google_id': user.google_id
     }
 
+def serialize_user_row(row):
+    # Như serialize_user, cho tuple theo thứ tự USER_LIST_COLUMNS
+    user_id, email, name, role, google_id = row
+    return {
+        'id': user_id,
+        'email': email,
+        'name': name,
+        'role': role,
+        'google_id': google_id
+    }
+
 @app.route('/api/users', methods=['GET', 'POST'])
 @token_required
 @admin_required
 def handle_users(current_user):
     if request.method == 'GET':
+        if 'since' in request.args:
+            return delta_response('user', serialize_user_row, [User.id], USER_LIST_COLUMNS)
         try:
-            users = User.query.all()
-            return jsonify([serialize_user(u) for u in users]), 200
+            version = change_log_version()
+            users = db.session.query(*USER_LIST_COLUMNS).all()
+            response = fast_jsonify([serialize_user_row(u) for u in users])
+            response.headers['X-Change-Version'] = str(version)
+            return response, 200
         except Exception as e:
             print_to_stderr(f"Error fetching users: {e}")
             return jsonify({'error': 'Could not fetch users'}), 500
@@ -340,7 +1156,11 @@ def delete_user(current_user, user_id):
             
     try:
         db.session.delete(user_to_delete)
+        for model in (DriveFile, DriveFolderWatch, DriveChangeCursor):
+            model.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+        revoke_authenticated_user(user_id)
         db.session.commit()
+        drive_tokens.forget(user_id)
         return jsonify({'message': 'User deleted successfully'}), 200
     except Exception as e:
         print_to_stderr(f"Error deleting user: {e}")
@@ -367,6 +1187,7 @@ def update_user_role(current_user, user_id):
             return jsonify({'error': 'Cannot remove the last admin account'}), 400
 
     user_to_update.role = new_role
+    revoke_authenticated_user(user_id)
     db.session.commit()
     
     return jsonify(serialize_user(user_to_update)), 200
@@ -381,18 +1202,111 @@ def change_password(current_user):
     if not new_password or len(new_password) < 6:
          return jsonify({'error': 'Password must be at least 6 characters'}), 400
 
-    current_user.password_hash = generate_password_hash(new_password, method='pbkdf2:sha256')
+    user = User.query.get(current_user.id)
+    user.password_hash = generate_password_hash(new_password, method='pbkdf2:sha256')
+    user.token_version = (user.token_version or 0) + 1
+    revoke_authenticated_user(current_user.id)
     db.session.commit()
-    return jsonify({'message': 'Password updated successfully'}), 200
+    # Token hiện tại đã bị thu hồi cùng các token cũ; trả token mới cho phiên này
+    return jsonify({'message': 'Password updated successfully', 'apiToken': issue_api_token(user)}), 200
 
 
 # --- Các API được bảo vệ ---
+SCHEDULE_PAGE_MAX = 1000
+
+def parse_schedule_date(value, required=True):
+    if not value:
+        if required:
+            raise ValueError("thiếu ngày")
+        return None
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(str(value))
+    return parsed
+
+def _encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime.date) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_cursor(cursor, columns):
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError("cursor")
+    decoded = []
+    for column, value in zip(columns, values):
+        if isinstance(column.type, db.Date):
+            value = parse_schedule_date(value)
+        decoded.append(value)
+    return decoded
+
+def _keyset_after(columns, values):
+    # (c1, c2, c3) > (v1, v2, v3) viết dạng OR/AND để chạy được trên cả SQLite và Postgres
+    clauses = []
+    for i, column in enumerate(columns):
+        clauses.append(and_(*[columns[j] == values[j] for j in range(i)], column > values[i]))
+    return or_(*clauses)
+
+def list_schedules(kind, model, serializer, columns, sort_columns, range_filter):
+    # GET danh sách lịch: lọc theo ?from=&to=, phân trang keyset (?limit=&after=),
+    # sắp xếp phía server và trả 304 nếu danh sách không đổi (ETag theo ScheduleRevision).
+    # ?since=<version>: chỉ trả phần thay đổi (delta_response). Chỉ đọc các cột trong
+    # columns (tuple, không dựng object ORM); không phân trang thì stream theo khối.
+    if 'since' in request.args:
+        return delta_response(kind, serializer, sort_columns, columns)
+    revision = db.session.query(ScheduleRevision.version).filter_by(id=1).scalar() or 0
+    etag = hashlib.sha1(f"{kind}:{revision}:{request.query_string.decode()}".encode()).hexdigest()[:20]
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    try:
+        date_from = parse_schedule_date(request.args.get('from'), required=False)
+        date_to = parse_schedule_date(request.args.get('to'), required=False)
+        limit = request.args.get('limit', type=int)
+        if limit is not None and not 1 <= limit <= SCHEDULE_PAGE_MAX:
+            raise ValueError("limit")
+        after = request.args.get('after')
+        after_values = _decode_cursor(after, sort_columns) if after else None
+    except (ValueError, TypeError):
+        return jsonify({"error": "Tham số from/to/limit/after không hợp lệ"}), 400
+
+    change_version = change_log_version()
+    query = db.session.query(*columns).filter(*range_filter(date_from, date_to))
+    if after_values:
+        query = query.filter(_keyset_after(sort_columns, after_values))
+    query = query.order_by(*sort_columns)
+    if limit:
+        # Lấy dư một dòng để biết còn trang sau hay không
+        rows = query.limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        response = fast_jsonify([serializer(s) for s in rows])
+        if has_more:
+            last = rows[-1]
+            response.headers['X-Next-Cursor'] = _encode_cursor([getattr(last, c.key) for c in sort_columns])
+    else:
+        rows = query.yield_per(JSON_STREAM_CHUNK)
+        response = Response(stream_with_context(fast_json.iter_array(
+            (serializer(s) for s in rows), JSON_STREAM_CHUNK)), mimetype='application/json')
+    response.headers['X-Change-Version'] = str(change_version)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 @app.route('/api/recurring-schedules', methods=['GET', 'POST'])
 @token_required
 def handle_recurring_schedules(current_user):
     if request.method == 'GET':
-        schedules = RecurringSchedule.query.all()
-        return jsonify([serialize_recurring(s) for s in schedules]), 200
+        # Lịch định kỳ còn hiệu lực trong khoảng [from, to]: chưa hết hạn trước ngày from
+        return list_schedules(
+            'recurring', RecurringSchedule, serialize_recurring_row, RECURRING_LIST_COLUMNS,
+            sort_columns=[RecurringSchedule.school_name, RecurringSchedule.class_name, RecurringSchedule.id],
+            range_filter=lambda date_from, date_to: [or_(
+                RecurringSchedule.expiry_date.is_(None), RecurringSchedule.expiry_date >= date_from
+            )] if date_from else []
+        )
     
     if request.method == 'POST':
         data = request.get_json()
@@ -400,11 +1314,20 @@ def handle_recurring_schedules(current_user):
             new_schedule = RecurringSchedule(
                 school_name=data['schoolName'], class_name=data['className'],
                 days_of_week=data['daysOfWeek'], start_time=data['startTime'],
-                end_time=data['endTime'], expiry_date=data.get('expiryDate')
+                end_time=data['endTime'], expiry_date=parse_schedule_date(data.get('expiryDate'), required=False)
             )
+            conflict_response = check_schedule_conflicts('recurring', serialize_recurring(new_schedule), data)
+            if conflict_response:
+                return conflict_response
             db.session.add(new_schedule)
+            revision = bump_schedule_revision()
             db.session.commit()
-            return jsonify(serialize_recurring(new_schedule)), 201
+            entry = serialize_recurring(new_schedule)
+            refresh_schedule_index(revision, lambda index: index.upsert_recurring(entry))
+            return jsonify(entry), 201
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({"error": f"Ngày không hợp lệ: {str(e)}"}), 400
         except Exception as e:
             db.session.rollback()
             print_to_stderr(f"ERROR adding recurring schedule: {str(e)}")
@@ -419,37 +1342,68 @@ def handle_single_recurring_schedule(current_user, schedule_id):
         
     if request.method == 'PUT':
         data = request.get_json()
+        try:
+            expiry_date = parse_schedule_date(data.get('expiryDate'), required=False)
+        except ValueError as e:
+            return jsonify({"error": f"Ngày không hợp lệ: {str(e)}"}), 400
+        # Kiểm tra trước khi sửa object, để truy vấn dựng chỉ mục không autoflush dữ liệu chưa commit
+        conflict_response = check_schedule_conflicts('recurring', dict(
+            serialize_recurring(schedule), daysOfWeek=data['daysOfWeek'], startTime=data['startTime'],
+            endTime=data['endTime'], expiryDate=expiry_date.isoformat() if expiry_date else None
+        ), data)
+        if conflict_response:
+            return conflict_response
         schedule.school_name = data['schoolName']
         schedule.class_name = data['className']
         schedule.days_of_week = data['daysOfWeek']
         schedule.start_time = data['startTime']
         schedule.end_time = data['endTime']
-        schedule.expiry_date = data.get('expiryDate')
+        schedule.expiry_date = expiry_date
+        revision = bump_schedule_revision()
         db.session.commit()
-        return jsonify(serialize_recurring(schedule)), 200
+        entry = serialize_recurring(schedule)
+        refresh_schedule_index(revision, lambda index: index.upsert_recurring(entry))
+        return jsonify(entry), 200
 
     if request.method == 'DELETE':
         db.session.delete(schedule)
+        revision = bump_schedule_revision()
         db.session.commit()
+        refresh_schedule_index(revision, lambda index: index.remove_recurring(schedule_id))
         return jsonify({"message": "Schedule deleted"}), 200
 
 @app.route('/api/one-off-schedules', methods=['GET', 'POST'])
 @token_required
 def handle_one_off_schedules(current_user):
     if request.method == 'GET':
-        schedules = OneOffSchedule.query.all()
-        return jsonify([serialize_one_off(s) for s in schedules]), 200
+        return list_schedules(
+            'one-off', OneOffSchedule, serialize_one_off_row, ONE_OFF_LIST_COLUMNS,
+            sort_columns=[OneOffSchedule.date, OneOffSchedule.start_time, OneOffSchedule.id],
+            range_filter=lambda date_from, date_to: (
+                ([OneOffSchedule.date >= date_from] if date_from else []) +
+                ([OneOffSchedule.date <= date_to] if date_to else [])
+            )
+        )
     
     if request.method == 'POST':
         data = request.get_json()
         try:
             new_schedule = OneOffSchedule(
                 school_name=data['schoolName'], class_name=data['className'],
-                date=data['date'], start_time=data['startTime'], end_time=data['endTime']
+                date=parse_schedule_date(data.get('date')), start_time=data['startTime'], end_time=data['endTime']
             )
+            conflict_response = check_schedule_conflicts('one-off', serialize_one_off(new_schedule), data)
+            if conflict_response:
+                return conflict_response
             db.session.add(new_schedule)
+            revision = bump_schedule_revision()
             db.session.commit()
-            return jsonify(serialize_one_off(new_schedule)), 201
+            entry = serialize_one_off(new_schedule)
+            refresh_schedule_index(revision, lambda index: index.upsert_one_off(entry))
+            return jsonify(entry), 201
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({"error": f"Ngày không hợp lệ: {str(e)}"}), 400
         except Exception as e:
             db.session.rollback()
             print_to_stderr(f"ERROR adding one-off schedule: {str(e)}")
@@ -464,60 +1418,1600 @@ def handle_single_one_off_schedule(current_user, schedule_id):
         
     if request.method == 'PUT':
         data = request.get_json()
+        try:
+            date = parse_schedule_date(data.get('date'))
+        except ValueError as e:
+            return jsonify({"error": f"Ngày không hợp lệ: {str(e)}"}), 400
+        conflict_response = check_schedule_conflicts('one-off', dict(
+            serialize_one_off(schedule), date=date.isoformat(), startTime=data['startTime'], endTime=data['endTime']
+        ), data)
+        if conflict_response:
+            return conflict_response
         schedule.school_name = data['schoolName']
         schedule.class_name = data['className']
-        schedule.date = data['date']
+        schedule.date = date
         schedule.start_time = data['startTime']
         schedule.end_time = data['endTime']
+        revision = bump_schedule_revision()
         db.session.commit()
-        return jsonify(serialize_one_off(schedule)), 200
+        entry = serialize_one_off(schedule)
+        refresh_schedule_index(revision, lambda index: index.upsert_one_off(entry))
+        return jsonify(entry), 200
 
     if request.method == 'DELETE':
         db.session.delete(schedule)
+        revision = bump_schedule_revision()
         db.session.commit()
+        refresh_schedule_index(revision, lambda index: index.remove_one_off(schedule_id))
         return jsonify({"message": "Schedule deleted"}), 200
 
+# --- Nhập lịch học hàng loạt ---
+def _import_index_entry(schedule_type, entry_id, row_number, mapping):
+    # Dòng nhập theo dạng entry của ScheduleIndex; dòng thêm mới chưa có id nên dùng -số dòng
+    entry = {"id": entry_id or -row_number, "row": row_number, "schoolName": mapping['school_name'],
+             "className": mapping['class_name'], "startTime": mapping['start_time'], "endTime": mapping['end_time']}
+    if schedule_type == 'recurring':
+        entry["daysOfWeek"] = mapping['days_of_week']
+        entry["expiryDate"] = mapping['expiry_date'].isoformat() if mapping['expiry_date'] else None
+    else:
+        entry["date"] = mapping['date'].isoformat()
+    return entry
+
+def _import_conflicts(schedule_type, batch):
+    # batch: entry của các dòng hợp lệ. So mỗi dòng với lịch đang có (trừ các lịch chính
+    # dòng khác trong lô sẽ ghi đè) và với các dòng khác trong lô. Trả về {số dòng: [...]}.
+    as_of = local_today()
+    replaced_ids = {entry['id'] for entry in batch if entry['id'] > 0}
+    batch_index = ScheduleIndex()
+    if schedule_type == 'recurring':
+        batch_index.rebuild(batch, [])
+    else:
+        batch_index.rebuild([], batch)
+
+    def describe(other, when):
+        conflict = dict(_conflict_entry(other), **_conflict_when(when))
+        if 'row' in other:
+            conflict['row'] = other['row']
+            if other['id'] < 0:
+                conflict['id'] = None
+        return conflict
+
+    found = {}
+    with schedule_index_lock:
+        index = ensure_schedule_index()
+        for entry in batch:
+            conflicts = [describe(other, when) for other, when in index.find_conflicts(schedule_type, entry, as_of)
+                         if other['id'] not in replaced_ids]
+            conflicts.extend(describe(other, when) for other, when in batch_index.find_conflicts(schedule_type, entry, as_of))
+            if conflicts:
+                found[entry['row']] = conflicts
+    return found
+
+def _read_import_payload():
+    # Nhận JSON {"type": ..., "rows": [...]} (hoặc mảng rows), file CSV tải lên
+    # dưới tên 'file', hoặc nội dung CSV gửi thẳng với Content-Type text/csv.
+    schedule_type = request.args.get('type')
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            schedule_type = schedule_type or data.get('type')
+            rows = data.get('rows')
+        else:
+            rows = data
+        if not isinstance(rows, list):
+            raise ValueError("Thiếu danh sách rows")
+        return schedule_type, rows
+    if 'file' in request.files:
+        text_data = request.files['file'].read().decode('utf-8-sig')
+    else:
+        text_data = request.get_data(as_text=True)
+    if not text_data.strip():
+        raise ValueError("Không có dữ liệu để nhập")
+    return schedule_type, schedule_import.read_csv_rows(text_data)
+
+@app.route('/api/schedules/import', methods=['POST'])
+@token_required
+def import_schedules(current_user):
+    started = time.perf_counter()
+    try:
+        schedule_type, rows = _read_import_payload()
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        return jsonify({"error": f"Dữ liệu nhập không hợp lệ: {str(e)}"}), 400
+    if schedule_type not in schedule_import.SCHEDULE_TYPES:
+        return jsonify({"error": "type phải là 'recurring' hoặc 'one-off'"}), 400
+    if len(rows) > SCHEDULE_IMPORT_LIMIT:
+        return jsonify({"error": f"Tối đa {SCHEDULE_IMPORT_LIMIT} dòng mỗi lần nhập"}), 400
+    dry_run = request.args.get('dryRun') == 'true'
+    allow_conflicts = request.args.get('allowConflicts') == 'true'
+
+    if schedule_type == 'recurring':
+        model = RecurringSchedule
+        key_columns = [RecurringSchedule.id, RecurringSchedule.school_name, RecurringSchedule.class_name,
+                       RecurringSchedule.start_time, RecurringSchedule.end_time, RecurringSchedule.days_of_week]
+    else:
+        model = OneOffSchedule
+        key_columns = [OneOffSchedule.id, OneOffSchedule.school_name, OneOffSchedule.class_name,
+                       OneOffSchedule.date, OneOffSchedule.start_time]
+
+    # Một truy vấn lấy khoá của toàn bộ lịch hiện có để quyết định thêm mới hay cập nhật
+    existing_ids = set()
+    existing_by_key = {}
+    for existing in db.session.query(*key_columns):
+        existing_ids.add(existing.id)
+        existing_by_key[schedule_import.natural_key(schedule_type, existing._asdict())] = existing.id
+
+    report, inserts, updates, batch = [], [], [], []
+    seen_ids, seen_keys = {}, {}
+    for row_number, raw in enumerate(rows, start=1):
+        mapping, errors = schedule_import.validate_row(schedule_type, raw)
+        entry = {"row": row_number}
+        if not errors:
+            key = schedule_import.natural_key(schedule_type, mapping)
+            target_id = mapping.get('id') or existing_by_key.get(key)
+            if 'id' in mapping and mapping['id'] not in existing_ids:
+                errors.append(f"Không tìm thấy lịch có id {mapping['id']}")
+            elif target_id in seen_ids:
+                errors.append(f"Trùng với dòng {seen_ids[target_id]}")
+            elif key in seen_keys:
+                errors.append(f"Trùng với dòng {seen_keys[key]}")
+            else:
+                seen_keys[key] = row_number
+                if target_id:
+                    seen_ids[target_id] = row_number
+                    mapping['id'] = target_id
+                    updates.append(mapping)
+                    entry.update(status='updated', id=target_id)
+                else:
+                    inserts.append(mapping)
+                    entry['status'] = 'created'
+                batch.append(_import_index_entry(schedule_type, target_id, row_number, mapping))
+        if errors:
+            entry.update(status='error', errors=errors)
+        report.append(entry)
+
+    # Kiểm tra trùng giờ như khi thêm/sửa từng lịch: có dòng trùng thì không ghi (409),
+    # trừ khi gửi kèm ?allowConflicts=true
+    conflicts = _import_conflicts(schedule_type, batch) if batch else {}
+    for entry in report:
+        if entry['row'] in conflicts:
+            entry['conflicts'] = conflicts[entry['row']]
+    blocked = bool(conflicts) and not allow_conflicts
+
+    error_count = sum(1 for entry in report if entry['status'] == 'error')
+    summary = {"rows": len(rows), "created": len(inserts), "updated": len(updates), "errors": error_count,
+               "conflicts": len(conflicts), "dryRun": dry_run}
+
+    # Chỉ ghi khi mọi dòng đều hợp lệ, và ghi tất cả trong một transaction
+    if not error_count and not blocked and not dry_run and (inserts or updates):
+        try:
+            # bulk_* không qua ORM nên tự ghi nhật ký thay đổi; id mới lấy theo id lớn nhất
+            # trước khi thêm (tăng bộ đếm trước để khoá dòng bộ đếm, không ai chèn xen vào)
+            bump_schedule_revision()
+            if inserts:
+                max_id = db.session.query(db.func.max(model.id)).scalar() or 0
+                db.session.bulk_insert_mappings(model, inserts)
+                note_changes(db.session, schedule_type,
+                             [row.id for row in db.session.query(model.id).filter(model.id > max_id)])
+            if updates:
+                db.session.bulk_update_mappings(model, updates)
+                note_changes(db.session, schedule_type, [mapping['id'] for mapping in updates])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print_to_stderr(f"ERROR importing {schedule_type} schedules: {str(e)}")
+            return jsonify({"error": "Lỗi máy chủ: Không thể nhập lịch."}), 500
+
+    elapsed = time.perf_counter() - started
+    summary["elapsedMs"] = round(elapsed * 1000, 1)
+    summary["rowsPerSecond"] = round(len(rows) / elapsed) if elapsed > 0 else None
+    status = 400 if error_count else 409 if blocked else 200
+    return jsonify({"summary": summary, "rows": report}), status
+
+# --- Tra cứu lịch học (schedule matching) ---
+def _bump_revision(session, revision_id):
+    updated = session.query(ScheduleRevision).filter_by(id=revision_id).update(
+        {ScheduleRevision.version: ScheduleRevision.version + 1}, synchronize_session=False)
+    if not updated:
+        session.add(ScheduleRevision(id=revision_id, version=1))
+        session.flush()
+    return session.query(ScheduleRevision.version).filter_by(id=revision_id).scalar()
+
+def bump_schedule_revision():
+    # Gọi trước commit để bộ đếm tăng trong cùng transaction với thao tác ghi lịch
+    revision = _bump_revision(db.session, 1)
+    # Khoá cache lịch đã chứa revision nên bản cũ không còn được dùng; xoá để giải phóng bộ nhớ
+    calendar_cache.clear()
+    return revision
+
+def refresh_schedule_index(revision, apply_change):
+    # Chỉ cập nhật từng phần nếu chỉ mục đang ở đúng phiên bản liền trước;
+    # nếu không (worker khác đã ghi xen vào) thì để lần tra cứu sau dựng lại toàn bộ.
+    with schedule_index_lock:
+        if schedule_index.revision == revision - 1:
+            apply_change(schedule_index)
+            schedule_index.revision = revision
+
+def ensure_schedule_index():
+    # Gọi khi đang giữ schedule_index_lock
+    revision = db.session.query(ScheduleRevision.version).filter_by(id=1).scalar() or 0
+    if schedule_index.revision != revision:
+        schedule_index.rebuild(
+            [serialize_recurring_row(s) for s in db.session.query(*RECURRING_LIST_COLUMNS).order_by(RecurringSchedule.id)],
+            [serialize_one_off_row(s) for s in db.session.query(*ONE_OFF_LIST_COLUMNS).order_by(OneOffSchedule.id)],
+            revision=revision
+        )
+    return schedule_index
+
+def local_today():
+    return (datetime.datetime.utcnow() + datetime.timedelta(minutes=APP_UTC_OFFSET_MINUTES)).date()
+
+def _conflict_when(when):
+    # Lịch định kỳ trùng theo thứ trong tuần, lịch đột xuất trùng theo ngày
+    return {"dayOfWeek": when} if isinstance(when, int) else {"date": when.isoformat()}
+
+def _conflict_entry(entry):
+    return {"id": entry['id'], "schoolName": entry['schoolName'], "className": entry['className'],
+            "startTime": entry['startTime'], "endTime": entry['endTime']}
+
+def check_schedule_conflicts(schedule_type, entry, data):
+    # Trả về response 409 nếu lịch sắp ghi trùng giờ với lịch cùng loại đang có.
+    # Client gửi lại kèm "allowConflicts": true để vẫn lưu.
+    if data.get('allowConflicts'):
+        return None
+    with schedule_index_lock:
+        conflicts = ensure_schedule_index().find_conflicts(schedule_type, entry, local_today())
+    if not conflicts:
+        return None
+    return jsonify({
+        "error": "Lịch bị trùng giờ với lịch khác",
+        "conflicts": [dict(_conflict_entry(other), **_conflict_when(when)) for other, when in conflicts],
+    }), 409
+
+@app.route('/api/schedules/conflicts', methods=['GET'])
+@token_required
+def schedule_conflicts(current_user):
+    # Rà toàn bộ bảng lịch tìm các cặp trùng giờ (sweep-line theo từng thứ/ngày).
+    # ?asOf=YYYY-MM-DD: lịch định kỳ hết hạn trước ngày này được bỏ qua (mặc định hôm nay).
+    try:
+        as_of = parse_schedule_date(request.args.get('asOf'), required=False) or local_today()
+        limit = request.args.get('limit', default=SCHEDULE_CONFLICT_LIMIT, type=int)
+        if not 1 <= limit <= SCHEDULE_CONFLICT_LIMIT:
+            raise ValueError("limit")
+    except ValueError:
+        return jsonify({"error": "Tham số asOf/limit không hợp lệ"}), 400
+
+    started = time.perf_counter()
+    with schedule_index_lock:
+        index = ensure_schedule_index()
+        found = index.conflicts(as_of, limit=limit)
+        revision = index.revision
+    elapsed = time.perf_counter() - started
+
+    result = {"asOf": as_of.isoformat(), "revision": revision, "elapsedMs": round(elapsed * 1000, 1)}
+    for kind, (total, pairs) in found.items():
+        result[kind] = {
+            "total": total,
+            "truncated": total > len(pairs),
+            "conflicts": [dict(_conflict_when(when), a=_conflict_entry(a.entry), b=_conflict_entry(b.entry))
+                          for when, a, b in pairs],
+        }
+    return jsonify(result), 200
+
+@app.route('/api/schedules/match', methods=['POST'])
+@token_required
+def match_schedules(current_user):
+    data = request.get_json()
+    if not data or not isinstance(data.get('timestamps'), list):
+        return jsonify({"error": "Thiếu danh sách timestamps"}), 400
+    if len(data['timestamps']) > SCHEDULE_MATCH_LIMIT:
+        return jsonify({"error": f"Tối đa {SCHEDULE_MATCH_LIMIT} thời điểm mỗi lần"}), 400
+    try:
+        utc_offset = int(data.get('utcOffsetMinutes', APP_UTC_OFFSET_MINUTES))
+    except (TypeError, ValueError):
+        return jsonify({"error": "utcOffsetMinutes không hợp lệ"}), 400
+
+    moments = [parse_timestamp(value, utc_offset) for value in data['timestamps']]
+    matches = []
+    with schedule_index_lock:
+        index = ensure_schedule_index()
+        for moment in moments:
+            if moment is None:
+                matches.append({"error": "Invalid timestamp"})
+                continue
+            kind, entry = index.match(moment)
+            matches.append(dict(entry, type=kind) if entry else None)
+        revision = index.revision
+    return jsonify({"matches": matches, "revision": revision}), 200
+
+@app.route('/api/schedules/calendar', methods=['GET'])
+@token_required
+def schedule_calendar(current_user):
+    # Các buổi học trong khoảng ?from=&to= đã bung sẵn và gom theo ngày cho trang lịch.
+    # Kết quả dùng chung cho mọi user và chỉ tính lại khi lịch thay đổi (revision tăng).
+    try:
+        date_from = parse_schedule_date(request.args.get('from'))
+        date_to = parse_schedule_date(request.args.get('to'))
+    except ValueError:
+        return jsonify({"error": "Tham số from/to không hợp lệ (YYYY-MM-DD)"}), 400
+    if date_to < date_from or (date_to - date_from).days >= CALENDAR_MAX_DAYS:
+        return jsonify({"error": f"Khoảng ngày phải từ 1 đến {CALENDAR_MAX_DAYS} ngày"}), 400
+
+    revision = db.session.query(ScheduleRevision.version).filter_by(id=1).scalar() or 0
+    etag = f"calendar-{revision}-{date_from.isoformat()}-{date_to.isoformat()}"
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        body = calendar_cache.get((date_from, date_to, revision))
+        if body is None:
+            with schedule_index_lock:
+                index = ensure_schedule_index()
+                days = index.occurrences(date_from, date_to)
+                revision = index.revision
+            body = fast_json.dumps({
+                "from": date_from.isoformat(), "to": date_to.isoformat(), "revision": revision,
+                "days": {day.isoformat(): [dict(entry, type=kind) for kind, entry in items] for day, items in days},
+            })
+            calendar_cache.set((date_from, date_to, revision), body)
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+# --- Lọc ảnh gần trùng (perceptual hash) ---
+def load_photo_hash_index(folder_id, algorithm):
+    # Gọi khi đang giữ photo_hash_lock. Chỉ nạp các bản ghi mới hơn lần nạp trước,
+    # nên hash do worker khác ghi vào cũng được thấy mà không phải dựng lại chỉ mục.
+    index = photo_hash_indexes.get((folder_id, algorithm))
+    if index is None:
+        index = hash_index.MultiIndexHash()
+        photo_hash_indexes.set((folder_id, algorithm), index)
+    rows = db.session.query(PhotoHash.id, PhotoHash.file_id, PhotoHash.hash).filter(
+        PhotoHash.folder_id == folder_id, PhotoHash.algorithm == algorithm, PhotoHash.id > index.loaded_row_id
+    ).order_by(PhotoHash.id)
+    for row in rows:
+        index.add(hash_index.from_signed(row.hash), row.file_id)
+        index.loaded_row_id = row.id
+    return index
+
+def _save_photo_hashes(new_rows):
+    try:
+        db.session.bulk_insert_mappings(PhotoHash, new_rows)
+        db.session.commit()
+    except Exception:
+        # Worker khác vừa ghi cùng file: ghi lại từng dòng, bỏ qua dòng đã tồn tại
+        db.session.rollback()
+        for row in new_rows:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(PhotoHash(**row))
+            except Exception:
+                pass
+        db.session.commit()
+
+def match_photo_hashes(folder_id, algorithm, items, threshold, insert=True):
+    # items: [{fileId, hash}], mọi hash cùng thuật toán algorithm. Dùng chung cho
+    # /api/photo-hashes/query và job sắp xếp.
+    results = []
+    new_rows = []
+    with photo_hash_lock:
+        index = load_photo_hash_index(folder_id, algorithm)
+        # Hash mới của lô này nằm riêng trong `pending` cho tới khi ghi DB xong: nếu ghi
+        # lỗi, chỉ mục của thư mục không chứa file chưa được lưu.
+        pending = hash_index.MultiIndexHash()
+        for item in items:
+            file_id = str(item.get('fileId') or '') if isinstance(item, dict) else ''
+            try:
+                if not file_id:
+                    raise ValueError("Thiếu fileId")
+                hash_value = hash_index.parse_hash(item.get('hash'))
+            except ValueError as e:
+                results.append({"fileId": file_id or None, "error": str(e)})
+                continue
+
+            match = index.find_nearest(hash_value, threshold, exclude=file_id)
+            pending_match = pending.find_nearest(hash_value, threshold, exclude=file_id)
+            if pending_match and (match is None or pending_match[1] < match[1]):
+                match = pending_match
+            if match:
+                results.append({"fileId": file_id, "duplicate": True, "matchFileId": match[0], "distance": match[1]})
+                continue
+            results.append({"fileId": file_id, "duplicate": False})
+            if insert and file_id not in index and file_id not in pending:
+                pending.add(hash_value, file_id)
+                new_rows.append({"folder_id": folder_id, "algorithm": algorithm, "file_id": file_id,
+                                 "hash": hash_index.to_signed(hash_value),
+                                 "created_at": datetime.datetime.utcnow()})
+        if new_rows:
+            try:
+                _save_photo_hashes(new_rows)
+            except Exception:
+                db.session.rollback()
+                raise
+            # Nạp lại từ DB đúng những dòng đã được ghi (kể cả khi vài dòng bị bỏ qua)
+            load_photo_hash_index(folder_id, algorithm)
+    return results
+
+@app.route('/api/photo-hashes/query', methods=['POST'])
+@token_required
+def query_photo_hashes(current_user):
+    # Với từng hash (theo thứ tự gửi lên): có ảnh nào trong thư mục cách không quá
+    # threshold bit không? Hash không trùng được thêm vào chỉ mục (trừ khi insert=false),
+    # nên các ảnh sau trong cùng lô cũng được so với nó. algorithm cho biết hash được tạo
+    # bằng gì (hash từ /api/image-analysis/batch là hash_index.DCT_PHASH); chỉ so
+    # với hash cùng thuật toán.
+    data = request.get_json()
+    if not data or not data.get('folderId') or not isinstance(data.get('hashes'), list):
+        return jsonify({"error": "Thiếu folderId hoặc hashes"}), 400
+    if data.get('algorithm') not in hash_index.ALGORITHMS:
+        return jsonify({"error": f"algorithm phải là một trong: {', '.join(hash_index.ALGORITHMS)}"}), 400
+    if len(data['hashes']) > PHOTO_HASH_QUERY_LIMIT:
+        return jsonify({"error": f"Tối đa {PHOTO_HASH_QUERY_LIMIT} hash mỗi lần"}), 400
+    try:
+        threshold = int(data.get('threshold', 5))
+    except (TypeError, ValueError):
+        threshold = -1
+    if not 0 <= threshold <= hash_index.HASH_BITS:
+        return jsonify({"error": "threshold không hợp lệ"}), 400
+
+    results = match_photo_hashes(str(data['folderId']), data['algorithm'], data['hashes'], threshold,
+                                 insert=data.get('insert', True) is not False)
+    return jsonify({"results": results}), 200
+
+@app.route('/api/photo-hashes/<folder_id>', methods=['DELETE'])
+@token_required
+def delete_photo_hashes(current_user, folder_id):
+    with photo_hash_lock:
+        try:
+            deleted = PhotoHash.query.filter_by(folder_id=folder_id).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print_to_stderr(f"LỖI DB khi xoá hash của thư mục {folder_id}: {e}")
+            return jsonify({'error': 'Could not delete photo hashes'}), 500
+        for algorithm in hash_index.ALGORITHMS:
+            photo_hash_indexes.pop((folder_id, algorithm))
+    return jsonify({'message': 'Photo hashes deleted', 'deleted': deleted}), 200
+
+# --- Cache metadata video ---
+def _media_cache_key(file_id, checksum, modified_time):
+    return f"{file_id}:{checksum or modified_time}"
+
+def _media_version_matches(entry, checksum, modified_time):
+    # Ưu tiên md5Checksum; file không có checksum thì so modifiedTime
+    if checksum:
+        return entry['checksum'] == checksum
+    if modified_time:
+        return entry['modified_time'] == modified_time
+    return False
+
+def _load_media_metadata_rows(file_ids):
+    # Một truy vấn IN cho cả lô thay vì mỗi file một truy vấn; bỏ qua bản ghi quá hạn
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=MEDIA_METADATA_TTL)
+    rows = {}
+    for i in range(0, len(file_ids), 500):
+        chunk = file_ids[i:i + 500]
+        for row in MediaMetadata.query.filter(MediaMetadata.file_id.in_(chunk), MediaMetadata.updated_at >= cutoff):
+            rows[row.file_id] = {
+                'checksum': row.checksum, 'modified_time': row.modified_time,
+                'creation_time': row.creation_time,
+            }
+    return rows
+
+def _store_media_metadata(result):
+    entry = {
+        'checksum': result.get('checksum'), 'modified_time': result.get('modifiedTime'),
+        'creation_time': result.get('creation_time'),
+    }
+    media_metadata_cache.set(_media_cache_key(result['fileId'], entry['checksum'], entry['modified_time']), entry)
+    try:
+        db.session.merge(MediaMetadata(
+            file_id=result['fileId'], checksum=entry['checksum'], modified_time=entry['modified_time'],
+            creation_time=entry['creation_time'], updated_at=datetime.datetime.utcnow()
+        ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print_to_stderr(f"LỖI DB khi lưu metadata video {result['fileId']}: {e}")
+
+def _lookup_cached_media(file_id, checksum, modified_time, row):
+    if not (checksum or modified_time):
+        return None
+    entry = media_metadata_cache.get(_media_cache_key(file_id, checksum, modified_time))
+    if entry is not None:
+        return entry
+    if row and _media_version_matches(row, checksum, modified_time):
+        media_metadata_counters['db_hits'] += 1
+        media_metadata_cache.set(_media_cache_key(file_id, checksum, modified_time), row)
+        return row
+    return None
+
+def resolve_video_metadata(files, access_token):
+    # Trả về generator các kết quả {fileId, creation_time | error} theo thứ tự xử lý xong.
+    # File đã có trong cache (bộ nhớ hoặc DB) được trả ngay; chỉ file mới hoặc đã
+    # thay đổi mới được đưa vào thread pool để đọc header/ffprobe.
+    rows = _load_media_metadata_rows([f['id'] for f in files])
+    ready = []
+    futures = []
+
+    def probe(file_id, checksum, modified_time, row):
+        try:
+            if not (checksum or modified_time):
+                checksum, modified_time = video_probe.fetch_file_version(file_id, access_token, http=drive_http)
+                cached = _lookup_cached_media(file_id, checksum, modified_time, row)
+                if cached is not None:
+                    return {"fileId": file_id, "creation_time": cached['creation_time']}
+            media_metadata_counters['probes'] += 1
+            creation_time = video_probe.get_creation_time(file_id, access_token, http=drive_http,
+                                                          observe=observe_video_probe)
+            return {"fileId": file_id, "creation_time": creation_time,
+                    "checksum": checksum, "modifiedTime": modified_time}
+        except Exception as e:
+            print_to_stderr(f"LỖI metadata video {file_id}: {e}")
+            return {"fileId": file_id, "error": str(e)}
+
+    for f in files:
+        file_id, checksum, modified_time = f['id'], f.get('md5Checksum'), f.get('modifiedTime')
+        cached = _lookup_cached_media(file_id, checksum, modified_time, rows.get(file_id))
+        if cached is not None:
+            ready.append({"fileId": file_id, "creation_time": cached['creation_time']})
+        else:
+            futures.append(video_metadata_executor.submit(probe, file_id, checksum, modified_time, rows.get(file_id)))
+
+    def generate():
+        try:
+            yield from ready
+            for future in as_completed(futures):
+                result = future.result()
+                if 'error' not in result and (result.get('checksum') or result.get('modifiedTime')):
+                    _store_media_metadata(result)
+                yield {k: v for k, v in result.items() if k in ('fileId', 'creation_time', 'error')}
+        finally:
+            # Client ngắt kết nối giữa chừng: huỷ các file chưa bắt đầu
+            for future in futures:
+                future.cancel()
+
+    return generate()
+
 @app.route('/api/video-metadata', methods=['POST'])
 @token_required
+@admission_controlled(heavy_admission)
 def video_metadata(current_user):
     data = request.get_json()
-    if not data or 'fileId' not in data or 'accessToken' not in data:
-        return jsonify({"error": "Thiếu fileId hoặc accessToken"}), 400
+    if not data or 'fileId' not in data:
+        return jsonify({"error": "Thiếu fileId"}), 400
+    try:
+        access_token = user_drive_token(current_user.id, data.get('accessToken'))
+    except drive_auth.DriveAuthError as e:
+        return jsonify({"error": str(e)}), 401
+
+    file_info = {'id': data['fileId'], 'md5Checksum': data.get('md5Checksum'), 'modifiedTime': data.get('modifiedTime')}
+    # Chỉ đọc header MP4/MOV bằng Range request; định dạng khác mới tải cả file cho ffprobe.
+    result = next(resolve_video_metadata([file_info], access_token))
+    if 'error' in result:
+        print_to_stderr(f"LỖI ffprobe: {result['error']}")
+        return jsonify({"error": result['error']}), 500
+    return jsonify({"creation_time": result['creation_time']}), 200
 
-    file_id = data['fileId']
-    access_token = data['accessToken']
-    temp_video_path = ""
+@app.route('/api/video-metadata/batch', methods=['POST'])
+@token_required
+@admission_controlled(heavy_admission)
+def video_metadata_batch(current_user):
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "Thiếu fileIds"}), 400
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".tmp") as tmp:
-            temp_video_path = tmp.name
+        access_token = user_drive_token(current_user.id, data.get('accessToken'))
+    except drive_auth.DriveAuthError as e:
+        return jsonify({"error": str(e)}), 401
+
+    # Nhận danh sách files [{id, md5Checksum, modifiedTime}] hoặc chỉ fileIds
+    if isinstance(data.get('files'), list):
+        files = [f for f in data['files'] if isinstance(f, dict) and f.get('id')]
+    elif isinstance(data.get('fileIds'), list):
+        files = [{'id': str(file_id)} for file_id in data['fileIds']]
+    else:
+        return jsonify({"error": "Thiếu fileIds"}), 400
+
+    # Bỏ các file trùng nhưng giữ nguyên thứ tự gửi lên
+    files = list({f['id']: f for f in reversed(files)}.values())[::-1]
+    if len(files) > VIDEO_METADATA_BATCH_LIMIT:
+        return jsonify({"error": f"Tối đa {VIDEO_METADATA_BATCH_LIMIT} video mỗi lần"}), 400
 
-        headers = {'Authorization': f'Bearer {access_token}'}
-        download_url = f"https://www.googleapis.com/drive/v3/files/{file_id}?alt=media"
-        response = requests.get(download_url, headers=headers, stream=True)
+    results = resolve_video_metadata(files, access_token)
+
+    # Trả kết quả dạng NDJSON, mỗi video một dòng ngay khi xử lý xong
+    def generate():
+        for result in results:
+            yield json.dumps(result, ensure_ascii=False) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# --- API Phân tích chất lượng ảnh ---
+def get_image_analysis_pool():
+    global image_analysis_pool
+    with image_analysis_pool_lock:
+        if image_analysis_pool is None:
+            # spawn thay vì fork: tiến trình con không thừa hưởng thread và kết nối DB của worker
+            image_analysis_pool = ProcessPoolExecutor(max_workers=IMAGE_ANALYSIS_PROCESSES,
+                                                      mp_context=multiprocessing.get_context('spawn'))
+        return image_analysis_pool
+
+def discard_image_analysis_pool(pool):
+    # Một tiến trình con chết (hết bộ nhớ, ...) làm hỏng cả pool; lần sau sẽ tạo pool mới
+    global image_analysis_pool
+    with image_analysis_pool_lock:
+        if image_analysis_pool is pool:
+            image_analysis_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def download_drive_image(file_id, access_token):
+    started = time.perf_counter()
+    response = drive_http.get(video_probe.drive_media_url(file_id),
+                              headers={'Authorization': f'Bearer {access_token}'}, stream=True, timeout=60)
+    with response:
         response.raise_for_status()
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(chunk_size=256 * 1024):
+            size += len(chunk)
+            if size > IMAGE_ANALYSIS_MAX_BYTES:
+                raise ValueError(f"Ảnh lớn hơn {IMAGE_ANALYSIS_MAX_BYTES // (1024 * 1024)}MB")
+            chunks.append(chunk)
+    DRIVE_DOWNLOAD_SECONDS.observe(time.perf_counter() - started, kind='image')
+    return b''.join(chunks)
 
-        with open(temp_video_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        
-        command = ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', temp_video_path]
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        metadata = json.loads(result.stdout)
-        creation_time = metadata.get('format', {}).get('tags', {}).get('creation_time')
-        
-        return jsonify({"creation_time": creation_time}), 200
+def analyze_drive_image(file_id, access_token):
+    # Một ảnh, dùng cho job sắp xếp (mỗi worker của job xử lý từng file)
+    data = download_drive_image(file_id, access_token)
+    import image_analysis  # numpy/Pillow chỉ nạp khi cần, worker khởi động nhanh hơn
+    pool = get_image_analysis_pool()
+    try:
+        return pool.submit(image_analysis.analyze_batch, [data]).result()[0]
+    except BrokenProcessPool:
+        discard_image_analysis_pool(pool)
+        raise
+
+def analyze_drive_images(file_ids, access_token):
+    # Trả về generator các kết quả {fileId, hash, sharpness, brightness, contrast | error}
+    # theo thứ tự xử lý xong. Ảnh tải xong được gom thành lô IMAGE_ANALYSIS_CHUNK ảnh
+    # rồi gửi sang process pool, trong khi các ảnh khác vẫn đang được tải.
+    import image_analysis
+    downloads = {image_download_executor.submit(download_drive_image, file_id, access_token): file_id
+                 for file_id in file_ids}
+    pool = get_image_analysis_pool()
+    analyses = {}
+
+    def submit_chunk(chunk):
+        ids = [file_id for file_id, _ in chunk]
+        analyses[pool.submit(image_analysis.analyze_batch, [data for _, data in chunk])] = ids
+
+    def collect(future):
+        ids = analyses.pop(future)
+        try:
+            results = future.result()
+        except Exception as e:
+            print_to_stderr(f"LỖI phân tích ảnh: {e}")
+            if isinstance(e, BrokenProcessPool):
+                discard_image_analysis_pool(pool)
+            results = [{"error": str(e)}] * len(ids)
+        for file_id, result in zip(ids, results):
+            yield {"fileId": file_id, **result}
+
+    def generate():
+        chunk = []
+        try:
+            for future in as_completed(downloads):
+                file_id = downloads[future]
+                try:
+                    chunk.append((file_id, future.result()))
+                except Exception as e:
+                    print_to_stderr(f"LỖI tải ảnh {file_id}: {e}")
+                    yield {"fileId": file_id, "error": str(e)}
+                if len(chunk) >= IMAGE_ANALYSIS_CHUNK:
+                    submit_chunk(chunk)
+                    chunk = []
+                for done in [f for f in analyses if f.done()]:
+                    yield from collect(done)
+            if chunk:
+                submit_chunk(chunk)
+            for done in as_completed(list(analyses)):
+                yield from collect(done)
+        finally:
+            # Client ngắt kết nối giữa chừng: huỷ các ảnh chưa bắt đầu
+            for future in list(downloads) + list(analyses):
+                future.cancel()
+
+    return generate()
+
+@app.route('/api/image-analysis/batch', methods=['POST'])
+@token_required
+@admission_controlled(heavy_admission)
+def image_analysis_batch(current_user):
+    data = request.get_json()
+    if not data or not isinstance(data.get('fileIds'), list):
+        return jsonify({"error": "Thiếu fileIds"}), 400
+    try:
+        access_token = user_drive_token(current_user.id, data.get('accessToken'))
+    except drive_auth.DriveAuthError as e:
+        return jsonify({"error": str(e)}), 401
+
+    file_ids = list(dict.fromkeys(str(file_id) for file_id in data['fileIds'] if file_id))
+    if len(file_ids) > IMAGE_ANALYSIS_BATCH_LIMIT:
+        return jsonify({"error": f"Tối đa {IMAGE_ANALYSIS_BATCH_LIMIT} ảnh mỗi lần"}), 400
+
+    results = analyze_drive_images(file_ids, access_token)
+
+    # NDJSON giống /api/video-metadata/batch: mỗi ảnh một dòng ngay khi phân tích xong
+    def generate():
+        for result in results:
+            yield json.dumps(result, ensure_ascii=False) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# --- Chỉ mục file Drive (changes feed) ---
+def _drive_file_values(f):
+    return {
+        "name": (f.get('name') or f['id'])[:500], "mime_type": f.get('mimeType') or '',
+        "created_time": f.get('createdTime'), "modified_time": f.get('modifiedTime'),
+        "exif_time": (f.get('imageMediaMetadata') or {}).get('time'), "md5_checksum": f.get('md5Checksum'),
+        "thumbnail_link": f.get('thumbnailLink'), "parents": f.get('parents') or [],
+    }
+
+def serialize_drive_file(row):
+    # Cùng dạng với object file của Drive API để frontend dùng lại code cũ
+    data = {
+        "id": row.file_id, "name": row.name, "mimeType": row.mime_type, "createdTime": row.created_time,
+        "modifiedTime": row.modified_time, "md5Checksum": row.md5_checksum,
+        "thumbnailLink": row.thumbnail_link, "parents": row.parents or [],
+    }
+    if row.exif_time:
+        data["imageMediaMetadata"] = {"time": row.exif_time}
+    return data
+
+def apply_drive_changes(user_id, changes):
+    # Áp các thay đổi vào những thư mục người dùng đang theo dõi: thêm/cập nhật file có
+    # cha là thư mục đó, xoá file đã bị chuyển đi, xoá vĩnh viễn hoặc vào thùng rác.
+    watched = {folder_id for folder_id, in db.session.query(DriveFolderWatch.folder_id).filter(
+        DriveFolderWatch.user_id == user_id, DriveFolderWatch.listed_at.isnot(None))}
+    latest = {c['fileId']: c for c in changes if c.get('fileId')}
+    if not watched or not latest:
+        return 0
+    file_ids = list(latest)
+    existing = {}
+    for start in range(0, len(file_ids), 500):
+        for row in DriveFile.query.filter(DriveFile.user_id == user_id,
+                                          DriveFile.file_id.in_(file_ids[start:start + 500])):
+            if row.folder_id in watched:
+                existing.setdefault(row.file_id, {})[row.folder_id] = row
+    applied = 0
+    for file_id, change in latest.items():
+        f = change.get('file') or {}
+        gone = change.get('removed') or f.get('trashed')
+        if gone and file_id in watched:
+            # Chính thư mục đang theo dõi bị xoá (với người dùng này): bỏ chỉ mục của nó
+            DriveFile.query.filter_by(user_id=user_id, folder_id=file_id).delete(synchronize_session=False)
+            DriveFolderWatch.query.filter_by(user_id=user_id, folder_id=file_id).delete(synchronize_session=False)
+        keep = set()
+        if not gone and drive_client.is_indexed_type(f.get('mimeType')):
+            keep = set(f.get('parents') or []) & watched
+        rows = existing.get(file_id, {})
+        for folder_id in keep:
+            values = _drive_file_values(dict(f, id=file_id))
+            row = rows.pop(folder_id, None)
+            if row is None:
+                db.session.add(DriveFile(user_id=user_id, folder_id=folder_id, file_id=file_id, **values))
+            else:
+                for key, value in values.items():
+                    setattr(row, key, value)
+            applied += 1
+        for row in rows.values():
+            db.session.delete(row)
+            applied += 1
+    return applied
+
+def pull_drive_changes(user_id, access_token, force=False):
+    # Đọc changes feed từ vị trí đã lưu của người dùng và áp vào chỉ mục
+    now = datetime.datetime.utcnow()
+    cursor = DriveChangeCursor.query.get(user_id)
+    if cursor is None:
+        # Lấy vị trí bắt đầu trước khi liệt kê thư mục để không lọt thay đổi xảy ra trong lúc liệt kê
+        page_token = drive_client.get_start_page_token(access_token, http=drive_http)
+        db.session.add(DriveChangeCursor(user_id=user_id, page_token=page_token, synced_at=now))
+        DriveFolderWatch.query.filter_by(user_id=user_id).update(
+            {DriveFolderWatch.listed_at: None}, synchronize_session=False)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # worker khác vừa tạo cursor
+        return
+    if not force and (now - cursor.synced_at).total_seconds() < DRIVE_SYNC_MIN_SECONDS:
+        return
+    old_token = cursor.page_token
+    try:
+        changes, new_token = drive_client.list_changes(old_token, access_token, http=drive_http)
+    except drive_client.DriveError as e:
+        if e.status not in (400, 404, 410):
+            raise
+        # Page token hết hạn: tạo vị trí mới, các thư mục sẽ được liệt kê lại
+        print_to_stderr(f"Page token changes của user {user_id} không còn hợp lệ ({e}), đồng bộ lại từ đầu")
+        DriveChangeCursor.query.filter_by(user_id=user_id, page_token=old_token).delete(synchronize_session=False)
+        db.session.commit()
+        return pull_drive_changes(user_id, access_token)
+    applied = apply_drive_changes(user_id, changes)
+    # Chỉ ghi nếu chưa worker nào khác tiến cursor trong lúc đọc; nếu có thì bỏ kết quả lần này
+    moved = DriveChangeCursor.query.filter_by(user_id=user_id, page_token=old_token).update(
+        {DriveChangeCursor.page_token: new_token, DriveChangeCursor.synced_at: now}, synchronize_session=False)
+    if moved:
+        db.session.commit()
+        if changes:
+            print_to_stderr(f"Drive changes user {user_id}: {len(changes)} thay đổi, {applied} dòng chỉ mục")
+    else:
+        db.session.rollback()
+
+def index_drive_folder(user_id, folder_id, access_token):
+    # Liệt kê lại toàn bộ thư mục (lần đầu mở, hoặc sau khi cursor bị tạo lại)
+    files = drive_client.list_folder(folder_id, access_token, http=drive_http)
+    now = datetime.datetime.utcnow()
+    try:
+        DriveFile.query.filter_by(user_id=user_id, folder_id=folder_id).delete(synchronize_session=False)
+        db.session.bulk_insert_mappings(DriveFile, [
+            dict(_drive_file_values(f), user_id=user_id, folder_id=folder_id, file_id=f['id'])
+            for f in {f['id']: f for f in files}.values()])
+        watch = DriveFolderWatch.query.get((user_id, folder_id))
+        if watch is None:
+            watch = DriveFolderWatch(user_id=user_id, folder_id=folder_id)
+            db.session.add(watch)
+        watch.listed_at = watch.thumbnails_at = now
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # worker khác đang liệt kê cùng thư mục
+
+def refresh_drive_thumbnails(watch, access_token):
+    # Chỉ lấy id + thumbnailLink, nhẹ hơn nhiều so với liệt kê đủ trường
+    files = drive_client.list_folder(watch.folder_id, access_token, http=drive_http, fields='id, thumbnailLink')
+    links = {f['id']: f.get('thumbnailLink') for f in files}
+    for row in DriveFile.query.filter_by(user_id=watch.user_id, folder_id=watch.folder_id):
+        if row.file_id in links and row.thumbnail_link != links[row.file_id]:
+            row.thumbnail_link = links[row.file_id]
+    watch.thumbnails_at = datetime.datetime.utcnow()
+    db.session.commit()
+
+def sync_drive_folder(user_id, folder_id, access_token, force=False, thumbnails=False):
+    # Bảo đảm chỉ mục của folder_id đã cập nhật tới thay đổi mới nhất mà người dùng thấy.
+    # force: đọc changes ngay, bỏ qua DRIVE_SYNC_MIN_SECONDS (job sắp xếp cần số liệu mới nhất).
+    with drive_sync_locks[hash(user_id) % DRIVE_SYNC_LOCK_STRIPES]:
+        pull_drive_changes(user_id, access_token, force=force)
+        watch = DriveFolderWatch.query.get((user_id, folder_id))
+        if watch is None or watch.listed_at is None:
+            index_drive_folder(user_id, folder_id, access_token)
+        elif thumbnails and (watch.thumbnails_at is None or (
+                datetime.datetime.utcnow() - watch.thumbnails_at).total_seconds() > DRIVE_THUMBNAIL_TTL_SECONDS):
+            refresh_drive_thumbnails(watch, access_token)
+
+def indexed_drive_files(user_id, folder_id, kind='all'):
+    query = DriveFile.query.filter_by(user_id=user_id, folder_id=folder_id)
+    if kind == 'media':
+        query = query.filter(DriveFile.mime_type != drive_client.FOLDER_MIME_TYPE)
+    elif kind == 'folders':
+        query = query.filter(DriveFile.mime_type == drive_client.FOLDER_MIME_TYPE)
+    return query.order_by(DriveFile.name, DriveFile.file_id).all()
+
+@app.route('/api/drive/folders/<folder_id>/files', methods=['GET'])
+@token_required
+def drive_folder_files(current_user, folder_id):
+    # Ảnh/video và thư mục con của một thư mục Drive, đọc từ chỉ mục trong DB thay vì gọi
+    # files.list mỗi lần. ?type=all|media|folders, ?refresh=1 để đọc changes ngay.
+    kind = request.args.get('type', 'all')
+    if kind not in ('all', 'media', 'folders'):
+        return jsonify({"error": "type phải là all, media hoặc folders"}), 400
+    try:
+        sync_drive_folder(current_user.id, folder_id, drive_auth.UserToken(drive_tokens, current_user.id),
+                          force=request.args.get('refresh') in ('1', 'true'), thumbnails=kind != 'folders')
+    except drive_client.DriveError as e:
+        db.session.rollback()
+        print_to_stderr(f"LỖI Drive khi đồng bộ thư mục {folder_id}: {e}")
+        return jsonify({"error": str(e)}), 401 if e.status == 401 else 502
+    return jsonify({"folderId": folder_id, "files": [serialize_drive_file(row) for row in indexed_drive_files(current_user.id, folder_id, kind)]}), 200
+
+# --- Di chuyển file Drive hàng loạt ---
+@app.route('/api/drive/move-batch', methods=['POST'])
+@token_required
+def drive_move_batch(current_user):
+    # Di chuyển nhiều file trong một lần gọi, gom thành batch request Drive (100 lệnh mỗi
+    # request). Thư mục đích cho bằng id (toFolderId) hoặc tên + thư mục cha
+    # (folderName, parentFolderId), thư mục chưa có sẽ được tạo.
+    data = request.get_json() or {}
+    moves = data.get('moves')
+    if not isinstance(moves, list):
+        return jsonify({"error": "Thiếu danh sách moves"}), 400
+    if len(moves) > DRIVE_MOVE_BATCH_LIMIT:
+        return jsonify({"error": f"Tối đa {DRIVE_MOVE_BATCH_LIMIT} file mỗi lần"}), 400
+    try:
+        access_token = user_drive_token(current_user.id, data.get('accessToken'))
+    except drive_auth.DriveAuthError as e:
+        return jsonify({"error": str(e)}), 401
+
+    results = []
+    for item in moves:
+        item = item if isinstance(item, dict) else {}
+        file_id, from_id = str(item.get('fileId') or ''), str(item.get('fromFolderId') or '')
+        if not file_id or not from_id:
+            results.append({"fileId": file_id or None, "error": "Thiếu fileId hoặc fromFolderId"})
+        elif item.get('toFolderId'):
+            results.append({"fileId": file_id, "from": from_id, "folderId": str(item['toFolderId'])})
+        elif item.get('folderName') and item.get('parentFolderId'):
+            results.append({"fileId": file_id, "from": from_id,
+                            "folderKey": (str(item['parentFolderId']), str(item['folderName']))})
+        else:
+            results.append({"fileId": file_id, "error": "Thiếu toFolderId hoặc folderName/parentFolderId"})
+
+    try:
+        folder_keys = [r['folderKey'] for r in results if 'folderKey' in r]
+        folders = drive_client.lookup_folders(folder_keys, access_token, http=drive_http) if folder_keys else {}
+        for result in results:
+            key = result.pop('folderKey', None)
+            if key is None:
+                continue
+            if isinstance(folders[key], Exception):
+                result['error'] = f"Không tìm/tạo được thư mục '{key[1]}': {folders[key]}"
+            else:
+                result['folderId'] = folders[key]
+        todo = [r for r in results if 'error' not in r]
+        errors = drive_client.move_files([(r['fileId'], r['from'], r['folderId']) for r in todo],
+                                         access_token, http=drive_http)
+    except drive_client.DriveError as e:
+        print_to_stderr(f"LỖI Drive khi di chuyển hàng loạt: {e}")
+        return jsonify({"error": str(e)}), 401 if e.status == 401 else 502
+
+    for result, error in zip(todo, errors):
+        if error is None:
+            result['ok'] = True
+        else:
+            result['error'] = str(error)
+    for result in results:
+        result.pop('from', None)
+    return jsonify({"results": results, "moved": len(todo) - sum(1 for e in errors if e)}), 200
+
+# --- Job sắp xếp ảnh phía server ---
+ORGANIZE_ACTIVE_STATUSES = ('queued', 'running', 'cancelling')
+ORGANIZE_TIME_FIELDS = ('exifTime', 'createdTime', 'modifiedTime')
+
+def organize_owner():
+    # Tính mỗi lần gọi vì gunicorn nạp app trước rồi mới fork worker
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def organize_lease_cutoff():
+    return datetime.datetime.utcnow() - datetime.timedelta(seconds=ORGANIZE_LEASE_SECONDS)
+
+def parse_organize_options(data):
+    time_field = data.get('timeField', 'exifTime')
+    if time_field not in ORGANIZE_TIME_FIELDS:
+        raise ValueError(f"timeField phải là một trong {', '.join(ORGANIZE_TIME_FIELDS)}")
+    try:
+        threshold = int(data.get('similarityThreshold', 5))
+        workers = int(data.get('workers', ORGANIZE_DEFAULT_WORKERS))
+    except (TypeError, ValueError):
+        raise ValueError("similarityThreshold/workers phải là số nguyên")
+    if not 0 <= threshold <= hash_index.HASH_BITS:
+        raise ValueError("similarityThreshold không hợp lệ")
+    try:
+        min_sharpness = float(data.get('minSharpness', ORGANIZE_MIN_SHARPNESS))
+        min_brightness = float(data.get('minBrightness', ORGANIZE_MIN_BRIGHTNESS))
+    except (TypeError, ValueError):
+        raise ValueError("minSharpness/minBrightness phải là số")
+    if not (min_sharpness >= 0 and 0 <= min_brightness <= 255):
+        raise ValueError("minSharpness/minBrightness không hợp lệ")
+    return {
+        "timeField": time_field,
+        "removeDuplicates": bool(data.get('removeDuplicates', True)),
+        "similarityThreshold": threshold,
+        "filterUnclearSubject": bool(data.get('filterUnclearSubject', True)),
+        "filterDarkFace": bool(data.get('filterDarkFace', True)),
+        "minSharpness": min_sharpness,
+        "minBrightness": min_brightness,
+        "workers": max(1, min(workers, ORGANIZE_MAX_WORKERS)),
+    }
+
+def serialize_organize_job(job, summary=None):
+    return {
+        "id": job.id, "status": job.status, "sourceFolderId": job.source_folder_id,
+        "options": job.options, "total": job.total, "processed": job.processed, "error": job.error,
+        "createdAt": job.created_at.isoformat(), "updatedAt": job.updated_at.isoformat(),
+        "summary": summary if summary is not None else organize_job_summary(job.id),
+    }
+
+def serialize_organize_file(row):
+    return {
+        "seq": row.seq, "fileId": row.file_id, "name": row.name, "mimeType": row.mime_type,
+        "status": row.status, "outcome": row.outcome, "message": row.message,
+        "destinationFolderId": row.destination_folder_id,
+    }
+
+def organize_job_summary(job_id):
+    # Số file theo kết quả (selected, moved, duplicate, ...) của các file đã xử lý
+    rows = db.session.query(OrganizeJobFile.outcome, db.func.count(OrganizeJobFile.id)).filter(
+        OrganizeJobFile.job_id == job_id, OrganizeJobFile.status != 'pending'
+    ).group_by(OrganizeJobFile.outcome)
+    return {outcome: count for outcome, count in rows}
+
+class OrganizeContext:
+    # Trạng thái trong bộ nhớ của một lần chạy job, dùng chung giữa các luồng worker.
+    # Thư mục đích được cache theo (thư mục cha, tên); lệnh di chuyển được gom thành
+    # batch request Drive. Token Drive lấy từ drive_tokens mỗi lần dùng nên job dài hơn
+    # một giờ vẫn chạy tiếp với token đã làm mới.
+    def __init__(self, active, job, token, last_seq):
+        self.active = active
+        self.job_id = job.id
+        self.source_folder_id = job.source_folder_id
+        self.options = job.options
+        self.token = token
+        self.seq = last_seq
+        self.commit_lock = threading.Lock()
+        self.folders = drive_client.FolderCache(token, http=drive_http)
+        self.mover = drive_client.MoveBatcher(token, http=drive_http, linger=ORGANIZE_MOVE_LINGER_SECONDS)
+
+    @property
+    def access_token(self):
+        return self.token()
+
+    def folder(self, name, parent_id):
+        return self.folders.folder(name, parent_id)
+
+def _is_drive_auth_error(error):
+    if isinstance(error, drive_client.DriveError):
+        return error.status == 401
+    response = getattr(error, 'response', None)
+    return isinstance(error, requests.HTTPError) and response is not None and response.status_code == 401
+
+ORGANIZE_AUTH_ERROR = "Token Google Drive hết hạn hoặc bị từ chối, hãy cấp quyền lại rồi chạy tiếp job"
+
+def organize_file_timestamp(ctx, row):
+    # Trả về (thời điểm, nguồn) theo cùng thứ tự ưu tiên với vòng lặp cũ trên trình duyệt
+    meta = row.meta or {}
+    if row.mime_type.startswith('video/'):
+        result = list(resolve_video_metadata([{
+            'id': row.file_id, 'md5Checksum': meta.get('md5Checksum'), 'modifiedTime': meta.get('modifiedTime'),
+        }], ctx.access_token))[0]
+        if result.get('creation_time'):
+            return result['creation_time'], 'Ngày quay (Video)'
+        return meta.get('createdTime'), 'Ngày tạo (Video)'
+    time_field = ctx.options['timeField']
+    if time_field == 'exifTime' and meta.get('exifTime'):
+        return meta['exifTime'], 'Ngày chụp (EXIF)'
+    if time_field == 'modifiedTime' and meta.get('modifiedTime'):
+        return meta['modifiedTime'], 'Ngày chỉnh sửa'
+    return meta.get('createdTime'), 'Ngày tạo'
+
+def organize_folder_name(entry):
+    return f"{entry['schoolName']} - {entry['className']}"
+
+def prefetch_organize_folders(ctx, row_ids):
+    # Tìm/tạo trước thư mục lớp của mọi ảnh đã biết thời điểm (video phải đọc metadata
+    # nên để lúc xử lý) trong vài batch request, thay vì mỗi thư mục hai lần gọi API
+    class_keys, image_keys = set(), set()
+    rows = OrganizeJobFile.query.filter(OrganizeJobFile.id.in_(row_ids),
+                                        ~OrganizeJobFile.mime_type.startswith('video/'))
+    with schedule_index_lock:
+        index = ensure_schedule_index()
+        for row in rows:
+            moment = parse_timestamp(organize_file_timestamp(ctx, row)[0], APP_UTC_OFFSET_MINUTES)
+            entry = index.match(moment)[1] if moment else None
+            if entry:
+                key = (ctx.source_folder_id, organize_folder_name(entry))
+                class_keys.add(key)
+                if row.mime_type.startswith('image/'):
+                    image_keys.add(key)
+    if not class_keys:
+        return
+    try:
+        class_folders = ctx.folders.resolve(class_keys)
+        # 'Selected Items' chỉ tìm sẵn; chưa có thì tạo khi có ảnh đầu tiên được chọn
+        ctx.folders.resolve([(class_folders[key], ORGANIZE_SELECTED_FOLDER) for key in image_keys], create=False)
     except Exception as e:
-        print_to_stderr(f"LỖI ffprobe: {e}")
-        return jsonify({"error": str(e)}), 500
-    finally:
-        if temp_video_path and os.path.exists(temp_video_path):
-            os.remove(temp_video_path)
+        print_to_stderr(f"LỖI job {ctx.job_id} khi tìm trước thư mục đích: {e}")
+
+def classify_organize_file(ctx, row):
+    # Trả về (outcome, message, thư mục đích hoặc None nếu giữ nguyên). Ảnh không đạt
+    # được xếp vào thư mục lớp, ảnh đạt vào thư mục con 'Selected Items'; file không
+    # khớp lịch giữ nguyên.
+    timestamp, source = organize_file_timestamp(ctx, row)
+    moment = parse_timestamp(timestamp, APP_UTC_OFFSET_MINUTES)
+    if moment is None:
+        return 'invalid-time', "Giá trị thời gian không hợp lệ", None
+    when = f"{source}: {moment.strftime('%d/%m/%Y %H:%M:%S')}"
+    with schedule_index_lock:
+        _, entry = ensure_schedule_index().match(moment)
+    if not entry:
+        return 'unmatched', f"{when}, không khớp lịch học", None
+
+    folder_name = organize_folder_name(entry)
+    class_folder_id = ctx.folder(folder_name, ctx.source_folder_id)
+    if not row.mime_type.startswith('image/'):
+        return 'moved', f"{when}, đã phân loại vào '{folder_name}'", class_folder_id
+
+    options = ctx.options
+    analysis = analyze_drive_image(row.file_id, ctx.access_token)
+    if 'error' in analysis:
+        # Không giải mã được (định dạng lạ, HEIC khi chưa cài pillow-heif): không đo được chất
+        # lượng nên không lọc, vẫn chọn ảnh như khi tắt các bộ lọc
+        selected_id = ctx.folder(ORGANIZE_SELECTED_FOLDER, class_folder_id)
+        return 'selected', (f"{when}, đã chọn vào '{folder_name}/{ORGANIZE_SELECTED_FOLDER}' "
+                            f"(không lọc: {analysis['error']})"), selected_id
+    rejected = None
+    if options['removeDuplicates']:
+        result = match_photo_hashes(class_folder_id, hash_index.DCT_PHASH,
+                                    [{'fileId': row.file_id, 'hash': analysis['hash']}],
+                                    options['similarityThreshold'])[0]
+        if result.get('duplicate'):
+            rejected = ('duplicate', f"tương tự ảnh {result['matchFileId']} (khác {result['distance']} bit)")
+    # Job tạo trước khi có minSharpness/minBrightness dùng ngưỡng mặc định
+    if not rejected and options['filterUnclearSubject'] and \
+            analysis['sharpness'] < options.get('minSharpness', ORGANIZE_MIN_SHARPNESS):
+        rejected = ('blurry', f"không rõ nét (Sharpness: {analysis['sharpness']:.2f})")
+    if not rejected and options['filterDarkFace'] and \
+            analysis['brightness'] < options.get('minBrightness', ORGANIZE_MIN_BRIGHTNESS):
+        rejected = ('dark', f"ảnh tối (Brightness: {analysis['brightness']:.2f})")
+
+    if rejected:
+        outcome, reason = rejected
+        return outcome, f"{when}, loại ({reason}), đã xếp vào '{folder_name}'", class_folder_id
+    selected_id = ctx.folder(ORGANIZE_SELECTED_FOLDER, class_folder_id)
+    return 'selected', f"{when}, đã chọn vào '{folder_name}/{ORGANIZE_SELECTED_FOLDER}'", selected_id
+
+def record_organize_file(ctx, row_id, status, outcome, message, destination=None):
+    with app.app_context():
+        # Gán seq và commit trong cùng một khoá để seq được commit theo đúng thứ tự tăng dần
+        with ctx.commit_lock:
+            OrganizeJobFile.query.filter_by(id=row_id, status='pending').update({
+                OrganizeJobFile.status: status, OrganizeJobFile.outcome: outcome,
+                OrganizeJobFile.message: message, OrganizeJobFile.destination_folder_id: destination,
+                OrganizeJobFile.seq: ctx.seq + 1,
+            }, synchronize_session=False)
+            OrganizeJob.query.filter_by(id=ctx.job_id).update({
+                OrganizeJob.processed: OrganizeJob.processed + 1,
+                OrganizeJob.updated_at: datetime.datetime.utcnow(),
+            }, synchronize_session=False)
+            try:
+                db.session.commit()
+                ctx.seq += 1
+            except Exception as e:
+                db.session.rollback()
+                print_to_stderr(f"LỖI DB khi lưu kết quả file {row_id} của job {ctx.job_id}: {e}")
+                return
+    organize_runner.notify()
+
+def finish_organize_move(ctx, row_id, outcome, message, destination, future):
+    # Callback khi batch chứa lệnh di chuyển file đã chạy xong (trên luồng gửi batch)
+    error = future.exception()
+    if error is None:
+        record_organize_file(ctx, row_id, 'done', outcome, message, destination)
+    elif _is_drive_auth_error(error):
+        ctx.active.abort(ORGANIZE_AUTH_ERROR)
+    else:
+        print_to_stderr(f"LỖI job {ctx.job_id} khi di chuyển file {row_id}: {error}")
+        record_organize_file(ctx, row_id, 'error', 'error', f"Không di chuyển được file: {error}"[:500])
+
+def process_organize_file(ctx, row_id):
+    with app.app_context():
+        row = OrganizeJobFile.query.get(row_id)
+        if row is None or row.status != 'pending':
+            return
+        file_id = row.file_id
+        for attempt in range(2):
+            try:
+                used_token = ctx.access_token
+                outcome, message, destination = classify_organize_file(ctx, row)
+                break
+            except Exception as e:
+                db.session.rollback()
+                if _is_drive_auth_error(e):
+                    if attempt == 0 and not isinstance(e, drive_auth.DriveAuthError):
+                        # Drive từ chối token: làm mới rồi thử lại file này một lần
+                        ctx.token.invalidate(used_token)
+                        continue
+                    # File giữ trạng thái pending, chạy tiếp được sau khi cấp lại quyền
+                    raise organize_jobs.JobAborted(ORGANIZE_AUTH_ERROR)
+                print_to_stderr(f"LỖI job {ctx.job_id} khi xử lý file {file_id}: {e}")
+                outcome, message, destination = 'error', str(e)[:500], None
+                record_organize_file(ctx, row_id, 'error', outcome, message)
+                return
+    if destination is None:
+        record_organize_file(ctx, row_id, 'done', outcome, message)
+        return
+    # Worker không chờ lệnh di chuyển mà lấy ngay file kế tiếp; kết quả được ghi khi batch chạy xong
+    ctx.mover.submit(file_id, ctx.source_folder_id, destination).add_done_callback(
+        lambda future: finish_organize_move(ctx, row_id, outcome, message, destination, future))
+
+def claim_organize_job(job_id):
+    # Nhận job nếu chưa ai chạy hoặc lease của worker trước đã hết hạn (update có điều kiện
+    # nên chỉ một worker nhận được)
+    now = datetime.datetime.utcnow()
+    claimed = OrganizeJob.query.filter(
+        OrganizeJob.id == job_id, OrganizeJob.status.in_(('queued', 'running')),
+        or_(OrganizeJob.owner.is_(None), OrganizeJob.owner == organize_owner(),
+            OrganizeJob.heartbeat_at < organize_lease_cutoff())
+    ).update({OrganizeJob.owner: organize_owner(), OrganizeJob.heartbeat_at: now,
+              OrganizeJob.status: 'running', OrganizeJob.updated_at: now}, synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+def organize_heartbeat(job_id):
+    # Gia hạn lease; trả về False nếu job bị huỷ hoặc đã bị worker khác nhận
+    with app.app_context():
+        alive = OrganizeJob.query.filter_by(id=job_id, owner=organize_owner(), status='running').update(
+            {OrganizeJob.heartbeat_at: datetime.datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        return alive == 1
+
+def finish_organize_job(job_id, status, error=None):
+    OrganizeJob.query.filter(
+        OrganizeJob.id == job_id, OrganizeJob.owner == organize_owner(),
+        OrganizeJob.status.in_(('running', 'cancelling'))
+    ).update({OrganizeJob.status: status, OrganizeJob.error: error and error[:500], OrganizeJob.owner: None,
+              OrganizeJob.updated_at: datetime.datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+
+def list_organize_files(job, access_token):
+    # Lần chạy đầu: lưu danh sách file cần xử lý (lấy từ chỉ mục Drive sau khi đồng bộ).
+    # Thêm file và cập nhật total trong cùng transaction nên lần chạy lại sau sự cố không
+    # liệt kê lại.
+    sync_drive_folder(job.user_id, job.source_folder_id, access_token, force=True)
+    files = indexed_drive_files(job.user_id, job.source_folder_id, 'media')
+    db.session.bulk_insert_mappings(OrganizeJobFile, [{
+        "job_id": job.id, "file_id": f.file_id, "name": f.name, "mime_type": f.mime_type, "status": 'pending',
+        "meta": {"createdTime": f.created_time, "modifiedTime": f.modified_time,
+                 "md5Checksum": f.md5_checksum, "exifTime": f.exif_time},
+    } for f in files])
+    job.total = len(files)
+    db.session.commit()
+
+def run_organize_job(active):
+    job_id = active.job_id
+    with app.app_context():
+        if not claim_organize_job(job_id):
+            return
+        ctx = None
+        try:
+            job = OrganizeJob.query.get(job_id)
+            token = drive_auth.UserToken(drive_tokens, job.user_id)
+            token()
+            if not job.total:
+                list_organize_files(job, token)
+            last_seq = db.session.query(db.func.max(OrganizeJobFile.seq)).filter_by(job_id=job_id).scalar() or 0
+            pending = [row_id for row_id, in db.session.query(OrganizeJobFile.id).filter_by(
+                job_id=job_id, status='pending').order_by(OrganizeJobFile.id)]
+            ctx = OrganizeContext(active, job, token, last_seq)
+            prefetch_organize_folders(ctx, pending)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            if _is_drive_auth_error(e):
+                e = ORGANIZE_AUTH_ERROR
+            print_to_stderr(f"LỖI job {job_id}: {e}")
+            if ctx:
+                ctx.mover.close()
+            finish_organize_job(job_id, 'failed', str(e))
+            return
+    organize_runner.notify()
+
+    organize_runner.run_workers(
+        active, pending, lambda row_id: process_organize_file(ctx, row_id), ctx.options['workers'],
+        heartbeat=lambda: organize_heartbeat(job_id), heartbeat_interval=ORGANIZE_HEARTBEAT_SECONDS)
+    ctx.mover.close()
+
+    with app.app_context():
+        if active.abort_reason:
+            finish_organize_job(job_id, 'failed', active.abort_reason)
+        elif active.cancelled.is_set():
+            finish_organize_job(job_id, 'cancelled')
+        else:
+            finish_organize_job(job_id, 'completed')
+
+def resume_organize_jobs():
+    # Chạy tiếp các job mà worker cũ đã dừng giữa chừng (lease hết hạn hoặc chính
+    # process này vừa khởi động lại). Gọi từ vòng lặp nền của mỗi worker và từ các API
+    # job, tối đa mỗi ORGANIZE_HEARTBEAT_SECONDS giây. Mọi worker đều có thể thấy cùng
+    # một job; claim_organize_job (update có điều kiện) bảo đảm chỉ một worker chạy nó.
+    now = time.monotonic()
+    if now - organize_state['resume_checked_at'] < ORGANIZE_HEARTBEAT_SECONDS:
+        return
+    organize_state['resume_checked_at'] = now
+    stale = db.session.query(OrganizeJob.id, OrganizeJob.status).filter(
+        OrganizeJob.status.in_(ORGANIZE_ACTIVE_STATUSES),
+        or_(OrganizeJob.owner.is_(None), OrganizeJob.owner == organize_owner(),
+            OrganizeJob.heartbeat_at < organize_lease_cutoff())
+    ).all()
+    for job_id, status in stale:
+        if organize_runner.is_running(job_id):
+            continue
+        if status == 'cancelling':
+            OrganizeJob.query.filter_by(id=job_id, status='cancelling').update(
+                {OrganizeJob.status: 'cancelled', OrganizeJob.owner: None}, synchronize_session=False)
+            db.session.commit()
+        else:
+            print_to_stderr(f"Chạy tiếp job sắp xếp {job_id} ({status}).")
+            organize_runner.start(job_id, run_organize_job)
+
+def start_organize_resumer():
+    # Gọi một lần trong mỗi process phục vụ request (gunicorn.conf.py: post_worker_init,
+    # hoặc khi chạy app.py trực tiếp), không gọi ở master trước khi fork. Job bị ngắt khi
+    # deploy được chạy tiếp ngay khi worker mới lên, hoặc khi lease của worker cũ hết hạn,
+    # không phải chờ ai mở giao diện.
+    if organize_state['resumer'] is not None:
+        return
+    def loop():
+        while True:
+            with app.app_context():
+                try:
+                    resume_organize_jobs()
+                except Exception as e:
+                    db.session.rollback()
+                    print_to_stderr(f"LỖI khi tìm job sắp xếp cần chạy tiếp: {e}")
+            time.sleep(ORGANIZE_HEARTBEAT_SECONDS)
+    organize_state['resumer'] = threading.Thread(target=loop, name='organize-resumer', daemon=True)
+    organize_state['resumer'].start()
+
+def get_visible_organize_job(current_user, job_id):
+    job = OrganizeJob.query.get(job_id)
+    if job is None or (job.user_id != current_user.id and current_user.role != 'Admin'):
+        return None
+    return job
+
+def sse_event(event, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False))
+    return '\n'.join(lines) + '\n\n'
+
+@app.route('/api/organize-jobs', methods=['GET', 'POST'])
+@token_required
+def handle_organize_jobs(current_user):
+    resume_organize_jobs()
+    if request.method == 'GET':
+        jobs = OrganizeJob.query.filter_by(user_id=current_user.id).order_by(OrganizeJob.created_at.desc()).limit(20)
+        return jsonify([serialize_organize_job(job) for job in jobs]), 200
+
+    data = request.get_json() or {}
+    source_folder_id = str(data.get('sourceFolderId') or '').strip()
+    if not source_folder_id:
+        return jsonify({"error": "Thiếu sourceFolderId"}), 400
+    try:
+        options = parse_organize_options(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Hai job cùng sắp xếp một thư mục sẽ di chuyển chồng lên nhau
+    running = OrganizeJob.query.filter(OrganizeJob.source_folder_id == source_folder_id,
+                                       OrganizeJob.status.in_(ORGANIZE_ACTIVE_STATUSES)).first()
+    if running:
+        return jsonify({"error": "Thư mục này đang được sắp xếp", "job": serialize_organize_job(running)}), 409
+
+    try:
+        if data.get('accessToken'):
+            save_user_drive_token(current_user.id, data['accessToken'])
+        else:
+            try:
+                drive_tokens.get(current_user.id)
+            except drive_auth.DriveAuthError as e:
+                return jsonify({"error": str(e)}), 400
+        now = datetime.datetime.utcnow()
+        job = OrganizeJob(id=uuid.uuid4().hex, user_id=current_user.id, status='queued',
+                          source_folder_id=source_folder_id, options=options, total=0, processed=0,
+                          created_at=now, updated_at=now)
+        db.session.add(job)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print_to_stderr(f"LỖI DB khi tạo job sắp xếp: {e}")
+        return jsonify({'error': 'Could not create organize job'}), 500
+
+    organize_runner.start(job.id, run_organize_job)
+    return jsonify(serialize_organize_job(job, summary={})), 202
+
+@app.route('/api/organize-jobs/<job_id>', methods=['GET'])
+@token_required
+def get_organize_job(current_user, job_id):
+    resume_organize_jobs()
+    job = get_visible_organize_job(current_user, job_id)
+    if job is None:
+        return jsonify({"error": "Không tìm thấy job"}), 404
+    return jsonify(serialize_organize_job(job)), 200
+
+@app.route('/api/organize-jobs/<job_id>/cancel', methods=['POST'])
+@token_required
+def cancel_organize_job(current_user, job_id):
+    job = get_visible_organize_job(current_user, job_id)
+    if job is None:
+        return jsonify({"error": "Không tìm thấy job"}), 404
+    if job.status not in ORGANIZE_ACTIVE_STATUSES:
+        return jsonify({"error": f"Job đã kết thúc ({job.status})"}), 400
+    # Job đang chạy (ở worker này hoặc worker khác còn giữ lease) dừng sau file hiện tại;
+    # job chưa có ai chạy thì huỷ ngay
+    owned = job.owner is not None and job.heartbeat_at and job.heartbeat_at >= organize_lease_cutoff()
+    job.status = 'cancelling' if owned else 'cancelled'
+    job.updated_at = datetime.datetime.utcnow()
+    db.session.commit()
+    organize_runner.cancel(job_id)
+    organize_runner.notify()
+    return jsonify(serialize_organize_job(job)), 200
+
+@app.route('/api/organize-jobs/<job_id>/resume', methods=['POST'])
+@token_required
+def resume_organize_job(current_user, job_id):
+    # Chạy tiếp job bị lỗi (ví dụ token hết hạn) hoặc đã huỷ; có thể gửi kèm accessToken mới
+    job = get_visible_organize_job(current_user, job_id)
+    if job is None:
+        return jsonify({"error": "Không tìm thấy job"}), 404
+    if job.status not in ('failed', 'cancelled'):
+        return jsonify({"error": f"Không thể chạy tiếp job ở trạng thái {job.status}"}), 400
+    data = request.get_json(silent=True) or {}
+    if data.get('accessToken'):
+        save_user_drive_token(job.user_id, data['accessToken'])
+    job.status, job.error, job.owner = 'queued', None, None
+    job.updated_at = datetime.datetime.utcnow()
+    db.session.commit()
+    organize_runner.start(job.id, run_organize_job)
+    return jsonify(serialize_organize_job(job)), 202
+
+@app.route('/api/organize-jobs/<job_id>/events', methods=['GET'])
+@token_required
+@admission_controlled(events_admission)
+def organize_job_events(current_user, job_id):
+    # Server-Sent Events: "file" cho mỗi file xử lý xong (id = seq), "progress" khi số liệu
+    # của job thay đổi, "end" khi job kết thúc. Kết nối lại với header Last-Event-ID
+    # (hoặc ?after=) để nhận tiếp từ sau sự kiện cuối cùng đã nhận. Stream đóng sau
+    # ORGANIZE_SSE_MAX_SECONDS mà không có "end": client nối lại ngay.
+    resume_organize_jobs()
+    if get_visible_organize_job(current_user, job_id) is None:
+        return jsonify({"error": "Không tìm thấy job"}), 404
+    try:
+        after = int(request.headers.get('Last-Event-ID') or request.args.get('after') or 0)
+    except ValueError:
+        return jsonify({"error": "Last-Event-ID không hợp lệ"}), 400
+
+    def generate():
+        last_seq = after
+        last_progress = None
+        last_sent = time.monotonic()
+        deadline = last_sent + ORGANIZE_SSE_MAX_SECONDS
+        while True:
+            rows = OrganizeJobFile.query.filter(
+                OrganizeJobFile.job_id == job_id, OrganizeJobFile.seq > last_seq
+            ).order_by(OrganizeJobFile.seq).limit(500).all()
+            for row in rows:
+                last_seq = row.seq
+                yield sse_event('file', serialize_organize_file(row), event_id=row.seq)
+            progress = serialize_organize_job(OrganizeJob.query.get(job_id))
+            # Kết thúc transaction đọc để lần sau thấy dữ liệu mới và trả kết nối về pool
+            db.session.rollback()
+            if progress != last_progress:
+                last_progress = progress
+                yield sse_event('progress', progress)
+            if rows:
+                last_sent = time.monotonic()
+                if len(rows) == 500:
+                    continue
+            if progress['status'] not in ORGANIZE_ACTIVE_STATUSES and not rows:
+                yield sse_event('end', {"status": progress['status'], "error": progress['error']})
+                return
+            if time.monotonic() >= deadline:
+                return
+            if time.monotonic() - last_sent >= ORGANIZE_HEARTBEAT_SECONDS:
+                # Comment SSE để proxy không cắt kết nối đang chờ
+                last_sent = time.monotonic()
+                yield ': keep-alive\n\n'
+            organize_runner.wait_for_change(ORGANIZE_SSE_POLL_SECONDS)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/admin/auth-cache', methods=['GET', 'DELETE'])
+@token_required
+@admin_required
+def handle_auth_cache(current_user):
+    if request.method == 'GET':
+        stats = auth_user_cache.stats()
+        stats.update(auth_cache_counters)
+        # Không có cache mỗi request cần một truy vấn User; có cache thì tổng số truy vấn là
+        # số lần nạp user cộng số lần đọc bộ đếm thu hồi
+        stats['db_queries'] = auth_cache_counters['db_lookups'] + auth_cache_counters['revision_checks']
+        stats['db_lookups_saved'] = stats['hits'] + stats['misses'] - stats['db_queries']
+        stats['tokens_cached'] = len(auth_token_cache)
+        return jsonify(stats), 200
+
+    if request.method == 'DELETE':
+        auth_token_cache.clear()
+        auth_user_cache.clear()
+        return jsonify({'message': 'Auth cache purged'}), 200
+
+@app.route('/api/admin/admission', methods=['GET'])
+@token_required
+@admin_required
+def handle_admission_stats(current_user):
+    # Số liệu của worker xử lý request này; /api/metrics có số liệu gộp mọi worker
+    return jsonify({'pools': [heavy_admission.stats(), login_admission.stats(), events_admission.stats()]}), 200
+
+@app.route('/api/admin/media-metadata-cache', methods=['GET', 'DELETE'])
+@token_required
+@admin_required
+def handle_media_metadata_cache(current_user):
+    if request.method == 'GET':
+        stats = media_metadata_cache.stats()
+        stats.update(media_metadata_counters)
+        stats['db_rows'] = MediaMetadata.query.count()
+        return jsonify(stats), 200
+
+    if request.method == 'DELETE':
+        # ?expired=true chỉ xoá bản ghi quá TTL; mặc định xoá toàn bộ
+        query = MediaMetadata.query
+        if request.args.get('expired') == 'true':
+            cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=MEDIA_METADATA_TTL)
+            query = query.filter(MediaMetadata.updated_at < cutoff)
+        try:
+            deleted = query.delete(synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print_to_stderr(f"LỖI DB khi xoá cache metadata: {e}")
+            return jsonify({'error': 'Could not purge media metadata cache'}), 500
+        media_metadata_cache.clear()
+        return jsonify({'message': 'Media metadata cache purged', 'deleted': deleted}), 200
 
 # --- Khởi tạo DB và chạy App ---
+def upgrade_schema():
+    # Không dùng công cụ migration: tự nâng cấp các bảng đã tồn tại từ phiên bản cũ.
+    inspector = inspect(db.engine)
+    if db.engine.dialect.name == 'postgresql':
+        # Cột ngày trước đây lưu dạng chuỗi 'YYYY-MM-DD'
+        for table, column in (('one_off_schedule', 'date'), ('recurring_schedule', 'expiry_date')):
+            columns = {c['name']: c['type'] for c in inspector.get_columns(table)}
+            if column in columns and not isinstance(columns[column], db.Date):
+                print_to_stderr(f"Chuyển cột {table}.{column} sang kiểu DATE...")
+                db.session.execute(text(
+                    f"ALTER TABLE {table} ALTER COLUMN {column} TYPE DATE USING NULLIF({column}, '')::date"))
+        db.session.commit()
+    # Chỉ mục Drive trước đây dùng chung cho mọi người dùng: bỏ đi, mỗi người dùng liệt kê
+    # lại thư mục của mình ở lần mở tới
+    if 'user_id' not in {c['name'] for c in inspector.get_columns(DriveFile.__table__.name)}:
+        print_to_stderr("Dựng lại bảng drive_file theo từng người dùng...")
+        DriveFile.__table__.drop(bind=db.engine)
+        DriveFile.__table__.create(bind=db.engine)
+        DriveFolderWatch.query.update({DriveFolderWatch.listed_at: None}, synchronize_session=False)
+        db.session.commit()
+    # Hash lưu trước khi có cột algorithm không biết do thuật toán nào tạo ra nên không so
+    # được với hash nào: dựng lại bảng (các thư mục đích sẽ được lọc trùng lại từ đầu)
+    if 'algorithm' not in {c['name'] for c in inspector.get_columns(PhotoHash.__table__.name)}:
+        print_to_stderr("Dựng lại bảng photo_hash kèm cột algorithm...")
+        PhotoHash.__table__.drop(bind=db.engine)
+        PhotoHash.__table__.create(bind=db.engine)
+    # create_all không thêm cột mới cho bảng đã có sẵn
+    for model, column in ((User, 'drive_token_expires_at'), (User, 'token_version')):
+        table = model.__table__
+        if column not in {c['name'] for c in inspector.get_columns(table.name)}:
+            print_to_stderr(f"Thêm cột {table.name}.{column}...")
+            column_type = table.c[column].type.compile(dialect=db.engine.dialect)
+            server_default = table.c[column].server_default
+            if server_default is not None:
+                column_type += f" NOT NULL DEFAULT {server_default.arg}"
+            db.session.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN {column} {column_type}'))
+            db.session.commit()
+    # create_all không tạo index mới cho bảng đã có sẵn
+    for model in (RecurringSchedule, OneOffSchedule):
+        for index in model.__table__.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
 def create_initial_admin():
     with app.app_context():
         db.create_all()
+        upgrade_schema()
         
+        for revision_id in (1, CHANGE_LOG_REVISION_ID, AUTH_REVISION_ID, SETTINGS_REVISION_ID):
+            if not ScheduleRevision.query.get(revision_id):
+                db.session.add(ScheduleRevision(id=revision_id, version=0))
+                db.session.commit()
+
         if not Setting.query.first():
             db.session.add(Setting(client_id='', api_key='', source_folder_id=''))
             db.session.commit()
@@ -538,20 +3032,83 @@ def create_initial_admin():
             db.session.commit()
             print_to_stderr("Tài khoản Admin đã được tạo.")
 
+# --- Khởi tạo ứng dụng ---
+bootstrap_lock = threading.Lock()
+bootstrap_state = {'done': False}
+
+def create_app():
+    # Điểm vào preload cho gunicorn (gunicorn.conf.py: wsgi_app = 'app:create_app()'), không
+    # phải app factory: app, route, cấu hình và engine DB đều được tạo khi import module này,
+    # hàm chỉ chạy bước khởi tạo DB (tạo bảng, nâng cấp schema, dữ liệu mặc định) một lần
+    # cho mỗi process rồi trả về chính app đó. Với preload_app bước này chạy ở master trước
+    # khi fork; những gì master đã tạo được worker thừa hưởng, reset_after_fork dọn phần
+    # không dùng chung được.
+    with bootstrap_lock:
+        if not bootstrap_state['done']:
+            started = time.perf_counter()
+            create_initial_admin()
+            # Master không phục vụ request: đóng kết nối DB vừa dùng để khởi tạo
+            db.engine.dispose()
+            bootstrap_state['done'] = True
+            reserved = max(HEAVY_MAX_ACTIVE + HEAVY_MAX_QUEUE, HEAVY_MAX_ACTIVE + LOGIN_MAX_ACTIVE) + EVENTS_MAX_ACTIVE
+            if reserved >= WORKER_THREADS:
+                print_to_stderr(f"CẢNH BÁO: heavy, login và events giữ tới {reserved} luồng, không nhỏ hơn "
+                                f"GUNICORN_THREADS={WORKER_THREADS}: request nặng có thể chiếm hết luồng của worker")
+            print_to_stderr(f"Khởi tạo ứng dụng xong sau {(time.perf_counter() - started) * 1000:.0f} ms")
+    return app
+
+def reset_after_fork():
+    # Gọi trong worker ngay sau khi fork (gunicorn.conf.py: post_fork). Kết nối trong pool
+    # DB và pool HTTP tới Drive là socket của master: bỏ chúng để worker tự mở kết nối
+    # riêng. close=False: không đóng kết nối DB thay master (đóng sẽ gửi lệnh kết thúc
+    # phiên cho server DB).
+    db.engine.dispose(close=False)
+    drive_http.close()
+
+# Các cột của lịch mà client thấy. Danh sách lớn đọc tuple theo đúng thứ tự này rồi
+# serialize_*_row unpack theo vị trí: nhanh hơn nhiều so với dựng object ORM hay đọc
+# thuộc tính của Row theo tên.
+RECURRING_LIST_COLUMNS = (
+    RecurringSchedule.id, RecurringSchedule.school_name, RecurringSchedule.class_name, RecurringSchedule.days_of_week,
+    RecurringSchedule.start_time, RecurringSchedule.end_time, RecurringSchedule.expiry_date)
+ONE_OFF_LIST_COLUMNS = (
+    OneOffSchedule.id, OneOffSchedule.school_name, OneOffSchedule.class_name, OneOffSchedule.date,
+    OneOffSchedule.start_time, OneOffSchedule.end_time)
+
 def serialize_recurring(s):
     return {
         "id": s.id, "schoolName": s.school_name, "className": s.class_name,
         "daysOfWeek": s.days_of_week, "startTime": s.start_time,
-        "endTime": s.end_time, "expiryDate": s.expiry_date
+        "endTime": s.end_time, "expiryDate": s.expiry_date.isoformat() if s.expiry_date else None
+    }
+
+def serialize_recurring_row(row):
+    # Như serialize_recurring, cho tuple theo thứ tự RECURRING_LIST_COLUMNS
+    schedule_id, school_name, class_name, days_of_week, start_time, end_time, expiry_date = row
+    return {
+        "id": schedule_id, "schoolName": school_name, "className": class_name,
+        "daysOfWeek": days_of_week, "startTime": start_time,
+        "endTime": end_time, "expiryDate": expiry_date.isoformat() if expiry_date else None
     }
 
 def serialize_one_off(s):
     return {
         "id": s.id, "schoolName": s.school_name, "className": s.class_name,
-        "date": s.date, "startTime": s.start_time, "endTime": s.end_time
+        "date": s.date.isoformat() if s.date else None, "startTime": s.start_time, "endTime": s.end_time
+    }
+
+def serialize_one_off_row(row):
+    # Như serialize_one_off, cho tuple theo thứ tự ONE_OFF_LIST_COLUMNS
+    schedule_id, school_name, class_name, date, start_time, end_time = row
+    return {
+        "id": schedule_id, "schoolName": school_name, "className": class_name,
+        "date": date.isoformat() if date else None, "startTime": start_time, "endTime": end_time
     }
 
 if __name__ == '__main__':
-    create_initial_admin()
+    create_app()
+    # Với reloader của debug, chỉ process con (phục vụ request) chạy job nền
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_organize_resumer()
     app.run(host='0.0.0.0', port=5001, debug=True)
 
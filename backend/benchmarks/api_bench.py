@@ -0,0 +1,436 @@
+# Benchmark các endpoint nóng của backend trên DB cục bộ và Drive giả lập.
+#
+#   python benchmarks/api_bench.py --output bench.json
+#   python benchmarks/api_bench.py --rows 10,1000 --video-sizes 1M,1G --concurrency 4
+#   python benchmarks/api_bench.py --database-url postgresql://bench@localhost/bench --reset
+#   python benchmarks/api_bench.py --baseline bench.json --max-regression 20
+#
+# App được nạp trong cùng process và gọi qua Flask test client (không qua gunicorn),
+# nên số đo là thời gian xử lý của app và DB, không gồm mạng tới trình duyệt. Drive là
+# server HTTP thật ở localhost (fake_drive.py) nên metadata video vẫn đi qua requests
+# và Range request như khi chạy thật.
+#
+# Đo thông lượng và độ trễ p50/p90/p99 của: đăng nhập admin (gồm băm pbkdf2), phần
+# token_required thêm vào một request, danh sách và thêm/sửa/xoá lịch ở từng số dòng
+# (--rows), /api/video-metadata theo kích thước file (chưa cache và đã cache), và danh
+# sách thư mục Drive từ chỉ mục. Kết quả ghi ra JSON; --baseline so với lần chạy trước
+# và thoát với mã 1 nếu có chỉ số chậm hơn quá ngưỡng.
+#
+# Không có --database-url thì dùng SQLite tạm. Với DB khác (Postgres), toàn bộ bảng
+# bị xoá và tạo lại nên phải dùng DB riêng cho benchmark và thêm --reset.
+import argparse
+import contextlib
+import datetime
+import itertools
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from fake_drive import FakeDriveServer, folder_id, video_id
+from schedule_conflicts import generate
+
+GROUPS = ('login', 'auth', 'schedules', 'video', 'drive')
+ADMIN_PASSWORD = 'password'
+DRIVE_TOKEN = 'bench-drive-token'
+# Lịch thêm mới nằm sau 20h (dữ liệu giả lập kết thúc trước 19h30), mỗi lịch một ô
+# một phút riêng nên không bị 409 trùng lịch mà vẫn đi qua bước kiểm tra trùng
+CRUD_FIRST_MINUTE = 20 * 60
+CRUD_SLOTS_PER_DAY = 24 * 60 - 1 - CRUD_FIRST_MINUTE
+CRUD_LIMIT = 7 * CRUD_SLOTS_PER_DAY
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def result_key(result):
+    # Chỉ so các phép đo cùng tham số và cùng số luồng
+    return f"{result['name']} {json.dumps(result['params'], sort_keys=True)} c={result['concurrency']}"
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Bench:
+    def __init__(self, backend, args):
+        self.backend = backend
+        self.app = backend.app
+        self.args = args
+        self.results = []
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        return client
+
+    def _call(self, method, url, **kwargs):
+        # Đóng response để các hàm call_on_close (số liệu request) chạy như trên server thật
+        response = self._client().open(url, method=method, **kwargs)
+        status = response.status_code
+        body = response.get_json(silent=True) if status in (200, 201) else None
+        response.close()
+        return status, body
+
+    def measure(self, name, params, request, count, ok=(200,), prepare=None, warmup=0):
+        # request(i) -> (method, url, kwargs) cho lần gọi thứ i; prepare(i) chạy trước
+        # lần gọi đó và không tính vào thời gian
+        concurrency = max(1, min(self.args.concurrency, count))
+        for i in range(warmup):
+            method, url, kwargs = request(i)
+            self._call(method, url, **kwargs)
+
+        latencies = [None] * count
+        statuses = {}
+        bodies = [None] * count
+        status_lock = threading.Lock()
+
+        def one(i):
+            if prepare:
+                prepare(i)
+            method, url, kwargs = request(i)
+            started = time.perf_counter()
+            status, body = self._call(method, url, **kwargs)
+            latencies[i] = time.perf_counter() - started
+            bodies[i] = body
+            with status_lock:
+                statuses[status] = statuses.get(status, 0) + 1
+
+        started = time.perf_counter()
+        if concurrency == 1:
+            for i in range(count):
+                one(i)
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(one, range(count)))
+        elapsed = time.perf_counter() - started
+
+        values = sorted(latency * 1000 for latency in latencies)
+        result = {
+            "name": name, "params": params, "requests": count, "concurrency": concurrency,
+            "errors": sum(n for status, n in statuses.items() if status not in ok),
+            "status": {str(status): n for status, n in sorted(statuses.items())},
+            "seconds": round(elapsed, 4),
+            "throughput_rps": round(count / elapsed, 2) if elapsed else None,
+            "latency_ms": {
+                "p50": round(percentile(values, 50), 3), "p90": round(percentile(values, 90), 3),
+                "p99": round(percentile(values, 99), 3), "mean": round(sum(values) / len(values), 3),
+                "min": round(values[0], 3), "max": round(values[-1], 3),
+            },
+        }
+        self.results.append(result)
+        status_note = '' if not result['errors'] else f"  LỖI {result['errors']} {result['status']}"
+        print(f"{name:<24} {json.dumps(params, sort_keys=True):<52} n={count:<5} "
+              f"{result['throughput_rps']:>9} req/s  p50 {result['latency_ms']['p50']:>9} ms  "
+              f"p99 {result['latency_ms']['p99']:>9} ms{status_note}", flush=True)
+        return result, bodies
+
+    def _scaled(self, rows):
+        # Danh sách đầy đủ ở 100k dòng mất cỡ giây mỗi request: giảm số lần gọi theo số dòng
+        return min(self.args.requests, max(10, 1000000 // max(rows, 1)))
+
+    # --- Chuẩn bị dữ liệu ---
+    def setup_database(self):
+        backend = self.backend
+        with self.app.app_context():
+            if self.args.reset:
+                backend.db.drop_all()
+        backend.create_initial_admin()
+        with self.app.app_context():
+            admin = backend.User.query.filter_by(role='Admin').first()
+            admin.drive_access_token = DRIVE_TOKEN
+            backend.db.session.commit()
+            self.admin_id = admin.id
+            self.dialect = backend.db.engine.dialect.name
+            self.server_version = '.'.join(str(part) for part in backend.db.engine.dialect.server_version_info or ())
+        status, body = self._call('POST', '/api/auth/login', json={'username': 'admin', 'password': ADMIN_PASSWORD})
+        if status != 200:
+            raise SystemExit(f"Không đăng nhập được tài khoản admin mặc định (HTTP {status})")
+        self.token = body['apiToken']
+        self.auth = {'x-access-token': self.token}
+
+    def seed_schedules(self, rows):
+        backend = self.backend
+        recurring, one_off = generate(rows, self.args.seed)
+        with self.app.app_context():
+            backend.RecurringSchedule.query.delete()
+            backend.OneOffSchedule.query.delete()
+            # Không gán id để sequence của Postgres vẫn đúng cho các lịch thêm qua API
+            backend.db.session.bulk_insert_mappings(backend.RecurringSchedule, [{
+                'school_name': e['schoolName'], 'class_name': e['className'], 'days_of_week': e['daysOfWeek'],
+                'start_time': e['startTime'], 'end_time': e['endTime'],
+                'expiry_date': datetime.date.fromisoformat(e['expiryDate']) if e['expiryDate'] else None,
+            } for e in recurring])
+            backend.db.session.bulk_insert_mappings(backend.OneOffSchedule, [{
+                'school_name': e['schoolName'], 'class_name': e['className'],
+                'date': datetime.date.fromisoformat(e['date']), 'start_time': e['startTime'], 'end_time': e['endTime'],
+            } for e in one_off])
+            backend.bump_schedule_revision()
+            backend.db.session.commit()
+            # Dựng sẵn chỉ mục trùng lịch để lần thêm lịch đầu tiên không phải gánh
+            with backend.schedule_index_lock:
+                backend.ensure_schedule_index()
+
+    # --- Các nhóm đo ---
+    def bench_login(self):
+        self.measure('auth.login', {}, lambda i: ('POST', '/api/auth/login', {
+            'json': {'username': 'admin', 'password': ADMIN_PASSWORD}}), self.args.slow_requests)
+
+    def bench_auth(self):
+        backend = self.backend
+        count = self.args.requests
+
+        def clear_auth_caches(i):
+            backend.auth_token_cache.clear()
+            backend.auth_user_cache.clear()
+
+        plain, _ = self.measure('auth.noop', {'token_required': False},
+                                lambda i: ('GET', '/api/_bench/noop', {}), count, warmup=5)
+        warm, _ = self.measure('auth.noop', {'token_required': True, 'cache': 'warm'},
+                               lambda i: ('GET', '/api/_bench/noop-auth', {'headers': self.auth}), count, warmup=5)
+        cold, _ = self.measure('auth.noop', {'token_required': True, 'cache': 'cold'},
+                               lambda i: ('GET', '/api/_bench/noop-auth', {'headers': self.auth}), count,
+                               prepare=clear_auth_caches)
+        self.derived['token_required_overhead_ms'] = {
+            cache: {pct: round(result['latency_ms'][pct] - plain['latency_ms'][pct], 3) for pct in ('p50', 'p99')}
+            for cache, result in (('warm', warm), ('cold', cold))
+        }
+
+    def bench_schedules(self, rows):
+        base = {'rows': rows}
+        count = self._scaled(rows)
+        for kind in ('recurring', 'one-off'):
+            url = f"/api/{kind}-schedules"
+            params = dict(base, kind=kind)
+            self.measure('schedules.list', dict(params, query='all'),
+                                     lambda i: ('GET', url, {'headers': self.auth}), count, warmup=1)
+            self.measure('schedules.list', dict(params, query='page50'),
+                         lambda i: ('GET', f"{url}?limit=50", {'headers': self.auth}), self.args.requests, warmup=1)
+            etag = self._header(url, 'ETag')
+            self.measure('schedules.list', dict(params, query='not_modified'),
+                         lambda i: ('GET', url, {'headers': dict(self.auth, **{'If-None-Match': etag})}),
+                         self.args.requests, ok=(304,))
+            # Đồng bộ delta khi không có gì thay đổi (client đã có version mới nhất)
+            version = self._header(url, 'X-Change-Version')
+            self.measure('schedules.list', dict(params, query='delta_empty'),
+                         lambda i: ('GET', f"{url}?since={version}", {'headers': self.auth}), self.args.requests)
+
+        crud = min(self.args.requests, CRUD_LIMIT)
+        slots = itertools.count()
+        today = datetime.date.today()
+
+        def recurring_payload(slot, suffix=''):
+            minute = CRUD_FIRST_MINUTE + slot // 7
+            return {'schoolName': 'Bench School', 'className': f"Bench {slot}{suffix}",
+                    'daysOfWeek': [str(slot % 7 + 1)], 'startTime': f"{minute // 60:02d}:{minute % 60:02d}",
+                    'endTime': f"{(minute + 1) // 60:02d}:{(minute + 1) % 60:02d}", 'expiryDate': None}
+
+        def one_off_payload(slot, suffix=''):
+            minute = CRUD_FIRST_MINUTE + slot % CRUD_SLOTS_PER_DAY
+            date = today + datetime.timedelta(days=400 + slot // CRUD_SLOTS_PER_DAY)
+            return {'schoolName': 'Bench School', 'className': f"Bench {slot}{suffix}", 'date': date.isoformat(),
+                    'startTime': f"{minute // 60:02d}:{minute % 60:02d}",
+                    'endTime': f"{(minute + 1) // 60:02d}:{(minute + 1) % 60:02d}"}
+
+        for kind, payload in (('recurring', recurring_payload), ('one-off', one_off_payload)):
+            url = f"/api/{kind}-schedules"
+            params = dict(base, kind=kind)
+            assigned = [next(slots) for _ in range(crud)]
+            _, created = self.measure('schedules.create', params, lambda i: (
+                'POST', url, {'headers': self.auth, 'json': payload(assigned[i])}), crud, ok=(201,))
+            ids = [body['id'] if body else None for body in created]
+            self.measure('schedules.update', params, lambda i: (
+                'PUT', f"{url}/{ids[i]}", {'headers': self.auth, 'json': payload(assigned[i], ' (sửa)')}), crud)
+            self.measure('schedules.delete', params, lambda i: (
+                'DELETE', f"{url}/{ids[i]}", {'headers': self.auth}), crud)
+
+    def _header(self, url, name):
+        response = self._client().get(url, headers=self.auth)
+        value = response.headers.get(name)
+        response.close()
+        return value
+
+    def bench_video(self, sizes):
+        run = itertools.count()
+        for size in sizes:
+            for faststart in (False, True):
+                params = {'size': size, 'layout': 'faststart' if faststart else 'moov_at_end'}
+                ids = [video_id(size, f"{self.run_id}-{next(run)}", faststart) for _ in range(self.args.slow_requests)]
+                self.measure('video_metadata', dict(params, cache='miss'), lambda i: (
+                    'POST', '/api/video-metadata', {'headers': self.auth, 'json': {
+                        'fileId': ids[i], 'md5Checksum': f"md5-{ids[i]}"}}), len(ids))
+                warm_id = ids[0]
+                self.measure('video_metadata', dict(params, cache='hit'), lambda i: (
+                    'POST', '/api/video-metadata', {'headers': self.auth, 'json': {
+                        'fileId': warm_id, 'md5Checksum': f"md5-{warm_id}"}}), self.args.requests)
+
+    def bench_drive(self, files):
+        run = itertools.count()
+        folders = [folder_id(files, f"{self.run_id}-{next(run)}") for _ in range(self.args.slow_requests)]
+        params = {'files': files}
+        self.measure('drive.folder_files', dict(params, index='cold'), lambda i: (
+            'GET', f"/api/drive/folders/{folders[i]}/files", {'headers': self.auth}), len(folders))
+        warm = folders[0]
+        self.measure('drive.folder_files', dict(params, index='warm'), lambda i: (
+            'GET', f"/api/drive/folders/{warm}/files", {'headers': self.auth}), self.args.requests)
+
+    def run(self, groups, rows_list, sizes):
+        self.derived = {}
+        self.run_id = f"{int(time.time())}"
+        self.setup_database()
+        if 'login' in groups:
+            self.bench_login()
+        if 'auth' in groups:
+            self.bench_auth()
+        if 'schedules' in groups:
+            for rows in rows_list:
+                print(f"-- Tạo {rows} lịch giả lập", flush=True)
+                self.seed_schedules(rows)
+                self.bench_schedules(rows)
+        if 'video' in groups:
+            self.bench_video(sizes)
+        if 'drive' in groups:
+            self.bench_drive(self.args.folder_files)
+
+
+def register_bench_routes(backend):
+    # Hai endpoint rỗng, giống nhau trừ token_required, để tách riêng chi phí xác thực
+    from flask import jsonify
+
+    def noop():
+        return jsonify({})
+
+    def noop_auth(current_user):
+        return jsonify({})
+
+    backend.app.add_url_rule('/api/_bench/noop', 'bench_noop', noop)
+    backend.app.add_url_rule('/api/_bench/noop-auth', 'bench_noop_auth', backend.token_required(noop_auth))
+
+
+def compare(results, baseline_path, max_regression, floor_ms):
+    with open(baseline_path) as f:
+        baseline = {result_key(r): r for r in json.load(f)['results']}
+    regressions = []
+    for result in results:
+        old = baseline.get(result_key(result))
+        if old is None:
+            continue
+        for pct in ('p50', 'p99'):
+            before, after = old['latency_ms'][pct], result['latency_ms'][pct]
+            change = (after - before) / before * 100 if before else 0.0
+            if change > max_regression and after - before > floor_ms:
+                regressions.append((result_key(result), pct, before, after, change))
+    print(f"\nSo với {baseline_path}: {len(regressions)} chỉ số chậm hơn {max_regression}%")
+    for key, pct, before, after, change in regressions:
+        print(f"  {key} {pct}: {before} ms -> {after} ms (+{change:.1f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-url', help="mặc định: SQLite tạm")
+    parser.add_argument('--reset', action='store_true', help="xoá và tạo lại mọi bảng (bắt buộc với DB không phải SQLite tạm)")
+    parser.add_argument('--groups', default=','.join(GROUPS), help=f"các nhóm cần đo trong {','.join(GROUPS)}")
+    parser.add_argument('--rows', default='10,1000,100000', help="số lịch giả lập cho từng lượt đo lịch")
+    parser.add_argument('--video-sizes', default='1M,256M,4G', help="kích thước video giả lập (hậu tố K/M/G)")
+    parser.add_argument('--folder-files', type=int, default=500, help="số file trong thư mục Drive giả lập")
+    parser.add_argument('--requests', type=int, default=200, help="số request mỗi phép đo")
+    parser.add_argument('--slow-requests', type=int, default=30, help="số request cho đăng nhập, video và thư mục chưa cache")
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--baseline', help="file JSON của lần chạy trước để so sánh")
+    parser.add_argument('--max-regression', type=float, default=20.0, help="ngưỡng chậm hơn cho phép (%%)")
+    parser.add_argument('--regression-floor-ms', type=float, default=0.5,
+                        help="bỏ qua chênh lệch tuyệt đối nhỏ hơn giá trị này (nhiễu)")
+    parser.add_argument('--verbose', action='store_true', help="giữ log stderr của app")
+    args = parser.parse_args()
+
+    groups = [group.strip() for group in args.groups.split(',') if group.strip()]
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        parser.error(f"nhóm không hợp lệ: {', '.join(sorted(unknown))}")
+    rows_list = [int(value) for value in args.rows.split(',') if value.strip()]
+    sizes = [parse_size(value) for value in args.video_sizes.split(',') if value.strip()]
+
+    temp_dir = None
+    if not args.database_url:
+        temp_dir = tempfile.mkdtemp(prefix='teacher-bench-')
+        args.database_url = f"sqlite:///{os.path.join(temp_dir, 'bench.db')}"
+    elif not args.reset:
+        parser.error("--database-url cần kèm --reset (mọi bảng sẽ bị xoá); hãy dùng DB riêng cho benchmark")
+
+    # Cấu hình app phải có trước khi nạp module app
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret')
+    os.environ['METRICS_DIR'] = ''
+    # Đo chi phí xử lý chứ không đo giới hạn của admission control (tốc độ, số request cùng lúc)
+    for name in ('LOGIN_IP_RATE', 'LOGIN_IP_BURST', 'HEAVY_USER_RATE', 'HEAVY_USER_BURST', 'HEAVY_MAX_ACTIVE',
+                 'HEAVY_USER_MAX_ACTIVE', 'LOGIN_MAX_ACTIVE'):
+        os.environ.setdefault(name, '1000000')
+
+    drive = FakeDriveServer().start()
+    import app as backend
+    import video_probe
+    video_probe.DRIVE_FILES_URL = drive.files_url
+    register_bench_routes(backend)
+
+    bench = Bench(backend, args)
+    started_at = datetime.datetime.utcnow().replace(microsecond=0).isoformat() + 'Z'
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stderr(stack.enter_context(open(os.devnull, 'w'))))
+        bench.run(groups, rows_list, sizes)
+    drive.stop()
+
+    output = {
+        "meta": {
+            "started_at": started_at, "git_revision": git_revision(),
+            "python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "database": {"dialect": bench.dialect, "server_version": bench.server_version},
+            "args": {k: v for k, v in vars(args).items() if k != 'database_url'},
+            "fake_drive": drive.counters,
+        },
+        "derived": bench.derived,
+        "results": bench.results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2, ensure_ascii=False)
+    print(f"\nĐã ghi {len(bench.results)} kết quả vào {args.output}")
+
+    if args.baseline:
+        regressions = compare(bench.results, args.baseline, args.max_regression, args.regression_floor_ms)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+# Đo thời gian khởi động lạnh của backend, mỗi lần trong một process Python mới.
+#
+#   python benchmarks/cold_start.py --runs 5
+#   python benchmarks/cold_start.py --gunicorn --workers 2 --output cold.json
+#
+# Mặc định đo từng bước trong process: nạp module app, create_app() (tạo bảng, dữ liệu
+# mặc định) và request đầu tiên, kèm danh sách module nặng đã bị nạp sẵn (numpy,
+# google.oauth2...). --gunicorn đo từ lúc chạy `gunicorn -c gunicorn.conf.py` tới khi
+# /api/settings trả 200. Lần chạy đầu tạo bảng trên SQLite tạm, các lần sau dùng lại DB.
+import argparse
+import datetime
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from api_bench import git_revision
+
+HEAVY_MODULES = ('numpy', 'PIL.Image', 'google.oauth2.id_token', 'google.auth.transport.requests')
+
+IN_PROCESS = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+bootstrapped = time.perf_counter()
+response = app.app.test_client().get('/api/settings')
+response.close()
+done = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000, "create_app_ms": (bootstrapped - imported) * 1000,
+    "first_request_ms": (done - bootstrapped) * 1000, "total_ms": (done - started) * 1000,
+    "status": response.status_code, "heavy_modules": [m for m in %r if m in sys.modules],
+}))
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_in_process(env):
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-c', IN_PROCESS % (HEAVY_MODULES,)], cwd=BACKEND_DIR, env=env,
+                               capture_output=True, text=True, check=True)
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["process_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def run_gunicorn(env, workers, timeout):
+    port = free_port()
+    env = dict(env, BACKEND_PORT=str(port), WEB_CONCURRENCY=str(workers))
+    url = f"http://127.0.0.1:{port}/api/settings"
+    started = time.perf_counter()
+    process = subprocess.Popen(['gunicorn', '-c', 'gunicorn.conf.py'], cwd=BACKEND_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise SystemExit(f"gunicorn thoát với mã {process.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return {"ready_ms": (time.perf_counter() - started) * 1000, "status": response.status}
+            except OSError:
+                time.sleep(0.02)
+        raise SystemExit(f"gunicorn chưa sẵn sàng sau {timeout} giây")
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--database-url', help="mặc định: SQLite tạm")
+    parser.add_argument('--gunicorn', action='store_true', help="đo gunicorn tới khi trả request đầu tiên")
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--output', help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='teacher-cold-'), 'cold.db')}"
+    env.setdefault('SECRET_KEY', 'benchmark-secret')
+
+    runs = []
+    for i in range(args.runs):
+        result = run_gunicorn(env, args.workers, args.timeout) if args.gunicorn else run_in_process(env)
+        runs.append(result)
+        print(f"lần {i + 1}: " + ", ".join(
+            f"{key} {value:.0f}" if isinstance(value, float) else f"{key} {value}" for key, value in result.items()))
+
+    keys = [key for key, value in runs[0].items() if isinstance(value, float)]
+    # Lần đầu còn tạo bảng nên không tính vào trung vị nếu có nhiều lần chạy
+    steady = runs[1:] or runs
+    summary = {key: {"first": round(runs[0][key], 1), "median": round(statistics.median(r[key] for r in steady), 1),
+                     "min": round(min(r[key] for r in steady), 1)} for key in keys}
+    for key, values in summary.items():
+        print(f"{key:<18} lần đầu {values['first']:>8} ms   trung vị {values['median']:>8} ms   min {values['min']:>8} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                "meta": {
+                    "started_at": datetime.datetime.utcnow().replace(microsecond=0).isoformat() + 'Z',
+                    "git_revision": git_revision(), "python": platform.python_version(),
+                    "platform": platform.platform(), "cpu_count": os.cpu_count(),
+                    "mode": 'gunicorn' if args.gunicorn else 'in_process',
+                    "workers": args.workers if args.gunicorn else None,
+                },
+                "summary": summary, "runs": runs,
+            }, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,418 @@
+# Server HTTP giả lập Google Drive API cho benchmark, chạy ở localhost.
+#
+# Không lưu nội dung file: id của file/thư mục mã hoá luôn thông số của nó nên mỗi lần
+# đo có thể dùng id mới (tránh cache) mà không cần đăng ký trước.
+#   video_id(size, n, faststart)   MP4 tổng cộng `size` byte, moov ở cuối file (kiểu
+#                                  camera ghi) hoặc ngay sau ftyp (faststart)
+#   folder_id(count, n)            thư mục chứa `count` ảnh/video
+# Hỗ trợ files.get (metadata), alt=media có Range, files.list theo thư mục cha,
+# changes/startPageToken và changes.
+#
+# Ngoài ra có thể thêm file "thật" (add_file: metadata + nội dung trong bộ nhớ) để test
+# các luồng ghi: batch request multipart/mixed tại batch_url với tìm thư mục theo tên,
+# tạo thư mục và di chuyển file (addParents/removeParents). Mọi thay đổi của các file này
+# (thêm, di chuyển, sửa, vào thùng rác, xoá vĩnh viễn) được ghi vào changes feed; page
+# token là số thứ tự thay đổi kế tiếp, expire_page_tokens() làm các token cũ hết hạn.
+import datetime
+import http.server
+import json
+import re
+import itertools
+import struct
+import threading
+import time
+import urllib.parse
+
+MP4_EPOCH = datetime.datetime(1904, 1, 1, tzinfo=datetime.timezone.utc)
+CREATION_TIME = datetime.datetime(2024, 3, 5, 1, 30, tzinfo=datetime.timezone.utc)
+MODIFIED_TIME = '2024-03-05T01:30:00.000Z'
+STREAM_CHUNK = 256 * 1024
+
+_VIDEO_RE = re.compile(r'^vid-(\d+)-(fast|tail)-[\w.-]+$')
+_FOLDER_RE = re.compile(r'^dir-(\d+)-[\w.-]+$')
+_PARENT_RE = re.compile(r"'((?:[^'\\]|\\.)*)' in parents")
+_NAME_RE = re.compile(r"name = '((?:[^'\\]|\\.)*)'")
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+
+def video_id(size, n, faststart=False):
+    return f"vid-{size}-{'fast' if faststart else 'tail'}-{n}"
+
+
+def folder_id(count, n):
+    return f"dir-{count}-{n}"
+
+
+def _unquote(value):
+    return re.sub(r"\\(.)", r"\1", value)
+
+
+def _atom(kind, payload):
+    return struct.pack('>I', 8 + len(payload)) + kind + payload
+
+
+class SyntheticMP4:
+    # File MP4 tối thiểu (ftyp, mdat toàn byte 0, moov/mvhd) ghép từ các đoạn, đọc theo
+    # khoảng byte mà không dựng cả file trong bộ nhớ.
+    def __init__(self, size, faststart=False, creation_time=CREATION_TIME):
+        seconds = int((creation_time - MP4_EPOCH).total_seconds())
+        mvhd = _atom(b'mvhd', b'\x00\x00\x00\x00' + struct.pack('>II', seconds, seconds) + b'\x00' * 88)
+        ftyp = _atom(b'ftyp', b'isom\x00\x00\x02\x00')
+        moov = _atom(b'moov', mvhd)
+        payload = max(size - len(ftyp) - len(moov) - 16, 0)
+        # mdat dùng largesize (64 bit) để file lớn hơn 4 GB vẫn hợp lệ
+        mdat_header = struct.pack('>I', 1) + b'mdat' + struct.pack('>Q', 16 + payload)
+        head = ftyp + moov + mdat_header if faststart else ftyp + mdat_header
+        self._segments = [(head, None), (None, payload)] + ([] if faststart else [(moov, None)])
+        self.size = len(head) + payload + (0 if faststart else len(moov))
+
+    def read(self, start, end):
+        # Các khối byte của đoạn [start, end) (end không tính)
+        offset = 0
+        for data, zeros in self._segments:
+            length = len(data) if data is not None else zeros
+            lo, hi = max(start, offset), min(end, offset + length)
+            while lo < hi:
+                if data is not None:
+                    yield data[lo - offset:hi - offset]
+                    break
+                step = min(hi - lo, STREAM_CHUNK)
+                yield bytes(step)
+                lo += step
+            offset += length
+
+
+class _Blob:
+    # Nội dung file thêm bằng add_file, cùng giao diện size/read với SyntheticMP4
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+
+    def read(self, start, end):
+        yield self.data[start:end]
+
+
+class FakeDriveServer:
+    def __init__(self, host='127.0.0.1', port=0, access_token=None):
+        # access_token=None: chấp nhận mọi Bearer token
+        self.access_token = access_token
+        self.counters = {'requests': 0, 'media_requests': 0, 'bytes_sent': 0, 'batch_requests': 0,
+                         'list_requests': 0}
+        # Thời gian chờ thêm trước mỗi lần tải nội dung (alt=media), để test huỷ job giữa chừng
+        self.media_delay = 0.0
+        self.files = {}
+        self._contents = {}
+        # changes feed: danh sách id file theo thứ tự thay đổi; token N = từ phần tử thứ N
+        self._changes = []
+        self._oldest_token = 1
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = http.server.ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self.base_url = f"http://{host}:{self._server.server_port}"
+        self.files_url = f"{self.base_url}/drive/v3/files"
+        self.batch_url = f"{self.base_url}/batch/drive/v3"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name='fake-drive', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.counters[key] += amount
+
+    # --- File thêm bằng add_file ---
+    def add_file(self, name, mime_type, parents, content=None, file_id=None, **fields):
+        # fields: các trường metadata khác (createdTime, imageMediaMetadata...). Trả về id.
+        with self._lock:
+            file_id = file_id or f"file-{next(self._ids)}"
+            entry = {'id': file_id, 'name': name, 'mimeType': mime_type, 'parents': list(parents),
+                     'createdTime': MODIFIED_TIME, 'modifiedTime': MODIFIED_TIME, 'trashed': False}
+            if content is not None:
+                entry['md5Checksum'] = f"md5-{file_id}-{len(content)}"
+                entry['size'] = str(len(content))
+                self._contents[file_id] = content
+            entry.update(fields)
+            self.files[file_id] = entry
+            self._changes.append(file_id)
+        return file_id
+
+    def add_folder(self, name, parent_id, file_id=None):
+        return self.add_file(name, FOLDER_MIME_TYPE, [parent_id], file_id=file_id)
+
+    def children(self, parent_id):
+        # File thêm bằng add_file nằm trong parent_id (không tính file trong thùng rác)
+        with self._lock:
+            return [dict(f) for f in self.files.values() if parent_id in f['parents'] and not f['trashed']]
+
+    def find_folder(self, name, parent_id):
+        return next((f['id'] for f in self.children(parent_id)
+                     if f['mimeType'] == FOLDER_MIME_TYPE and f['name'] == name), None)
+
+    def move(self, file_id, add_parents=(), remove_parents=()):
+        with self._lock:
+            entry = self.files.get(file_id)
+            if entry is None:
+                return None
+            entry['parents'] = [p for p in entry['parents'] if p not in remove_parents] + [
+                p for p in add_parents if p not in entry['parents']]
+            self._changes.append(file_id)
+            return dict(entry)
+
+    def update_file(self, file_id, **fields):
+        # Sửa metadata (đổi tên, trashed=True để vào thùng rác...)
+        with self._lock:
+            self.files[file_id].update(fields)
+            self._changes.append(file_id)
+
+    def delete_file(self, file_id):
+        # Xoá vĩnh viễn: change có removed=True và không kèm file
+        with self._lock:
+            del self.files[file_id]
+            self._contents.pop(file_id, None)
+            self._changes.append(file_id)
+
+    # --- Changes feed ---
+    def start_page_token(self):
+        with self._lock:
+            return str(len(self._changes) + 1)
+
+    def expire_page_tokens(self):
+        # Như khi Drive không còn giữ lịch sử thay đổi: token cũ hơn hiện tại bị từ chối
+        with self._lock:
+            self._oldest_token = len(self._changes) + 1
+
+    def list_changes(self, page_token, page_size):
+        # Trả về (status, body) như changes.list. Mỗi change mang trạng thái hiện tại của file.
+        with self._lock:
+            latest = len(self._changes) + 1
+            if not str(page_token).isdigit() or not self._oldest_token <= int(page_token) <= latest:
+                return 404, {'error': {'code': 404, 'message': f"Page token is not valid: {page_token}"}}
+            start = int(page_token) - 1
+            changes = []
+            for file_id in self._changes[start:start + page_size]:
+                entry = self.files.get(file_id)
+                change = {'kind': 'drive#change', 'type': 'file', 'fileId': file_id, 'removed': entry is None}
+                if entry is not None:
+                    change['file'] = dict(entry)
+                changes.append(change)
+            body = {'changes': changes}
+            if start + page_size < len(self._changes):
+                body['nextPageToken'] = str(start + page_size + 1)
+            else:
+                body['newStartPageToken'] = str(latest)
+            return 200, body
+
+    def file_metadata(self, file_id):
+        with self._lock:
+            if file_id in self.files:
+                return dict(self.files[file_id])
+        match = _VIDEO_RE.match(file_id)
+        if match:
+            return {'id': file_id, 'name': f"{file_id}.mp4", 'mimeType': 'video/mp4',
+                    'createdTime': MODIFIED_TIME, 'modifiedTime': MODIFIED_TIME,
+                    'md5Checksum': f"md5-{file_id}", 'size': str(SyntheticMP4(int(match.group(1)),
+                                                                               match.group(2) == 'fast').size)}
+        if _FOLDER_RE.match(file_id):
+            return {'id': file_id, 'name': file_id, 'mimeType': 'application/vnd.google-apps.folder',
+                    'createdTime': MODIFIED_TIME, 'modifiedTime': MODIFIED_TIME}
+        return None
+
+    def list_children(self, parent_id):
+        match = _FOLDER_RE.match(parent_id)
+        if not match:
+            return self.children(parent_id)
+        files = []
+        for i in range(int(match.group(1))):
+            # Cứ 5 file có 1 video, còn lại là ảnh
+            if i % 5 == 4:
+                entry = self.file_metadata(video_id(4 * 1024 * 1024, f"{parent_id}-{i}"))
+            else:
+                entry = {'id': f"img-{parent_id}-{i}", 'name': f"IMG_{i:05d}.jpg", 'mimeType': 'image/jpeg',
+                         'createdTime': MODIFIED_TIME, 'modifiedTime': MODIFIED_TIME,
+                         'md5Checksum': f"md5-img-{parent_id}-{i}",
+                         'imageMediaMetadata': {'time': '2024:03:05 08:30:00'}}
+            entry['parents'] = [parent_id]
+            entry['thumbnailLink'] = f"{self.base_url}/thumbnails/{entry['id']}"
+            files.append(entry)
+        return files
+
+    def _list(self, params):
+        self._count('list_requests')
+        q = params.get('q', '')
+        match = _PARENT_RE.search(q)
+        files = self.list_children(_unquote(match.group(1))) if match else []
+        name = _NAME_RE.search(q)
+        if name:
+            # Tìm thư mục con theo tên (lookup_folders)
+            files = [f for f in files if f['mimeType'] == FOLDER_MIME_TYPE and f['name'] == _unquote(name.group(1))]
+        start = int(params.get('pageToken') or 0)
+        size = int(params.get('pageSize') or 100)
+        body = {'files': files[start:start + size]}
+        if start + size < len(files):
+            body['nextPageToken'] = str(start + size)
+        return 200, body
+
+    def api_call(self, method, path, params, body):
+        # Một lệnh files.* (gọi thẳng hoặc nằm trong batch). Trả về (status, body JSON).
+        path = path.rstrip('/')
+        if path.endswith('/changes/startPageToken'):
+            return 200, {'startPageToken': self.start_page_token()}
+        if path.endswith('/changes'):
+            return self.list_changes(params.get('pageToken'), int(params.get('pageSize') or 100))
+        if path.endswith('/files'):
+            if method == 'POST':
+                parents = (body or {}).get('parents') or []
+                file_id = self.add_file(body.get('name'), body.get('mimeType'), parents)
+                return 200, {'id': file_id}
+            return self._list(params)
+        file_id = urllib.parse.unquote(path.rsplit('/', 1)[-1])
+        if method == 'PATCH':
+            entry = self.move(file_id, [p for p in params.get('addParents', '').split(',') if p],
+                              [p for p in params.get('removeParents', '').split(',') if p])
+        else:
+            entry = self.file_metadata(file_id)
+        if entry is None:
+            return 404, {'error': {'code': 404, 'message': f"File not found: {file_id}."}}
+        return 200, entry
+
+    def media(self, file_id):
+        # Nội dung file (SyntheticMP4 hoặc _Blob) hoặc None
+        with self._lock:
+            content = self._contents.get(file_id)
+        if content is not None:
+            return _Blob(content)
+        match = _VIDEO_RE.match(file_id)
+        if match:
+            return SyntheticMP4(int(match.group(1)), faststart=match.group(2) == 'fast')
+        return None
+
+    def _batch(self, content_type, payload):
+        # Tách request multipart/mixed thành các lệnh, trả về body multipart/mixed
+        boundary = content_type.split('boundary=', 1)[-1].strip().strip('"')
+        answers = []
+        for part in payload.decode('utf-8').split(f"--{boundary}"):
+            part = part.strip()
+            if not part or part == '--':
+                continue
+            outer, _, inner = part.replace('\r\n', '\n').partition('\n\n')
+            content_id = next((line.split(':', 1)[1].strip() for line in outer.split('\n')
+                               if line.lower().startswith('content-id:')), '')
+            request_line, _, rest = inner.partition('\n')
+            method, target = request_line.split()[:2]
+            _, _, json_body = rest.partition('\n\n')
+            url = urllib.parse.urlparse(target)
+            status, body = self.api_call(method, url.path, dict(urllib.parse.parse_qsl(url.query)),
+                                         json.loads(json_body) if json_body.strip() else None)
+            answers.append(f"--{boundary}\r\nContent-Type: application/http\r\n"
+                           f"Content-ID: <response-{content_id.strip('<>')}>\r\n\r\n"
+                           f"HTTP/1.1 {status} {'OK' if status < 400 else 'Error'}\r\n"
+                           f"Content-Type: application/json; charset=UTF-8\r\n\r\n{json.dumps(body)}\r\n")
+        return boundary, (''.join(answers) + f"--{boundary}--\r\n").encode('utf-8')
+
+    def _handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Gửi header và body ngay, không để Nagle/delayed ACK thêm ~40 ms mỗi request
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=UTF-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _authorized(self):
+                header = self.headers.get('Authorization', '')
+                if not header.startswith('Bearer ') or (
+                        server.access_token is not None and header[len('Bearer '):] != server.access_token):
+                    self._send_json(401, {'error': {'code': 401, 'message': 'Invalid Credentials'}})
+                    return False
+                return True
+
+            def _read_body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def do_GET(self):
+                server._count('requests')
+                if not self._authorized():
+                    return
+                url = urllib.parse.urlparse(self.path)
+                params = dict(urllib.parse.parse_qsl(url.query))
+                if params.get('alt') == 'media':
+                    return self._media(urllib.parse.unquote(url.path.rstrip('/').rsplit('/', 1)[-1]))
+                self._send_json(*server.api_call('GET', url.path, params, None))
+
+            def do_POST(self):
+                server._count('requests')
+                payload = self._read_body()
+                if not self._authorized():
+                    return
+                url = urllib.parse.urlparse(self.path)
+                if url.path.startswith('/batch/'):
+                    server._count('batch_requests')
+                    boundary, data = server._batch(self.headers.get('Content-Type', ''), payload)
+                    self.send_response(200)
+                    self.send_header('Content-Type', f'multipart/mixed; boundary={boundary}')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+                self._send_json(*server.api_call('POST', url.path, dict(urllib.parse.parse_qsl(url.query)),
+                                                 json.loads(payload) if payload else None))
+
+            def do_PATCH(self):
+                server._count('requests')
+                self._read_body()
+                if not self._authorized():
+                    return
+                url = urllib.parse.urlparse(self.path)
+                self._send_json(*server.api_call('PATCH', url.path, dict(urllib.parse.parse_qsl(url.query)), None))
+
+            def _media(self, file_id):
+                content = server.media(file_id)
+                if content is None:
+                    return self._send_json(404, {'error': {'code': 404, 'message': f"File not found: {file_id}."}})
+                server._count('media_requests')
+                if server.media_delay:
+                    time.sleep(server.media_delay)
+                start, end = 0, content.size
+                range_header = self.headers.get('Range', '')
+                if range_header.startswith('bytes='):
+                    first, _, last = range_header[len('bytes='):].partition('-')
+                    start = int(first)
+                    end = min(int(last) + 1, content.size) if last else content.size
+                    if start >= content.size:
+                        self.send_response(416)
+                        self.send_header('Content-Range', f"bytes */{content.size}")
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', f"bytes {start}-{end - 1}/{content.size}")
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Type', (server.file_metadata(file_id) or {}).get('mimeType', 'video/mp4'))
+                self.send_header('Content-Length', str(end - start))
+                self.end_headers()
+                try:
+                    for chunk in content.read(start, end):
+                        self.wfile.write(chunk)
+                        server._count('bytes_sent', len(chunk))
+                except (BrokenPipeError, ConnectionResetError):
+                    # Client chỉ đọc phần đầu rồi đóng kết nối
+                    self.close_connection = True
+
+        return Handler
@@ -0,0 +1,184 @@
+# Đo chi phí CPU và số byte của danh sách lịch lớn theo từng cách đọc, mã hoá và nén.
+#
+#   python benchmarks/list_encoding_bench.py --rows 100000 --runs 5 --output encoding.json
+#
+# Mỗi loại lịch (định kỳ, đột xuất) có --rows dòng. Trong process, so sánh:
+#   orm_jsonify      cách cũ: object ORM đầy đủ + serializer + jsonify (json chuẩn)
+#   columns_fastjson chỉ đọc các cột cần (tuple) + fast_json (orjson nếu có)
+#   columns_stream   như trên nhưng đọc và mã hoá từng khối như endpoint (yield_per)
+# hai cách đầu tách riêng thời gian truy vấn và mã hoá (cột JSON đọc bằng fast_json ở cả
+# hai). Giữ cả 100k dòng trong bộ nhớ cùng lúc làm GC chạy lâu hơn nên stream rẻ hơn. Sau
+# đó gọi GET qua Flask test client với từng Accept-Encoding (identity, gzip, br nếu đã
+# cài brotli) để đo CPU cả request và số byte thực gửi đi. CPU là time.process_time()
+# của process (benchmark chạy một luồng).
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from api_bench import git_revision
+from schedule_conflicts import generate
+
+KINDS = ('recurring', 'one-off')
+
+
+def timed(fn):
+    # Dọn rác của lần đo trước (100k object ORM) để không tính vào lần đo này
+    gc.collect()
+    wall, cpu = time.perf_counter(), time.process_time()
+    value = fn()
+    return value, (time.perf_counter() - wall) * 1000, (time.process_time() - cpu) * 1000
+
+
+def seed(backend, rows, seed_value):
+    # generate() chia đôi số dòng cho hai loại lịch
+    recurring, one_off = generate(rows * 2, seed_value)
+    with backend.app.app_context():
+        backend.RecurringSchedule.query.delete()
+        backend.OneOffSchedule.query.delete()
+        backend.db.session.bulk_insert_mappings(backend.RecurringSchedule, [{
+            'school_name': e['schoolName'], 'class_name': e['className'], 'days_of_week': e['daysOfWeek'],
+            'start_time': e['startTime'], 'end_time': e['endTime'],
+            'expiry_date': datetime.date.fromisoformat(e['expiryDate']) if e['expiryDate'] else None,
+        } for e in recurring])
+        backend.db.session.bulk_insert_mappings(backend.OneOffSchedule, [{
+            'school_name': e['schoolName'], 'class_name': e['className'],
+            'date': datetime.date.fromisoformat(e['date']), 'start_time': e['startTime'], 'end_time': e['endTime'],
+        } for e in one_off])
+        backend.bump_schedule_revision()
+        backend.db.session.commit()
+
+
+def list_spec(backend, kind):
+    # (model, serializer cho object ORM, serializer cho tuple, các cột, thứ tự sắp xếp)
+    if kind == 'recurring':
+        model = backend.RecurringSchedule
+        return (model, backend.serialize_recurring, backend.serialize_recurring_row, backend.RECURRING_LIST_COLUMNS,
+                [model.school_name, model.class_name, model.id])
+    model = backend.OneOffSchedule
+    return (model, backend.serialize_one_off, backend.serialize_one_off_row, backend.ONE_OFF_LIST_COLUMNS,
+            [model.date, model.start_time, model.id])
+
+
+def measure_in_process(backend, kind):
+    model, serializer, row_serializer, columns, sort_columns = list_spec(backend, kind)
+    results = {}
+    with backend.app.app_context():
+        rows, query_ms, query_cpu = timed(lambda: model.query.order_by(*sort_columns).all())
+        body, encode_ms, encode_cpu = timed(lambda: backend.jsonify([serializer(s) for s in rows]).get_data())
+        results['orm_jsonify'] = {"query_ms": query_ms, "encode_ms": encode_ms, "cpu_ms": query_cpu + encode_cpu,
+                                  "bytes": len(body), "rows": len(rows)}
+        backend.db.session.expunge_all()
+
+        rows, query_ms, query_cpu = timed(lambda: backend.db.session.query(*columns).order_by(*sort_columns).all())
+        body, encode_ms, encode_cpu = timed(lambda: b''.join(backend.fast_json.iter_array(
+            (row_serializer(s) for s in rows), backend.JSON_STREAM_CHUNK)))
+        results['columns_fastjson'] = {"query_ms": query_ms, "encode_ms": encode_ms, "cpu_ms": query_cpu + encode_cpu,
+                                       "bytes": len(body), "rows": len(rows)}
+        del rows
+
+        body, total_ms, total_cpu = timed(lambda: b''.join(backend.fast_json.iter_array(
+            (row_serializer(s) for s in backend.db.session.query(*columns).order_by(*sort_columns).yield_per(
+                backend.JSON_STREAM_CHUNK)), backend.JSON_STREAM_CHUNK)))
+        results['columns_stream'] = {"total_ms": total_ms, "cpu_ms": total_cpu, "bytes": len(body)}
+    return results
+
+
+def measure_http(backend, client, token, kind, encoding):
+    def call():
+        response = client.get(f"/api/{kind}-schedules", headers={'x-access-token': token, 'Accept-Encoding': encoding})
+        data = response.get_data()
+        response.close()
+        return response.headers.get('Content-Encoding', 'identity'), len(data)
+
+    (sent_encoding, size), wall_ms, cpu_ms = timed(call)
+    return {"wall_ms": wall_ms, "cpu_ms": cpu_ms, "bytes": size, "content_encoding": sent_encoding}
+
+
+def median_of(runs):
+    # Trung vị từng trường số qua các lần chạy
+    first = runs[0]
+    return {key: round(statistics.median(run[key] for run in runs), 1) if isinstance(value, (int, float)) else value
+            for key, value in first.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000, help="số dòng mỗi loại lịch")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database-url', help="mặc định: SQLite tạm")
+    parser.add_argument('--reset', action='store_true', help="xoá lịch hiện có (bắt buộc với DB không phải SQLite tạm)")
+    parser.add_argument('--output', help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        args.database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='teacher-encoding-'), 'bench.db')}"
+    elif not args.reset:
+        parser.error("--database-url cần kèm --reset (mọi lịch sẽ bị xoá); hãy dùng DB riêng cho benchmark")
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret')
+    os.environ['METRICS_DIR'] = ''
+    os.environ.setdefault('LOGIN_IP_RATE', '1000000')
+
+    import app as backend
+    import compression
+    backend.create_app()
+    print(f"-- Tạo {args.rows} lịch mỗi loại")
+    seed(backend, args.rows, args.seed)
+    client = backend.app.test_client()
+    login = client.post('/api/auth/login', json={'username': 'admin', 'password': 'password'})
+    token = login.get_json()['apiToken']
+
+    encodings = ['identity', 'gzip'] + (['br'] if compression.brotli is not None else [])
+    results = {}
+    for kind in KINDS:
+        in_process = [measure_in_process(backend, kind) for _ in range(args.runs)]
+        results[kind] = {name: median_of([run[name] for run in in_process]) for name in in_process[0]}
+        for encoding in encodings:
+            measure_http(backend, client, token, kind, encoding)
+            results[kind][f"http_{encoding}"] = median_of(
+                [measure_http(backend, client, token, kind, encoding) for _ in range(args.runs)])
+        for name, values in results[kind].items():
+            print(f"{kind:<10} {name:<18} " + "  ".join(
+                f"{key} {value}" for key, value in values.items() if key != 'rows'))
+
+    derived = {}
+    for kind, values in results.items():
+        legacy, columns = values['orm_jsonify'], values['columns_fastjson']
+        derived[kind] = {
+            "cpu_saved_pct": round(100 * (1 - values['columns_stream']['cpu_ms'] / legacy['cpu_ms']), 1)
+            if legacy['cpu_ms'] else None,
+            "encode_speedup": round(legacy['encode_ms'] / columns['encode_ms'], 1) if columns['encode_ms'] else None,
+        }
+        for encoding in encodings[1:]:
+            derived[kind][f"{encoding}_bytes_saved_pct"] = round(
+                100 * (1 - values[f"http_{encoding}"]['bytes'] / values['http_identity']['bytes']), 1)
+        print(f"{kind:<10} " + "  ".join(f"{key} {value}" for key, value in derived[kind].items()))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                "meta": {
+                    "started_at": datetime.datetime.utcnow().replace(microsecond=0).isoformat() + 'Z',
+                    "git_revision": git_revision(), "python": platform.python_version(),
+                    "platform": platform.platform(), "cpu_count": os.cpu_count(), "rows": args.rows,
+                    "runs": args.runs, "orjson": backend.fast_json.orjson is not None,
+                    "brotli": compression.brotli is not None,
+                    "database": backend.db.engine.dialect.name,
+                },
+                "derived": derived, "results": results,
+            }, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
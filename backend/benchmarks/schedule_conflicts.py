@@ -0,0 +1,91 @@
+# Đo thời gian kiểm tra trùng lịch trên dữ liệu giả lập.
+#
+#   python benchmarks/schedule_conflicts.py --entries 50000
+#
+# In thời gian dựng chỉ mục, rà toàn bộ (sweep-line) và kiểm tra từng lịch khi ghi
+# (trung bình mỗi lần gọi find_conflicts), không cần DB.
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schedule_index import ScheduleIndex
+
+
+def _hhmm(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def generate(entries, seed):
+    # Nửa định kỳ, nửa đột xuất, mô phỏng nhiều năm dữ liệu: 80% lịch định kỳ là thời
+    # khoá biểu cũ đã hết hạn, lịch đột xuất trải trong 4 năm.
+    # Giờ học 45-90 phút, bắt đầu theo bước 15 phút trong khoảng 6h-18h.
+    rnd = random.Random(seed)
+    today = datetime.date.today()
+    recurring, one_off = [], []
+    for i in range(1, entries // 2 + 1):
+        start = rnd.randrange(6 * 4, 18 * 4) * 15
+        roll = rnd.random()
+        if roll < 0.8:
+            expiry = (today - datetime.timedelta(days=rnd.randrange(1, 3 * 365))).isoformat()
+        elif roll < 0.9:
+            expiry = (today + datetime.timedelta(days=rnd.randrange(0, 365))).isoformat()
+        else:
+            expiry = None
+        recurring.append({
+            'id': i, 'schoolName': f"School {i % 500}", 'className': f"Class {i}",
+            'daysOfWeek': sorted(rnd.sample(['1', '2', '3', '4', '5', '6', '7'], rnd.randrange(1, 4))),
+            'startTime': _hhmm(start), 'endTime': _hhmm(start + rnd.choice((45, 60, 90))), 'expiryDate': expiry,
+        })
+    for i in range(1, entries - entries // 2 + 1):
+        start = rnd.randrange(6 * 4, 18 * 4) * 15
+        one_off.append({
+            'id': i, 'schoolName': f"School {i % 500}", 'className': f"Class {i}",
+            'date': (today + datetime.timedelta(days=rnd.randrange(-3 * 365, 365))).isoformat(),
+            'startTime': _hhmm(start), 'endTime': _hhmm(start + rnd.choice((45, 60, 90))),
+        })
+    return recurring, one_off
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=50000)
+    parser.add_argument('--checks', type=int, default=2000, help="số lần kiểm tra khi ghi")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    recurring, one_off = generate(args.entries, args.seed)
+    today = datetime.date.today()
+    index = ScheduleIndex()
+
+    started = time.perf_counter()
+    index.rebuild(recurring, one_off, revision=1)
+    rebuild_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    found = index.conflicts(today, limit=1000)
+    audit_ms = (time.perf_counter() - started) * 1000
+
+    rnd = random.Random(args.seed + 1)
+    samples = [('recurring', e) for e in rnd.sample(recurring, min(args.checks // 2, len(recurring)))]
+    samples += [('one-off', e) for e in rnd.sample(one_off, min(args.checks - len(samples), len(one_off)))]
+    found_per_check = 0
+    started = time.perf_counter()
+    for schedule_type, entry in samples:
+        found_per_check += len(index.find_conflicts(schedule_type, entry, today))
+    check_us = (time.perf_counter() - started) * 1e6 / max(len(samples), 1)
+    found_per_check /= max(len(samples), 1)
+
+    print(f"entries:            {args.entries} ({len(recurring)} định kỳ, {len(one_off)} đột xuất)")
+    print(f"rebuild index:      {rebuild_ms:.1f} ms")
+    print(f"full audit:         {audit_ms:.1f} ms "
+          f"({found['recurring'][0]} cặp định kỳ, {found['oneOff'][0]} cặp đột xuất)")
+    print(f"check on write:     {check_us:.1f} µs / lần (trung bình {found_per_check:.1f} lịch trùng)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# Nén body response theo Accept-Encoding của client: brotli ("br", nếu đã cài gói
+# brotli) hoặc gzip. Danh sách lịch dạng JSON lặp lại tên trường ở mỗi dòng nên nén được
+# 10-20 lần; response stream được nén theo từng khối khi gửi đi.
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def negotiate(accept_encodings):
+    # accept_encodings: request.accept_encodings của werkzeug. Trả về None nếu không nén.
+    if brotli is not None and accept_encodings.quality('br') > 0:
+        return 'br'
+    if accept_encodings.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding, level):
+        if encoding == 'br':
+            inner = brotli.Compressor(quality=level)
+            self.compress, self.flush = inner.process, inner.finish
+        else:
+            # wbits=31: định dạng gzip (header + CRC) thay vì zlib thô
+            inner = zlib.compressobj(level, zlib.DEFLATED, 31)
+            self.compress, self.flush = inner.compress, inner.flush
+
+
+def compress(data, encoding, level):
+    compressor = _Compressor(encoding, level)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding, level, on_done=None):
+    # Nén iterable các khối bytes; on_done(số byte gốc, số byte đã nén) khi gửi xong
+    compressor = _Compressor(encoding, level)
+    raw = sent = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            raw += len(chunk)
+            out = compressor.compress(chunk)
+            if out:
+                sent += len(out)
+                yield out
+        out = compressor.flush()
+        sent += len(out)
+        yield out
+        if on_done:
+            on_done(raw, sent)
+    finally:
+        # Client ngắt giữa chừng: vẫn đóng generator gốc (stream_with_context, call_on_close)
+        close = getattr(chunks, 'close', None)
+        if close:
+            close()
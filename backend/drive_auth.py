@@ -0,0 +1,138 @@
+# Token Google Drive phía server cho từng người dùng.
+#
+# Access token của Google chỉ sống khoảng một giờ. Token được giữ trong bộ nhớ kèm
+# thời điểm hết hạn và được làm mới chủ động (trước khi hết hạn REFRESH_MARGIN_SECONDS
+# giây) bằng refresh token đã lưu, nên job dài hay một loạt request không bị 401
+# giữa chừng. Mỗi người dùng một khoá: nhiều luồng cùng cần token mới thì chỉ một
+# luồng gọi Google, các luồng còn lại chờ rồi dùng lại kết quả.
+import os
+import threading
+import time
+
+import requests
+
+from drive_client import DriveError
+
+GOOGLE_TOKEN_URL = os.environ.get('GOOGLE_TOKEN_URL', 'https://oauth2.googleapis.com/token')
+REFRESH_MARGIN_SECONDS = 300
+
+
+class DriveAuthError(DriveError):
+    # Không có token dùng được và không làm mới được (chưa cấp quyền, refresh token bị
+    # thu hồi, thiếu client secret...). Xử lý như Drive trả 401.
+    def __init__(self, message):
+        super().__init__(message, status=401)
+
+
+def request_token(params, http=None):
+    response = (http or requests).post(GOOGLE_TOKEN_URL, data=params, timeout=30)
+    try:
+        body = response.json()
+    except ValueError:
+        body = {}
+    if response.status_code >= 400 or 'access_token' not in body:
+        raise DriveAuthError(body.get('error_description') or body.get('error')
+                             or f"Google token endpoint lỗi {response.status_code}")
+    return body
+
+
+def refresh_access_token(refresh_token, client_id, client_secret, http=None):
+    return request_token({'grant_type': 'refresh_token', 'refresh_token': refresh_token,
+                          'client_id': client_id, 'client_secret': client_secret}, http=http)
+
+
+def exchange_code(code, client_id, client_secret, redirect_uri='postmessage', http=None):
+    # Đổi authorization code (Google Identity Services, ux_mode popup) lấy access token
+    # và refresh token
+    return request_token({'grant_type': 'authorization_code', 'code': code, 'redirect_uri': redirect_uri,
+                          'client_id': client_id, 'client_secret': client_secret}, http=http)
+
+
+class DriveTokenManager:
+    # load(user_id) -> (access_token, refresh_token, expires_at) với expires_at là epoch
+    # giây hoặc None nếu không biết; save(user_id, access_token, expires_at) lưu token mới;
+    # credentials() -> (client_id, client_secret).
+    def __init__(self, load, save, credentials, http=None, margin=REFRESH_MARGIN_SECONDS):
+        self._load = load
+        self._save = save
+        self._credentials = credentials
+        self._http = http
+        self.margin = margin
+        self._tokens = {}
+        self._rejected = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.refreshes = 0
+
+    def _usable(self, user_id, access_token, expires_at):
+        if not access_token or access_token in self._rejected.get(user_id, ()):
+            return False
+        return expires_at is None or expires_at - self.margin > time.time()
+
+    def _user_lock(self, user_id):
+        with self._lock:
+            return self._locks.setdefault(user_id, threading.Lock())
+
+    def get(self, user_id):
+        entry = self._tokens.get(user_id)
+        if entry and self._usable(user_id, *entry):
+            return entry[0]
+        with self._user_lock(user_id):
+            entry = self._tokens.get(user_id)
+            if entry and self._usable(user_id, *entry):
+                return entry[0]
+            # Worker khác có thể vừa làm mới và lưu vào DB
+            access_token, refresh_token, expires_at = self._load(user_id)
+            if self._usable(user_id, access_token, expires_at):
+                self._tokens[user_id] = (access_token, expires_at)
+                return access_token
+            client_id, client_secret = self._credentials()
+            if not refresh_token or not client_id or not client_secret:
+                if access_token and access_token not in self._rejected.get(user_id, ()):
+                    # Không làm mới được: dùng token hiện có, Drive sẽ trả 401 nếu đã hết hạn
+                    self._tokens[user_id] = (access_token, None)
+                    return access_token
+                raise DriveAuthError("Token Google Drive hết hạn hoặc chưa được cấp, hãy cấp quyền lại")
+            data = refresh_access_token(refresh_token, client_id, client_secret, http=self._http)
+            self.refreshes += 1
+            return self._store(user_id, data['access_token'], data.get('expires_in'))
+
+    def _store(self, user_id, access_token, expires_in):
+        expires_at = time.time() + int(expires_in) if expires_in else None
+        self._save(user_id, access_token, expires_at)
+        self._tokens[user_id] = (access_token, expires_at)
+        self._rejected.pop(user_id, None)
+        return access_token
+
+    def set(self, user_id, access_token, expires_in=None):
+        # Token mới do trình duyệt gửi lên (đã được lưu vào DB bởi người gọi)
+        expires_at = time.time() + int(expires_in) if expires_in else None
+        self._tokens[user_id] = (access_token, expires_at)
+        self._rejected.pop(user_id, None)
+
+    def invalidate(self, user_id, access_token):
+        # Drive trả 401 với token này: lần get() sau sẽ làm mới. Không làm gì nếu token
+        # đã được luồng khác thay trước đó.
+        with self._lock:
+            entry = self._tokens.get(user_id)
+            if entry is None or entry[0] == access_token:
+                self._rejected.setdefault(user_id, set()).add(access_token)
+                self._tokens.pop(user_id, None)
+
+    def forget(self, user_id):
+        self._tokens.pop(user_id, None)
+        self._rejected.pop(user_id, None)
+
+
+class UserToken:
+    # Token của một người dùng cho drive_client: gọi để lấy token hiện tại (tự làm mới),
+    # invalidate() khi Drive từ chối token đó.
+    def __init__(self, manager, user_id):
+        self.manager = manager
+        self.user_id = user_id
+
+    def __call__(self):
+        return self.manager.get(self.user_id)
+
+    def invalidate(self, access_token):
+        self.manager.invalidate(self.user_id, access_token)
@@ -0,0 +1,406 @@
+# Gọi Google Drive API v3 từ backend: liệt kê ảnh/video trong thư mục, đọc changes
+# feed, tìm hoặc tạo thư mục con và di chuyển file.
+#
+# Di chuyển file và tìm/tạo thư mục được gom thành batch request multipart/mixed
+# (tối đa BATCH_MAX_CALLS lệnh mỗi request) thay vì mỗi file một round-trip HTTPS.
+# Lỗi giới hạn tốc độ (403 rateLimitExceeded, 429) và lỗi 5xx được thử lại với
+# exponential backoff có jitter, cho cả request đơn lẫn từng lệnh trong batch.
+import json
+import random
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import Future
+from urllib.parse import urlencode
+
+import requests
+
+import video_probe
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+# Các trường được lưu vào chỉ mục file (bảng DriveFile)
+INDEX_FIELDS = 'id, name, mimeType, createdTime, modifiedTime, md5Checksum, imageMediaMetadata(time), parents, thumbnailLink'
+
+DRIVE_BATCH_URL = 'https://www.googleapis.com/batch/drive/v3'
+# Đường dẫn của từng lệnh bên trong batch (tương đối với www.googleapis.com)
+BATCH_FILES_PATH = '/drive/v3/files'
+BATCH_MAX_CALLS = 100
+
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 32.0
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+
+class DriveError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+# Một lệnh trong batch: method, phần đường dẫn sau /files, query params, body JSON
+BatchCall = namedtuple('BatchCall', ['method', 'suffix', 'params', 'body'])
+
+
+def _error_message(status, body):
+    error = body.get('error') if isinstance(body, dict) else None
+    if isinstance(error, dict) and error.get('message'):
+        return error['message']
+    return f"Drive API lỗi {status}"
+
+
+def _is_retryable(status, body):
+    if status == 429 or status >= 500:
+        return True
+    if status == 403 and isinstance(body, dict):
+        errors = (body.get('error') or {}).get('errors') or []
+        return any(e.get('reason') in RATE_LIMIT_REASONS for e in errors)
+    return False
+
+
+def backoff_delay(attempt):
+    # Full jitter: chờ ngẫu nhiên trong [0, min(max, base * 2^attempt)]
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+def _json_body(response):
+    try:
+        return response.json() if response.content else {}
+    except ValueError:
+        return {}
+
+
+def _bearer(access_token):
+    # access_token là chuỗi, hoặc đối tượng gọi được trả về token hiện tại và có
+    # invalidate(token) (drive_auth.UserToken) để làm mới rồi thử lại khi bị 401
+    return access_token() if callable(access_token) else access_token
+
+
+def _retry_auth(access_token, token, status, retried):
+    if status != 401 or retried or not hasattr(access_token, 'invalidate'):
+        return False
+    access_token.invalidate(token)
+    return True
+
+
+def _api_url(path):
+    # path tương đối với gốc API (/files, /changes, ...), suy ra từ DRIVE_FILES_URL
+    return video_probe.DRIVE_FILES_URL.rsplit('/files', 1)[0] + path
+
+
+def _request(method, path, access_token, http=None, params=None, json_body=None, timeout=30):
+    auth_retried = False
+    attempt = 0
+    while True:
+        token = _bearer(access_token)
+        response = (http or requests).request(
+            method, _api_url(path), params=params, json=json_body, timeout=timeout,
+            headers={'Authorization': f'Bearer {token}'})
+        body = _json_body(response)
+        if response.status_code < 400:
+            return body
+        if _retry_auth(access_token, token, response.status_code, auth_retried):
+            auth_retried = True
+            continue
+        if attempt == MAX_RETRIES or not _is_retryable(response.status_code, body):
+            raise DriveError(_error_message(response.status_code, body), status=response.status_code)
+        time.sleep(backoff_delay(attempt))
+        attempt += 1
+
+
+def _encode_batch(calls, boundary):
+    parts = []
+    for i, call in enumerate(calls):
+        path = f"{BATCH_FILES_PATH}{call.suffix}"
+        if call.params:
+            path += '?' + urlencode(call.params)
+        lines = [f"--{boundary}", 'Content-Type: application/http', f"Content-ID: <item{i}>", '',
+                 f"{call.method} {path} HTTP/1.1"]
+        if call.body is not None:
+            lines += ['Content-Type: application/json; charset=UTF-8', '', json.dumps(call.body)]
+        else:
+            lines.append('')
+        parts.append('\r\n'.join(lines) + '\r\n')
+    return ''.join(parts) + f"--{boundary}--\r\n"
+
+
+def _parse_batch(response):
+    # Trả về {chỉ số lệnh: (status, body JSON)} từ response multipart/mixed
+    content_type = response.headers.get('Content-Type', '')
+    boundary = content_type.split('boundary=', 1)[-1].strip().strip('"')
+    if 'multipart/mixed' not in content_type or not boundary:
+        raise DriveError("Batch response không hợp lệ", status=response.status_code)
+    results = {}
+    for part in response.text.split(f"--{boundary}"):
+        part = part.strip()
+        if not part or part == '--':
+            continue
+        outer_headers, _, inner = part.replace('\r\n', '\n').partition('\n\n')
+        content_id = next((line.split(':', 1)[1].strip() for line in outer_headers.split('\n')
+                           if line.lower().startswith('content-id:')), '')
+        index = content_id.strip('<>').rsplit('item', 1)[-1]
+        status_line, _, rest = inner.partition('\n')
+        _, _, body = rest.partition('\n\n')
+        try:
+            status = int(status_line.split()[1])
+        except (IndexError, ValueError):
+            continue
+        try:
+            parsed = json.loads(body) if body.strip() else {}
+        except ValueError:
+            parsed = {}
+        if index.isdigit():
+            results[int(index)] = (status, parsed)
+    return results
+
+
+def _send_batch(calls, access_token, http=None, timeout=60):
+    boundary = f"batch_{uuid.uuid4().hex}"
+    payload = _encode_batch(calls, boundary).encode('utf-8')
+    auth_retried = False
+    attempt = 0
+    while True:
+        token = _bearer(access_token)
+        response = (http or requests).post(
+            DRIVE_BATCH_URL, data=payload, timeout=timeout,
+            headers={'Authorization': f'Bearer {token}',
+                     'Content-Type': f'multipart/mixed; boundary={boundary}'})
+        if response.status_code < 400:
+            return _parse_batch(response)
+        if _retry_auth(access_token, token, response.status_code, auth_retried):
+            auth_retried = True
+            continue
+        body = _json_body(response)
+        if attempt == MAX_RETRIES or not _is_retryable(response.status_code, body):
+            raise DriveError(_error_message(response.status_code, body), status=response.status_code)
+        time.sleep(backoff_delay(attempt))
+        attempt += 1
+
+
+def execute_batch(calls, access_token, http=None):
+    # Chạy danh sách BatchCall theo từng batch BATCH_MAX_CALLS lệnh. Lệnh bị giới hạn
+    # tốc độ được gửi lại (chỉ các lệnh đó) sau khi chờ backoff. Trả về danh sách
+    # (status, body) cùng thứ tự với calls. Lỗi của cả request (401, ...) được ném ra.
+    results = [None] * len(calls)
+    for start in range(0, len(calls), BATCH_MAX_CALLS):
+        pending = list(range(start, min(start + BATCH_MAX_CALLS, len(calls))))
+        for attempt in range(MAX_RETRIES + 1):
+            answers = _send_batch([calls[i] for i in pending], access_token, http=http)
+            retry = []
+            for n, i in enumerate(pending):
+                status, body = answers.get(n, (500, {}))
+                results[i] = (status, body)
+                if status >= 400 and _is_retryable(status, body):
+                    retry.append(i)
+            if not retry or attempt == MAX_RETRIES:
+                break
+            pending = retry
+            time.sleep(backoff_delay(attempt))
+    return results
+
+
+def _check(status, body):
+    if status >= 400:
+        raise DriveError(_error_message(status, body), status=status)
+    return body
+
+
+def _quote(value):
+    # Chuỗi trong truy vấn q của Drive đặt trong dấu nháy đơn
+    return "'" + str(value).replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def is_indexed_type(mime_type):
+    # Chỉ mục chỉ giữ ảnh, video và thư mục con
+    mime_type = mime_type or ''
+    return mime_type.startswith(('image/', 'video/')) or mime_type == FOLDER_MIME_TYPE
+
+
+def list_folder(folder_id, access_token, http=None, fields=INDEX_FIELDS):
+    # Ảnh, video và thư mục con trực tiếp của folder_id (đủ mọi trang)
+    files = []
+    params = {
+        'q': f"{_quote(folder_id)} in parents and (mimeType contains 'image/' or mimeType contains 'video/' "
+             f"or mimeType = '{FOLDER_MIME_TYPE}') and trashed = false",
+        'fields': f"nextPageToken, files({fields})",
+        'pageSize': 1000,
+    }
+    while True:
+        data = _request('GET', '/files', access_token, http=http, params=params)
+        files.extend(data.get('files', []))
+        if not data.get('nextPageToken'):
+            return files
+        params['pageToken'] = data['nextPageToken']
+
+
+def get_start_page_token(access_token, http=None):
+    return _request('GET', '/changes/startPageToken', access_token, http=http)['startPageToken']
+
+
+def list_changes(page_token, access_token, http=None):
+    # Mọi thay đổi kể từ page_token. Trả về (danh sách change, token cho lần sau).
+    # Token hết hạn/không hợp lệ thì Drive trả lỗi 4xx (DriveError).
+    changes = []
+    params = {
+        'pageToken': page_token, 'pageSize': 1000, 'includeRemoved': 'true', 'spaces': 'drive',
+        'fields': f"nextPageToken, newStartPageToken, changes(fileId, removed, file({INDEX_FIELDS}, trashed))",
+    }
+    while True:
+        data = _request('GET', '/changes', access_token, http=http, params=params)
+        changes.extend(data.get('changes', []))
+        if data.get('newStartPageToken'):
+            return changes, data['newStartPageToken']
+        params['pageToken'] = data['nextPageToken']
+
+
+def _find_folder_call(parent_id, name):
+    return BatchCall('GET', '', {
+        'q': f"mimeType = '{FOLDER_MIME_TYPE}' and name = {_quote(name)} and {_quote(parent_id)} in parents and trashed = false",
+        'fields': 'files(id)', 'pageSize': 1,
+    }, None)
+
+
+def _create_folder_call(parent_id, name):
+    return BatchCall('POST', '', {'fields': 'id'}, {'name': name, 'mimeType': FOLDER_MIME_TYPE, 'parents': [parent_id]})
+
+
+def lookup_folders(keys, access_token, http=None, create=True):
+    # keys: danh sách (parent_id, name). Tìm tất cả trong một batch rồi tạo các thư
+    # mục chưa có trong batch thứ hai. Trả về {(parent_id, name): id | None | DriveError}.
+    keys = list(dict.fromkeys(keys))
+    found = {}
+    answers = execute_batch([_find_folder_call(*key) for key in keys], access_token, http=http)
+    for key, (status, body) in zip(keys, answers):
+        try:
+            files = _check(status, body).get('files') or []
+            found[key] = files[0]['id'] if files else None
+        except DriveError as e:
+            found[key] = e
+    missing = [key for key in keys if found[key] is None]
+    if create and missing:
+        answers = execute_batch([_create_folder_call(*key) for key in missing], access_token, http=http)
+        for key, (status, body) in zip(missing, answers):
+            try:
+                found[key] = _check(status, body)['id']
+            except DriveError as e:
+                found[key] = e
+    return found
+
+
+class FolderCache:
+    # Cache (parent_id, name) -> id thư mục trong phạm vi một job/một request. Nhiều
+    # luồng cùng cần một thư mục thì chỉ một luồng tìm/tạo, các luồng khác chờ kết quả.
+    def __init__(self, access_token, http=None):
+        self.access_token = access_token
+        self.http = http
+        self._folders = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, keys, create=True):
+        # Trả về {(parent_id, name): id}; với create=False thư mục chưa có trả về None
+        waiting, mine = {}, []
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                future = self._folders.get(key)
+                if future is None:
+                    future = self._folders[key] = Future()
+                    mine.append(key)
+                waiting[key] = future
+        if mine:
+            try:
+                found = lookup_folders(mine, self.access_token, http=self.http, create=create)
+            except Exception as e:
+                found = {key: e for key in mine}
+            for key in mine:
+                value = found.get(key)
+                if value is None or isinstance(value, Exception):
+                    # Không giữ kết quả lỗi/chưa có để lần sau thử lại
+                    with self._lock:
+                        self._folders.pop(key, None)
+                if isinstance(value, Exception):
+                    waiting[key].set_exception(value)
+                else:
+                    waiting[key].set_result(value)
+        return {key: future.result() for key, future in waiting.items()}
+
+    def folder(self, name, parent_id):
+        return self.resolve([(parent_id, name)])[(parent_id, name)]
+
+
+def _move_call(file_id, old_parent_id, new_parent_id):
+    return BatchCall('PATCH', f"/{file_id}", {
+        'addParents': new_parent_id, 'removeParents': old_parent_id, 'fields': 'id, parents'}, None)
+
+
+def move_files(moves, access_token, http=None):
+    # moves: danh sách (file_id, thư mục cũ, thư mục mới). Trả về danh sách cùng thứ
+    # tự, mỗi phần tử là None nếu thành công hoặc DriveError.
+    answers = execute_batch([_move_call(*move) for move in moves], access_token, http=http)
+    return [None if status < 400 else DriveError(_error_message(status, body), status=status)
+            for status, body in answers]
+
+
+class MoveBatcher:
+    # Gom lệnh di chuyển do nhiều luồng gửi tới thành batch request. Batch được gửi
+    # khi đủ BATCH_MAX_CALLS lệnh hoặc sau `linger` giây kể từ lệnh cũ nhất đang chờ.
+    # submit() trả về Future; callback của Future chạy trên luồng gửi batch.
+    def __init__(self, access_token, http=None, linger=0.5):
+        self.access_token = access_token
+        self.http = http
+        self.linger = linger
+        self._pending = []
+        self._first_at = None
+        self._closed = False
+        self._changed = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='drive-move-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, file_id, old_parent_id, new_parent_id):
+        future = Future()
+        with self._changed:
+            if self._closed:
+                raise RuntimeError("MoveBatcher đã đóng")
+            if not self._pending:
+                self._first_at = time.monotonic()
+            self._pending.append(((file_id, old_parent_id, new_parent_id), future))
+            # Lệnh đầu tiên đánh thức luồng gửi để bắt đầu đếm linger; đủ batch thì gửi ngay
+            if len(self._pending) == 1 or len(self._pending) >= BATCH_MAX_CALLS:
+                self._changed.notify()
+        return future
+
+    def close(self):
+        # Gửi nốt các lệnh còn lại và chờ tất cả hoàn tất
+        with self._changed:
+            self._closed = True
+            self._changed.notify()
+        self._thread.join()
+
+    def _take(self):
+        with self._changed:
+            while len(self._pending) < BATCH_MAX_CALLS and not self._closed:
+                if not self._pending:
+                    self._changed.wait()
+                    continue
+                remaining = self._first_at + self.linger - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+            batch, self._pending = self._pending[:BATCH_MAX_CALLS], self._pending[BATCH_MAX_CALLS:]
+            self._first_at = time.monotonic() if self._pending else None
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            if not batch:
+                return
+            try:
+                errors = move_files([move for move, _ in batch], self.access_token, http=self.http)
+            except Exception as e:
+                errors = [e] * len(batch)
+            for (_, future), error in zip(batch, errors):
+                if error is None:
+                    future.set_result(True)
+                else:
+                    future.set_exception(error)
@@ -0,0 +1,45 @@
+# Mã hoá JSON cho các endpoint danh sách lớn (lịch học, người dùng).
+#
+# Dùng orjson nếu đã cài: với danh sách hàng chục nghìn dòng, orjson nhanh hơn json chuẩn
+# (mà jsonify dùng) nhiều lần và trả thẳng bytes UTF-8. Không có orjson thì dùng json
+# chuẩn với cùng định dạng gọn (không khoảng trắng, giữ nguyên ký tự tiếng Việt).
+# iter_array mã hoá từng khối dòng để stream danh sách lớn mà không dựng cả body;
+# dumps_text/loads dùng cho cột JSON của SQLAlchemy (json_serializer/json_deserializer).
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(value):
+    # Trả về bytes UTF-8
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def dumps_text(value):
+    # Như dumps nhưng trả về str (cho json_serializer của SQLAlchemy)
+    return dumps(value).decode('utf-8')
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def iter_array(items, chunk_size=1000):
+    # Mảng JSON của `items` theo từng khối bytes, mỗi khối chunk_size phần tử
+    yield b'['
+    chunk, separator = [], b''
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield separator + dumps(chunk)[1:-1]
+            chunk, separator = [], b','
+    if chunk:
+        yield separator + dumps(chunk)[1:-1]
+    yield b']'
@@ -0,0 +1,94 @@
+# Xác thực Google ID token với session HTTP dùng chung và cache chứng chỉ ký.
+#
+# google.oauth2.id_token tải lại chứng chỉ của Google ở mỗi lần xác thực nếu ta
+# truyền vào một google_requests.Request() mới. Ở đây transport được tạo một lần,
+# giữ kết nối keep-alive và nhớ chứng chỉ theo max-age trong Cache-Control mà
+# Google trả về, nên đợt đăng nhập buổi sáng chỉ tải chứng chỉ một lần.
+#
+# google.auth/google.oauth2 (kéo theo cryptography, pyasn1...) chỉ được nạp ở lần xác
+# thực đầu tiên để worker khởi động nhanh.
+import os
+import re
+import threading
+import time
+
+import requests
+
+GOOGLE_CERTS_URL = os.environ.get('GOOGLE_CERTS_URL', 'https://www.googleapis.com/oauth2/v1/certs')
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+_MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+def _max_age(headers):
+    cache_control = headers.get('Cache-Control', '') or ''
+    if 'no-store' in cache_control or 'no-cache' in cache_control:
+        return 0
+    match = _MAX_AGE_RE.search(cache_control)
+    if not match:
+        return 0
+    # Age: số giây response đã nằm trong cache trung gian
+    age = headers.get('Age', '0')
+    return max(0, int(match.group(1)) - (int(age) if str(age).isdigit() else 0))
+
+
+class CachingRequest:
+    # Transport cho google-auth (cùng giao diện google.auth.transport.Request): GET thành
+    # công được cache theo Cache-Control.
+    def __init__(self, session=None):
+        self._session = session
+        self._transport = None
+        self._cache = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.fetches = 0
+
+    @property
+    def _inner(self):
+        if self._transport is None:
+            from google.auth.transport import requests as google_requests
+            self._transport = google_requests.Request(session=self._session or requests.Session())
+        return self._transport
+
+    def __call__(self, url, method='GET', body=None, headers=None, timeout=30, **kwargs):
+        if method != 'GET' or body is not None:
+            return self._inner(url, method=method, body=body, headers=headers, timeout=timeout, **kwargs)
+
+        with self._lock:
+            cached = self._cache.get(url)
+            if cached and cached[1] > time.monotonic():
+                self.hits += 1
+                return cached[0]
+
+        response = self._inner(url, method=method, headers=headers, timeout=timeout, **kwargs)
+        with self._lock:
+            self.fetches += 1
+            max_age = _max_age(response.headers) if response.status == 200 else 0
+            if max_age:
+                self._cache[url] = (response, time.monotonic() + max_age)
+            else:
+                self._cache.pop(url, None)
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+class GoogleTokenVerifier:
+    def __init__(self, certs_url=GOOGLE_CERTS_URL, session=None):
+        self.certs_url = certs_url
+        self.request = CachingRequest(session=session)
+
+    def verify(self, token, audience):
+        # Giống id_token.verify_oauth2_token nhưng dùng transport có cache
+        from google.auth import exceptions
+        from google.oauth2 import id_token
+        id_info = id_token.verify_token(token, self.request, audience=audience, certs_url=self.certs_url)
+        if id_info.get('iss') not in GOOGLE_ISSUERS:
+            raise exceptions.GoogleAuthError(
+                "Wrong issuer. 'iss' should be one of the following: {}".format(GOOGLE_ISSUERS))
+        return id_info
+
+    def stats(self):
+        return {'cert_cache_hits': self.request.hits, 'cert_fetches': self.request.fetches}
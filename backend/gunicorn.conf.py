@@ -0,0 +1,86 @@
+# Cấu hình gunicorn cho production, chạy trong thư mục backend:
+#
+#   gunicorn -c gunicorn.conf.py
+#
+# Mặc định dùng worker gthread: mỗi worker nhiều luồng nên một request dài (tải video cho
+# ffprobe, phân tích ảnh, job sắp xếp) không chặn các request khác. Các đường I/O Drive
+# dùng requests/subprocess, nhả GIL khi chờ mạng nên luồng là đủ; phần tính toán ảnh
+# chạy trong process pool riêng. GUNICORN_WORKER_CLASS=gevent dùng greenlet (cần cài
+# gevent, và psycogreen nếu dùng Postgres), sync là kiểu cũ một request mỗi worker.
+#
+# preload_app: master import app.py (module tạo app, route và engine DB ngay khi import)
+# và chạy create_app() (tạo bảng, dữ liệu mặc định) một lần rồi mới fork, nên worker khởi
+# động nhanh và không tranh nhau tạo bảng. Worker thừa hưởng mọi thứ master đã tạo;
+# post_fork bỏ các kết nối DB/HTTP thừa hưởng đó. create_app() không phải app factory.
+import glob
+import multiprocessing
+import os
+import sys
+
+cores = multiprocessing.cpu_count()
+
+bind = f"0.0.0.0:{os.environ.get('BACKEND_PORT', '5001')}"
+wsgi_app = 'app:create_app()'
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') not in ('0', 'false')
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class == 'gevent':
+    try:
+        # Phải patch trước khi preload nạp app, nếu không các lock/luồng tạo lúc import
+        # (cache, pool HTTP, thread pool) là lock thật và có thể chặn cả worker
+        from gevent import monkey
+        monkey.patch_all()
+    except ImportError:
+        print("gevent chưa được cài, dùng worker gthread", file=sys.stderr)
+        worker_class = 'gthread'
+    else:
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            pass
+
+# app.py suy ra giới hạn admission control (HEAVY_*, LOGIN_*) từ GUNICORN_THREADS để request
+# nặng, kể cả request đang xếp hàng, không chiếm hết luồng của worker.
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '200'))
+# gthread/gevent: mỗi worker đã xử lý song song nhiều request, số worker theo số nhân để
+# tận dụng CPU (JSON, pbkdf2); sync cần nhiều worker hơn vì mỗi worker chỉ một request.
+if worker_class == 'sync':
+    default_workers = cores * 2 + 1
+else:
+    default_workers = max(2, cores)
+workers = int(os.environ.get('WEB_CONCURRENCY', str(default_workers)))
+# app.py đọc WEB_CONCURRENCY để chia nhân CPU: mỗi worker có process pool phân tích ảnh
+# riêng (IMAGE_ANALYSIS_PROCESSES, mặc định số nhân // số worker). Đặt thẳng
+# IMAGE_ANALYSIS_PROCESSES thì tổng số process là workers x giá trị đó.
+os.environ['WEB_CONCURRENCY'] = str(workers)
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+
+
+def on_starting(server):
+    # Số liệu của các worker ở lần chạy trước (pid cũ có thể bị dùng lại) không được cộng
+    # vào lần chạy mới
+    metrics_dir = os.environ.get('METRICS_DIR')
+    if metrics_dir:
+        for path in glob.glob(os.path.join(metrics_dir, '*.json')):
+            os.remove(path)
+    server.log.info("Worker %s x %d (threads=%d), preload=%s", worker_class, workers,
+                    threads if worker_class == 'gthread' else 1, preload_app)
+
+
+def post_fork(server, worker):
+    # Chỉ có việc khi preload_app (app đã được import ở master)
+    app = sys.modules.get('app')
+    if app is not None:
+        app.reset_after_fork()
+
+
+def post_worker_init(worker):
+    # Chạy tiếp job sắp xếp bị ngắt (deploy, worker chết) ngay khi worker sẵn sàng. Không
+    # làm ở master: luồng tạo trước khi fork không sang được worker.
+    import app
+    app.start_organize_resumer()
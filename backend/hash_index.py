@@ -0,0 +1,126 @@
+# Chỉ mục tìm ảnh gần trùng theo perceptual hash 64 bit (multi-index hashing).
+#
+# Hash được chia thành 4 đoạn 16 bit, mỗi đoạn có một bảng băm riêng. Nếu hai hash
+# cách nhau không quá k bit thì theo nguyên lý Dirichlet có ít nhất một đoạn cách
+# nhau không quá k // 4 bit, nên chỉ cần dò các ô lân cận trong từng bảng rồi tính
+# khoảng cách thật (popcount của XOR) cho số ít ứng viên, thay vì so với mọi ảnh.
+
+HASH_BITS = 64
+# Thuật toán tạo hash, lưu kèm mỗi hash: cùng một ảnh, hai thuật toán cho hai hash khác
+# hẳn nhau, nên chỉ so hash cùng thuật toán
+DCT_PHASH = 'dct-phash-64'  # image_analysis (server)
+PHASH_JS = 'phash-js'  # thư viện phash-js trong trình duyệt
+ALGORITHMS = (DCT_PHASH, PHASH_JS)
+_HASH_MASK = (1 << HASH_BITS) - 1
+_SIGN_BIT = 1 << (HASH_BITS - 1)
+
+if hasattr(int, 'bit_count'):
+    def popcount(value):
+        return value.bit_count()
+else:  # Python < 3.10
+    def popcount(value):
+        return bin(value).count('1')
+
+
+def hamming(a, b):
+    return popcount(a ^ b)
+
+
+def parse_hash(value):
+    # Nhận hash dạng chuỗi nhị phân 64 ký tự (phash-js toBinary()), chuỗi hex
+    # (tối đa 16 ký tự) hoặc số nguyên. Trả về số nguyên không dấu 64 bit.
+    if isinstance(value, bool):
+        raise ValueError("hash không hợp lệ")
+    if isinstance(value, int):
+        if not 0 <= value <= _HASH_MASK:
+            raise ValueError("hash vượt quá 64 bit")
+        return value
+    if not isinstance(value, str):
+        raise ValueError("hash không hợp lệ")
+    text = value.strip().lower()
+    if text.startswith('0x'):
+        text = text[2:]
+    try:
+        if len(text) == HASH_BITS and set(text) <= {'0', '1'}:
+            return int(text, 2)
+        if 0 < len(text) <= HASH_BITS // 4:
+            return int(text, 16)
+    except ValueError:
+        pass
+    raise ValueError("hash phải là chuỗi nhị phân 64 ký tự hoặc chuỗi hex 16 ký tự")
+
+
+def to_signed(value):
+    # Lưu vào cột BIGINT (có dấu) của DB
+    return value - (1 << HASH_BITS) if value & _SIGN_BIT else value
+
+
+def from_signed(value):
+    return value & _HASH_MASK
+
+
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+_CHUNK_MASK = (1 << CHUNK_BITS) - 1
+# Bán kính dò tối đa trong mỗi đoạn (k <= 11). Ngưỡng lớn hơn thì số ô phải dò
+# còn nhiều hơn số ảnh, quét tuần tự sẽ nhanh hơn.
+MAX_PROBE_RADIUS = 2
+_PROBE_MASKS = [
+    [mask for mask in range(1 << CHUNK_BITS) if popcount(mask) <= radius]
+    for radius in range(MAX_PROBE_RADIUS + 1)
+]
+
+
+class MultiIndexHash:
+    def __init__(self):
+        self._tables = [{} for _ in range(CHUNKS)]
+        self._files_by_hash = {}
+        self._file_hashes = {}
+        # id lớn nhất của bản ghi DB đã nạp vào chỉ mục, để chỉ nạp thêm phần mới
+        self.loaded_row_id = 0
+
+    def __contains__(self, file_id):
+        return file_id in self._file_hashes
+
+    def __len__(self):
+        return len(self._file_hashes)
+
+    def add(self, hash_value, file_id):
+        if file_id in self._file_hashes:
+            return
+        self._file_hashes[file_id] = hash_value
+        same_hash = self._files_by_hash.get(hash_value)
+        if same_hash:
+            same_hash.append(file_id)
+            return
+        self._files_by_hash[hash_value] = [file_id]
+        for i, table in enumerate(self._tables):
+            table.setdefault((hash_value >> (i * CHUNK_BITS)) & _CHUNK_MASK, []).append(hash_value)
+
+    def _candidates(self, hash_value, max_distance):
+        radius = max_distance // CHUNKS
+        if radius > MAX_PROBE_RADIUS:
+            return self._files_by_hash.keys()
+        candidates = set()
+        masks = _PROBE_MASKS[radius]
+        for i, table in enumerate(self._tables):
+            chunk = (hash_value >> (i * CHUNK_BITS)) & _CHUNK_MASK
+            for mask in masks:
+                bucket = table.get(chunk ^ mask)
+                if bucket:
+                    candidates.update(bucket)
+        return candidates
+
+    def find_nearest(self, hash_value, max_distance, exclude=None):
+        # Trả về (file_id, khoảng cách) gần nhất trong phạm vi max_distance, hoặc None
+        best = None
+        for candidate in self._candidates(hash_value, max_distance):
+            distance = hamming(hash_value, candidate)
+            if distance > max_distance or (best is not None and distance >= best[1]):
+                continue
+            file_ids = [f for f in self._files_by_hash[candidate] if f != exclude]
+            if file_ids:
+                best = (file_ids[0], distance)
+                if distance == 0:
+                    break
+        return best
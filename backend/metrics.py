@@ -0,0 +1,248 @@
+# Số liệu theo dõi dạng Prometheus (text exposition format), không cần thư viện ngoài.
+#
+# Mỗi process giữ số liệu của mình trong bộ nhớ. Gunicorn chạy nhiều worker nên một
+# lần scrape chỉ rơi vào một worker: nếu có thư mục chung (MetricsExporter), mỗi worker
+# định kỳ ghi bản chụp ra <thư mục>/<pid>.json và lần scrape cộng gộp mọi file. Counter
+# và histogram của worker đã tắt vẫn được cộng (không bị giảm); gauge chỉ tính worker
+# còn sống.
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def snapshot(self):
+        with self._lock:
+            values = [[list(key), value if not isinstance(value, list) else list(value)]
+                      for key, value in self._values.items()]
+        return {"kind": self.kind, "help": self.documentation, "labels": list(self.labelnames), "values": values}
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    # Mỗi nhãn lưu [số mẫu trong từng bucket (không cộng dồn)..., +Inf, tổng, số mẫu]
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        data = super().snapshot()
+        data["buckets"] = list(self.buckets)
+        return data
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} đã tồn tại")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+def merge(snapshots):
+    # snapshots: [(bản chụp, process còn sống hay không)]
+    merged = {}
+    for snapshot, alive in snapshots:
+        for name, data in snapshot.items():
+            target = merged.setdefault(name, dict(data, values={}))
+            if data["kind"] == 'gauge' and not alive:
+                continue
+            values = target["values"]
+            for key, value in data["values"]:
+                key = tuple(key)
+                if isinstance(value, list):
+                    current = values.get(key)
+                    values[key] = list(value) if current is None else [a + b for a, b in zip(current, value)]
+                else:
+                    values[key] = values.get(key, 0) + value
+    for data in merged.values():
+        data["values"] = sorted(data["values"].items())
+    return merged
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(merged):
+    lines = []
+    for name, data in merged.items():
+        lines.append(f"# HELP {name} {data['help']}")
+        lines.append(f"# TYPE {name} {data['kind']}")
+        names = data["labels"]
+        for key, value in data["values"]:
+            if data["kind"] != 'histogram':
+                lines.append(f"{name}{_labels(names, key)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(data["buckets"]) + [float('inf')], value[:-2]):
+                cumulative += count
+                le = 'le="%s"' % _number(float(bound))
+                lines.append(f"{name}_bucket{_labels(names, key, [le])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(names, key)} {_number(float(value[-2]))}")
+            lines.append(f"{name}_count{_labels(names, key)} {value[-1]}")
+    return '\n'.join(lines) + '\n'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsExporter:
+    # Ghi bản chụp của process này ra thư mục chung và gộp bản chụp của mọi process.
+    # directory rỗng thì chỉ dùng số liệu của process hiện tại.
+    def __init__(self, registry, directory=None, interval=5.0):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self._started = False
+        self._lock = threading.Lock()
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def write(self):
+        path = self._path(os.getpid())
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.registry.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def start(self):
+        # Luồng nền ghi bản chụp định kỳ; gọi lại nhiều lần không sao. Phải gọi sau khi
+        # fork (trong worker) vì luồng không đi theo process con.
+        if not self.directory:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        os.makedirs(self.directory, exist_ok=True)
+
+        def loop():
+            while True:
+                try:
+                    self.write()
+                except OSError:
+                    pass
+                time.sleep(self.interval)
+
+        threading.Thread(target=loop, name='metrics-exporter', daemon=True).start()
+
+    def collect(self):
+        if not self.directory:
+            return merge([(self.registry.snapshot(), True)])
+        self.start()
+        own_pid = os.getpid()
+        snapshots = [(self.registry.snapshot(), True)]
+        for filename in os.listdir(self.directory):
+            pid = filename[:-len('.json')]
+            if not filename.endswith('.json') or not pid.isdigit() or int(pid) == own_pid:
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    snapshots.append((json.load(f), _pid_alive(int(pid))))
+            except (OSError, ValueError):
+                continue
+        return merge(snapshots)
+
+    def render(self):
+        return render(self.collect())
@@ -0,0 +1,108 @@
+# Điều phối luồng cho job sắp xếp ảnh chạy nền phía server.
+#
+# Mỗi job có một hàng đợi file dùng chung và N luồng worker: luồng nào xử lý xong
+# file của mình thì lấy ngay file kế tiếp, thay vì chờ cả lô như vòng lặp cũ trên
+# trình duyệt, nên một video chậm không giữ chân các file khác. Số job chạy đồng
+# thời trong một process bị giới hạn; job vượt giới hạn chờ đến lượt.
+# Module này chỉ lo phần luồng; app.py lo DB, Drive và logic phân loại.
+import queue
+import threading
+
+
+class JobAborted(Exception):
+    # process() ném lỗi này để dừng cả job (ví dụ token Drive hết hạn); các file
+    # chưa xử lý giữ nguyên trạng thái để chạy tiếp sau.
+    pass
+
+
+class ActiveJob:
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.cancelled = threading.Event()
+        self.abort_reason = None
+
+    def abort(self, reason):
+        if self.abort_reason is None:
+            self.abort_reason = reason
+        self.cancelled.set()
+
+
+class JobRunner:
+    def __init__(self, max_jobs):
+        self._slots = threading.BoundedSemaphore(max_jobs)
+        self._lock = threading.Lock()
+        self._active = {}
+        self._changed = threading.Condition()
+
+    def is_running(self, job_id):
+        with self._lock:
+            return job_id in self._active
+
+    def running_jobs(self):
+        with self._lock:
+            return list(self._active)
+
+    def start(self, job_id, target):
+        # Chạy target(active_job) trong luồng riêng khi có chỗ trống. Trả về False
+        # nếu job đang chạy trong process này rồi.
+        with self._lock:
+            if job_id in self._active:
+                return False
+            job = self._active[job_id] = ActiveJob(job_id)
+
+        def run():
+            try:
+                with self._slots:
+                    if not job.cancelled.is_set():
+                        target(job)
+            finally:
+                with self._lock:
+                    self._active.pop(job_id, None)
+                self.notify()
+
+        threading.Thread(target=run, name=f'organize-job-{job_id[:8]}', daemon=True).start()
+        return True
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._active.get(job_id)
+        if job:
+            job.cancelled.set()
+        return job is not None
+
+    def run_workers(self, job, items, process, workers, heartbeat=None, heartbeat_interval=15):
+        # Xử lý items bằng `workers` luồng lấy việc từ cùng một hàng đợi. heartbeat()
+        # được gọi định kỳ từ luồng điều phối; trả về False thì job bị huỷ.
+        pending = queue.SimpleQueue()
+        for item in items:
+            pending.put(item)
+
+        def work():
+            while not job.cancelled.is_set():
+                try:
+                    item = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    process(item)
+                except JobAborted as e:
+                    job.abort(str(e))
+
+        threads = [threading.Thread(target=work, name=f'{threading.current_thread().name}-w{i}', daemon=True)
+                   for i in range(max(1, min(workers, len(items))))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(heartbeat_interval)
+                if heartbeat and thread.is_alive() and not heartbeat():
+                    job.cancelled.set()
+
+    def notify(self):
+        # Báo cho các luồng đang chờ (SSE) rằng có job vừa thay đổi
+        with self._changed:
+            self._changed.notify_all()
+
+    def wait_for_change(self, timeout):
+        with self._changed:
+            self._changed.wait(timeout)
@@ -0,0 +1,91 @@
+# Đọc và kiểm tra dữ liệu nhập lịch học hàng loạt (CSV hoặc JSON).
+# Chỉ xử lý dữ liệu thuần, không chạm tới DB; app.py lo phần ghi.
+import csv
+import io
+import re
+
+from schedule_index import parse_date, parse_hhmm
+
+SCHEDULE_TYPES = ('recurring', 'one-off')
+
+_DAY_SPLIT_RE = re.compile(r'[^0-9]+')
+
+
+def read_csv_rows(text):
+    reader = csv.DictReader(io.StringIO(text.lstrip('﻿')))
+    return [{(k or '').strip(): (v or '').strip() for k, v in row.items()} for row in reader]
+
+
+def _normalize_time(value, field, errors):
+    minutes = parse_hhmm(value)
+    if minutes is None:
+        errors.append(f"{field} phải có dạng HH:MM")
+        return None
+    # Luôn lưu dạng HH:MM có số 0 đứng đầu để so sánh chuỗi giờ vẫn đúng
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _parse_days(value, errors):
+    if isinstance(value, str):
+        value = [part for part in _DAY_SPLIT_RE.split(value) if part]
+    if not isinstance(value, list) or not value:
+        errors.append("daysOfWeek không được để trống")
+        return None
+    days = []
+    for day in value:
+        day = str(day).strip()
+        if not day.isdigit() or not 1 <= int(day) <= 7:
+            errors.append(f"daysOfWeek chứa giá trị không hợp lệ: {day}")
+            return None
+        if day not in days:
+            days.append(day)
+    return sorted(days)
+
+
+def validate_row(schedule_type, raw):
+    # Trả về (mapping cột DB, danh sách lỗi). mapping có 'id' nếu dòng chỉ định id.
+    errors = []
+    if not isinstance(raw, dict):
+        return None, ["Dòng phải là một object"]
+
+    mapping = {}
+    raw_id = raw.get('id')
+    if raw_id not in (None, ''):
+        if not str(raw_id).isdigit():
+            errors.append("id phải là số nguyên")
+        else:
+            mapping['id'] = int(raw_id)
+
+    for field, column in (('schoolName', 'school_name'), ('className', 'class_name')):
+        value = str(raw.get(field) or '').strip()
+        if not value:
+            errors.append(f"Thiếu {field}")
+        elif len(value) > 100:
+            errors.append(f"{field} dài quá 100 ký tự")
+        mapping[column] = value
+
+    mapping['start_time'] = _normalize_time(raw.get('startTime'), 'startTime', errors)
+    mapping['end_time'] = _normalize_time(raw.get('endTime'), 'endTime', errors)
+    if mapping['start_time'] and mapping['end_time'] and mapping['start_time'] > mapping['end_time']:
+        errors.append("startTime phải trước endTime")
+
+    if schedule_type == 'recurring':
+        mapping['days_of_week'] = _parse_days(raw.get('daysOfWeek'), errors)
+        expiry = raw.get('expiryDate')
+        mapping['expiry_date'] = parse_date(expiry) if expiry else None
+        if expiry and mapping['expiry_date'] is None:
+            errors.append("expiryDate phải có dạng YYYY-MM-DD")
+    else:
+        mapping['date'] = parse_date(raw.get('date'))
+        if mapping['date'] is None:
+            errors.append("date phải có dạng YYYY-MM-DD")
+
+    return mapping, errors
+
+
+def natural_key(schedule_type, mapping):
+    # Khoá dùng để nhận ra cùng một buổi học khi nhập lại thời khoá biểu
+    if schedule_type == 'recurring':
+        return (mapping['school_name'], mapping['class_name'], mapping['start_time'],
+                mapping['end_time'], tuple(sorted(str(d) for d in mapping['days_of_week'] or [])))
+    return (mapping['school_name'], mapping['class_name'], mapping['date'], mapping['start_time'])
@@ -0,0 +1,326 @@
+# Chỉ mục tra cứu "thời điểm này thuộc lớp nào" cho lịch định kỳ và lịch đột xuất.
+#
+# Lịch được biên dịch sẵn thành các bucket theo ngày (lịch đột xuất) và theo thứ
+# trong tuần (lịch định kỳ). Mỗi bucket chia trục thời gian trong ngày (phút kể từ
+# 0h) thành các đoạn rời nhau; mỗi đoạn lưu sẵn danh sách lịch phủ đoạn đó theo
+# thứ tự id, nên tra cứu chỉ là một lần bisect. Khi một lịch thay đổi, chỉ các
+# bucket chứa lịch đó được dựng lại.
+import datetime
+import re
+from operator import attrgetter
+from bisect import bisect_left, bisect_right
+from heapq import heappop, heappush
+
+_FRACTION_RE = re.compile(r'\.(\d+)')
+
+
+def parse_hhmm(value):
+    # "08:30" -> 510; trả None nếu không hợp lệ
+    try:
+        hours, minutes = str(value).split(':')[:2]
+        hours, minutes = int(hours), int(minutes)
+    except (TypeError, ValueError):
+        return None
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        return None
+    return hours * 60 + minutes
+
+
+def parse_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def parse_timestamp(value, utc_offset_minutes=0):
+    # Nhận ISO 8601 (có hoặc không có múi giờ, kể cả hậu tố Z và dạng EXIF
+    # "YYYY:MM:DD HH:MM:SS"). Thời điểm có múi giờ được đổi sang giờ địa phương
+    # theo utc_offset_minutes; thời điểm không có múi giờ coi như đã là giờ địa phương.
+    if not isinstance(value, str) or len(value) < 16:
+        return None
+    text = value.strip()
+    if text[4:5] == ':' and text[7:8] == ':':
+        text = f"{text[:4]}-{text[5:7]}-{text[8:]}"
+    if text.endswith(('Z', 'z')):
+        text = text[:-1] + '+00:00'
+    # Python < 3.11 chỉ nhận phần lẻ giây 3 hoặc 6 chữ số
+    text = _FRACTION_RE.sub(lambda m: '.' + m.group(1)[:6].ljust(6, '0'), text, count=1)
+    try:
+        parsed = datetime.datetime.fromisoformat(text)
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        local_tz = datetime.timezone(datetime.timedelta(minutes=utc_offset_minutes))
+        parsed = parsed.astimezone(local_tz).replace(tzinfo=None)
+    return parsed
+
+
+class _Interval:
+    __slots__ = ('id', 'start', 'end', 'days', 'date', 'expiry', 'entry')
+
+    def __init__(self, entry_id, start, end, entry, days=(), date=None, expiry=None):
+        self.id = entry_id
+        self.start = start
+        self.end = end
+        self.days = days
+        self.date = date
+        self.expiry = expiry
+        self.entry = entry
+
+
+class _Bucket:
+    # Các đoạn thời gian rời nhau [points[i], points[i+1]) kèm danh sách lịch phủ đoạn đó
+    __slots__ = ('points', 'segments', 'by_start', 'starts')
+
+    def __init__(self, intervals):
+        points = sorted({iv.start for iv in intervals} | {iv.end + 1 for iv in intervals})
+        by_start = sorted(intervals, key=lambda iv: iv.start)
+        segments = []
+        active = []
+        next_start = 0
+        for point in points:
+            active = [iv for iv in active if iv.end >= point]
+            while next_start < len(by_start) and by_start[next_start].start <= point:
+                active.append(by_start[next_start])
+                next_start += 1
+            segments.append(tuple(sorted(active, key=lambda iv: iv.id)))
+        self.points = points
+        self.segments = segments
+        # Dùng cho kiểm tra trùng: tìm nhanh các lịch bắt đầu trong một khoảng giờ
+        self.by_start = by_start
+        self.starts = [iv.start for iv in by_start]
+
+    def lookup(self, minute):
+        pos = bisect_right(self.points, minute) - 1
+        if pos < 0:
+            return ()
+        return self.segments[pos]
+
+
+def _overlaps(a, b):
+    # Hai buổi học nối tiếp nhau (08:00-09:00 và 09:00-10:00) không tính là trùng
+    return max(a.start, b.start) < min(a.end, b.end)
+
+
+def sweep_overlaps(intervals, limit=None):
+    # Quét theo giờ bắt đầu, giữ heap các buổi đang diễn ra theo giờ kết thúc:
+    # O(n log n + số cặp trùng). Trả về (tổng số cặp, tối đa limit cặp (a, b)).
+    pairs = []
+    total = 0
+    active = []
+    for iv in sorted(intervals, key=attrgetter('start', 'id')):
+        if iv.start == iv.end:
+            # Buổi dài 0 phút không giao với buổi nào (giống _overlaps)
+            continue
+        while active and active[0][0] <= iv.start:
+            heappop(active)
+        if active:
+            total += len(active)
+            for _, _, other in active:
+                if limit is not None and len(pairs) >= limit:
+                    break
+                pairs.append((other, iv))
+        heappush(active, (iv.end, iv.id, iv))
+    return total, pairs
+
+
+class ScheduleIndex:
+    def __init__(self):
+        # Phiên bản lịch (revision trong DB) mà chỉ mục đang phản ánh
+        self.revision = None
+        self._recurring = {}
+        self._one_off = {}
+        self._one_off_by_date = {}
+        self._weekday_buckets = {}
+        self._date_buckets = {}
+
+    # --- Dựng chỉ mục ---
+    def rebuild(self, recurring, one_off, revision=None):
+        self._recurring = {}
+        self._one_off = {}
+        self._one_off_by_date = {}
+        for entry in recurring:
+            interval = self._compile_recurring(entry)
+            if interval:
+                self._recurring[interval.id] = interval
+        for entry in one_off:
+            interval = self._compile_one_off(entry)
+            if interval:
+                self._add_one_off(interval)
+        self._weekday_buckets = {}
+        self._date_buckets = {}
+        self._rebuild_weekdays(range(1, 8))
+        self._rebuild_dates(list(self._one_off_by_date))
+        self.revision = revision
+
+    @staticmethod
+    def _compile_recurring(entry):
+        start, end = parse_hhmm(entry.get('startTime')), parse_hhmm(entry.get('endTime'))
+        if start is None or end is None or start > end:
+            return None
+        days = frozenset(int(d) for d in entry.get('daysOfWeek') or [] if str(d).isdigit() and 1 <= int(d) <= 7)
+        return _Interval(entry['id'], start, end, entry, days=days, expiry=parse_date(entry.get('expiryDate')))
+
+    @staticmethod
+    def _compile_one_off(entry):
+        start, end = parse_hhmm(entry.get('startTime')), parse_hhmm(entry.get('endTime'))
+        date = parse_date(entry.get('date'))
+        if start is None or end is None or start > end or date is None:
+            return None
+        return _Interval(entry['id'], start, end, entry, date=date)
+
+    def _add_one_off(self, interval):
+        self._one_off[interval.id] = interval
+        self._one_off_by_date.setdefault(interval.date, {})[interval.id] = interval
+
+    def _pop_one_off(self, entry_id):
+        old = self._one_off.pop(entry_id, None)
+        if old:
+            same_day = self._one_off_by_date.get(old.date, {})
+            same_day.pop(entry_id, None)
+            if not same_day:
+                self._one_off_by_date.pop(old.date, None)
+        return old
+
+    def _rebuild_weekdays(self, weekdays):
+        for weekday in weekdays:
+            intervals = [iv for iv in self._recurring.values() if weekday in iv.days]
+            if intervals:
+                self._weekday_buckets[weekday] = _Bucket(intervals)
+            else:
+                self._weekday_buckets.pop(weekday, None)
+
+    def _rebuild_dates(self, dates):
+        for date in dates:
+            if date is None:
+                continue
+            intervals = self._one_off_by_date.get(date)
+            if intervals:
+                self._date_buckets[date] = _Bucket(list(intervals.values()))
+            else:
+                self._date_buckets.pop(date, None)
+
+    # --- Cập nhật từng phần khi lịch thay đổi ---
+    def upsert_recurring(self, entry):
+        old = self._recurring.pop(entry['id'], None)
+        new = self._compile_recurring(entry)
+        if new:
+            self._recurring[new.id] = new
+        self._rebuild_weekdays((old.days if old else frozenset()) | (new.days if new else frozenset()))
+
+    def remove_recurring(self, entry_id):
+        old = self._recurring.pop(entry_id, None)
+        if old:
+            self._rebuild_weekdays(old.days)
+
+    def upsert_one_off(self, entry):
+        old = self._pop_one_off(entry['id'])
+        new = self._compile_one_off(entry)
+        if new:
+            self._add_one_off(new)
+        self._rebuild_dates({old.date if old else None, new.date if new else None})
+
+    def remove_one_off(self, entry_id):
+        old = self._pop_one_off(entry_id)
+        if old:
+            self._rebuild_dates({old.date})
+
+    # --- Tra cứu ---
+    def occurrences(self, start, end):
+        # Bung lịch thành các buổi học cụ thể trong [start, end] (date, tính cả hai đầu).
+        # Trả về [(ngày, [(loại, entry), ...]), ...]; mỗi ngày sắp theo giờ bắt đầu rồi id,
+        # bỏ qua ngày không có buổi nào.
+        order = attrgetter('start', 'id')
+        by_weekday = {
+            weekday: sorted((iv for iv in self._recurring.values() if weekday in iv.days), key=order)
+            for weekday in range(1, 8)
+        }
+        result = []
+        day = start
+        while day <= end:
+            items = [('recurring', iv) for iv in by_weekday[day.isoweekday()]
+                     if iv.expiry is None or day <= iv.expiry]
+            same_day = self._one_off_by_date.get(day)
+            if same_day:
+                items.extend(('oneOff', iv) for iv in same_day.values())
+                items.sort(key=lambda item: order(item[1]))
+            if items:
+                result.append((day, [(kind, iv.entry) for kind, iv in items]))
+            day += datetime.timedelta(days=1)
+        return result
+
+    # --- Kiểm tra trùng lịch ---
+    # Chỉ so lịch cùng loại: lịch đột xuất trùng giờ lịch định kỳ là ghi đè có chủ ý
+    # (match() ưu tiên lịch đột xuất). Lịch định kỳ hết hạn trước as_of coi như đã
+    # được thay thế và không còn tính là trùng.
+    @staticmethod
+    def _bucket_overlaps(bucket, interval):
+        # Lịch giao với interval = lịch đang diễn ra lúc interval bắt đầu (một đoạn) +
+        # lịch bắt đầu trong khoảng (start, end); O(log n + số lịch tìm được).
+        if bucket is None:
+            return []
+        pos = bisect_right(bucket.points, interval.start) - 1
+        candidates = list(bucket.segments[pos]) if pos >= 0 else []
+        first = bisect_right(bucket.starts, interval.start)
+        last = bisect_left(bucket.starts, interval.end)
+        candidates.extend(bucket.by_start[first:last])
+        return [iv for iv in candidates if iv.id != interval.id and _overlaps(iv, interval)]
+
+    def find_conflicts(self, schedule_type, entry, as_of):
+        # Các lịch đang có trùng giờ với entry (lịch sắp thêm/sửa), dạng [(entry, ngày/thứ)]
+        if schedule_type == 'recurring':
+            interval = self._compile_recurring(entry)
+            if interval is None or (interval.expiry is not None and interval.expiry < as_of):
+                return []
+            conflicts = []
+            for weekday in sorted(interval.days):
+                for iv in self._bucket_overlaps(self._weekday_buckets.get(weekday), interval):
+                    if iv.expiry is None or iv.expiry >= as_of:
+                        conflicts.append((iv.entry, weekday))
+            return conflicts
+        interval = self._compile_one_off(entry)
+        if interval is None:
+            return []
+        return [(iv.entry, interval.date) for iv in self._bucket_overlaps(self._date_buckets.get(interval.date), interval)]
+
+    def conflicts(self, as_of, limit=None):
+        # Rà toàn bộ lịch: quét từng thứ (lịch định kỳ) và từng ngày (lịch đột xuất).
+        # Trả về {'recurring': (tổng, [(thứ, a, b)]), 'oneOff': (tổng, [(ngày, a, b)])}.
+        by_weekday = {}
+        for iv in self._recurring.values():
+            if iv.expiry is None or iv.expiry >= as_of:
+                for weekday in iv.days:
+                    by_weekday.setdefault(weekday, []).append(iv)
+        result = {}
+        for kind, groups in (('recurring', sorted(by_weekday.items())),
+                             ('oneOff', sorted(self._one_off_by_date.items()))):
+            total, found = 0, []
+            for key, intervals in groups:
+                remaining = None if limit is None else limit - len(found)
+                count, pairs = sweep_overlaps(intervals if kind == 'recurring' else list(intervals.values()), remaining)
+                total += count
+                found.extend((key, a, b) for a, b in pairs)
+            result[kind] = (total, found)
+        return result
+
+    def match(self, moment):
+        # moment: datetime giờ địa phương. Lịch đột xuất được ưu tiên hơn lịch định kỳ,
+        # trong cùng loại thì lịch có id nhỏ hơn được chọn (giống thứ tự frontend dùng trước đây).
+        minute = moment.hour * 60 + moment.minute
+        day = moment.date()
+
+        bucket = self._date_buckets.get(day)
+        if bucket:
+            covering = bucket.lookup(minute)
+            if covering:
+                return 'oneOff', covering[0].entry
+
+        bucket = self._weekday_buckets.get(day.isoweekday())
+        if bucket:
+            for interval in bucket.lookup(minute):
+                if interval.expiry is None or day <= interval.expiry:
+                    return 'recurring', interval.entry
+        return None, None
@@ -0,0 +1,51 @@
+# Chạy trong thư mục backend:  python -m pytest -q
+#
+# Các test dùng module phẳng của backend (app, google_verifier...) và server Drive giả
+# lập ở benchmarks/fake_drive.py.
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'benchmarks'))
+
+
+@pytest.fixture(scope='session')
+def drive():
+    from fake_drive import FakeDriveServer
+    server = FakeDriveServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope='session')
+def backend(drive):
+    # app.py đọc cấu hình từ biến môi trường lúc import: dùng SQLite tạm và trỏ mọi lời
+    # gọi Drive về server giả
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='teacher-test-'), 'test.db')}"
+    os.environ.setdefault('SECRET_KEY', 'test-secret')
+    os.environ['METRICS_DIR'] = ''
+    os.environ.setdefault('LOGIN_IP_RATE', '1000000')
+    os.environ.setdefault('ORGANIZE_MOVE_LINGER_SECONDS', '0.05')
+    os.environ.setdefault('IMAGE_ANALYSIS_PROCESSES', '1')
+    import app as backend
+    import drive_client
+    import video_probe
+    video_probe.DRIVE_FILES_URL = drive.files_url
+    drive_client.DRIVE_BATCH_URL = drive.batch_url
+    backend.create_app()
+    return backend
+
+
+@pytest.fixture(scope='session')
+def client(backend):
+    return backend.app.test_client()
+
+
+@pytest.fixture(scope='session')
+def auth_headers(client):
+    login = client.post('/api/auth/login', json={'username': 'admin', 'password': 'password'})
+    return {'x-access-token': login.get_json()['apiToken']}
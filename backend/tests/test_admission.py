@@ -0,0 +1,79 @@
+# AdmissionController: giới hạn số chỗ mỗi người dùng, hàng đợi đầy thì từ chối ngay, và
+# response stream trả chỗ khi sinh xong body.
+import threading
+import time
+
+import pytest
+
+import admission
+
+
+def test_one_user_cannot_take_every_slot():
+    controller = admission.AdmissionController('test', max_active=4, max_queue=1, queue_timeout=5, max_per_key=2)
+    held = [controller.acquire('a'), controller.acquire('a')]
+    with pytest.raises(admission.AdmissionRejected) as e:
+        controller.acquire('a')
+    assert e.value.reason == 'too_many_active'
+    # Người khác vẫn có chỗ
+    other = controller.acquire('b')
+    controller.release(other, 'b')
+    controller.release(held.pop(), 'a')
+    controller.release(controller.acquire('a'), 'a')
+    assert controller.stats()['rejected']['too_many_active'] == 1
+
+
+def test_queue_full_rejects_without_waiting():
+    controller = admission.AdmissionController('test', max_active=1, max_queue=1, queue_timeout=5)
+    admitted_at = controller.acquire('a')
+    waiter = threading.Thread(target=lambda: controller.release(controller.acquire('b'), 'b'))
+    waiter.start()
+    while controller.stats()['queued'] < 1:
+        time.sleep(0.01)
+
+    started = time.monotonic()
+    with pytest.raises(admission.AdmissionRejected) as e:
+        controller.acquire('c')
+    assert e.value.reason == 'queue_full'
+    assert time.monotonic() - started < 0.5
+
+    controller.release(admitted_at, 'a')
+    waiter.join(5)
+    assert controller.stats()['active'] == 0
+
+
+class Gauge:
+    def __init__(self):
+        self.value = None
+
+    def set(self, value, pool):
+        self.value = value
+
+
+def test_queue_timeout_frees_user_slot():
+    queued = Gauge()
+    controller = admission.AdmissionController('test', max_active=1, max_queue=1, queue_timeout=0.05, max_per_key=1,
+                                               queued_gauge=queued)
+    admitted_at = controller.acquire('a')
+    with pytest.raises(admission.AdmissionRejected) as e:
+        controller.acquire('b')
+    assert e.value.reason == 'queue_timeout'
+    assert queued.value == 0
+    controller.release(admitted_at, 'a')
+    controller.release(controller.acquire('b'), 'b')
+
+
+def test_streamed_response_releases_when_body_is_done(backend):
+    controller = admission.AdmissionController('test', max_active=1, max_per_key=1)
+
+    @backend.admission_controlled(controller, per='ip')
+    def view():
+        return backend.Response((line for line in (b'1\n', b'2\n')), mimetype='application/x-ndjson')
+
+    with backend.app.test_request_context('/'):
+        response = view()
+        assert controller.stats()['active'] == 1
+        assert b''.join(response.response) == b'1\n2\n'
+        assert controller.stats()['active'] == 0
+        # Đóng response sau đó không trả chỗ lần nữa
+        response.close()
+        assert controller.stats()['active'] == 0
@@ -0,0 +1,44 @@
+# Cache xác thực: request liên tiếp không truy vấn DB, thu hồi ở worker khác (tăng bộ đếm
+# AUTH_REVISION_ID trong DB) có hiệu lực sau lần đọc lại bộ đếm kế tiếp.
+import pytest
+
+
+@pytest.fixture
+def admin(backend):
+    with backend.app.app_context():
+        admin = backend.User.query.filter_by(role='Admin').first()
+        backend.auth_user_cache.clear()
+        backend.auth_revision_state['checked_at'] = None
+        return admin.id
+
+
+def counters(backend):
+    return dict(backend.auth_cache_counters)
+
+
+def test_cached_user_skips_every_query(backend, monkeypatch, admin):
+    monkeypatch.setattr(backend, 'AUTH_REVISION_CHECK_SECONDS', 60)
+    with backend.app.app_context():
+        before = counters(backend)
+        for _ in range(5):
+            assert backend.get_authenticated_user(admin).role == 'Admin'
+        after = counters(backend)
+    assert after['db_lookups'] - before['db_lookups'] == 1
+    assert after['revision_checks'] - before['revision_checks'] == 1
+
+
+def test_revocation_in_another_worker_is_seen_after_recheck(backend, monkeypatch, admin):
+    monkeypatch.setattr(backend, 'AUTH_REVISION_CHECK_SECONDS', 60)
+    with backend.app.app_context():
+        backend.get_authenticated_user(admin)
+        # Worker khác đổi quyền: chỉ bộ đếm trong DB tăng, cache của worker này không bị đụng
+        backend._bump_revision(backend.db.session, backend.AUTH_REVISION_ID)
+        backend.db.session.commit()
+        lookups = counters(backend)['db_lookups']
+        backend.get_authenticated_user(admin)
+        assert counters(backend)['db_lookups'] == lookups
+
+        backend.auth_revision_state['checked_at'] -= 60
+        backend.get_authenticated_user(admin)
+        assert counters(backend)['db_lookups'] == lookups + 1
+        assert counters(backend)['stale_after_revocation'] >= 1
@@ -0,0 +1,130 @@
+# Chỉ mục file Drive cập nhật qua changes feed của server Drive giả lập: file mới, di
+# chuyển giữa các thư mục, vào thùng rác/xoá vĩnh viễn, và vị trí cursor được lưu lại.
+import pytest
+
+
+@pytest.fixture(scope='module')
+def admin_id(backend):
+    with backend.app.app_context():
+        admin = backend.User.query.filter_by(role='Admin').first()
+        backend.save_user_drive_token(admin.id, 'drive-token')
+        return admin.id
+
+
+def listed(client, auth_headers, folder_id):
+    response = client.get(f"/api/drive/folders/{folder_id}/files?refresh=1", headers=auth_headers)
+    assert response.status_code == 200, response.get_json()
+    return sorted(f['name'] for f in response.get_json()['files'])
+
+
+def cursor_token(backend, user_id):
+    with backend.app.app_context():
+        return backend.DriveChangeCursor.query.get(user_id).page_token
+
+
+@pytest.fixture
+def folders(backend, drive, client, auth_headers, admin_id):
+    # Hai thư mục đang được theo dõi (đã liệt kê một lần), mỗi thư mục một ảnh
+    a, b = drive.add_folder('A', 'root'), drive.add_folder('B', 'root')
+    drive.add_file('a1.jpg', 'image/jpeg', [a])
+    drive.add_file('b1.jpg', 'image/jpeg', [b])
+    assert listed(client, auth_headers, a) == ['a1.jpg']
+    assert listed(client, auth_headers, b) == ['b1.jpg']
+    return a, b
+
+
+def test_new_files_come_from_changes_feed(drive, client, auth_headers, folders):
+    a, _ = folders
+    lists = drive.counters['list_requests']
+    drive.add_file('a2.jpg', 'image/jpeg', [a])
+    drive.add_folder('con', a)
+    drive.add_file('notes.txt', 'text/plain', [a])
+    assert listed(client, auth_headers, a) == ['a1.jpg', 'a2.jpg', 'con']
+    # Không liệt kê lại thư mục, chỉ đọc changes
+    assert drive.counters['list_requests'] == lists
+
+
+def test_move_between_and_out_of_watched_folders(drive, client, auth_headers, folders):
+    a, b = folders
+    moving = drive.add_file('a2.jpg', 'image/jpeg', [a])
+    assert listed(client, auth_headers, a) == ['a1.jpg', 'a2.jpg']
+
+    drive.move(moving, add_parents=[b], remove_parents=[a])
+    assert listed(client, auth_headers, a) == ['a1.jpg']
+    assert listed(client, auth_headers, b) == ['a2.jpg', 'b1.jpg']
+
+    elsewhere = drive.add_folder('Không theo dõi', 'root')
+    drive.move(moving, add_parents=[elsewhere], remove_parents=[b])
+    drive.update_file(drive.children(a)[0]['id'], name='a1-renamed.jpg')
+    assert listed(client, auth_headers, b) == ['b1.jpg']
+    assert listed(client, auth_headers, a) == ['a1-renamed.jpg']
+
+
+def test_trashed_and_deleted_files_are_removed(drive, client, auth_headers, folders):
+    a, b = folders
+    drive.update_file(drive.children(a)[0]['id'], trashed=True)
+    drive.delete_file(drive.children(b)[0]['id'])
+    assert listed(client, auth_headers, a) == []
+    assert listed(client, auth_headers, b) == []
+
+
+def test_deleting_watched_folder_drops_its_index(backend, drive, client, auth_headers, folders):
+    a, _ = folders
+    drive.update_file(a, trashed=True)
+    listed(client, auth_headers, 'root')
+    with backend.app.app_context():
+        assert backend.DriveFile.query.filter_by(folder_id=a).count() == 0
+        assert backend.DriveFolderWatch.query.filter_by(folder_id=a).count() == 0
+
+
+def test_cursor_advances_and_persists(backend, drive, client, auth_headers, admin_id, folders):
+    a, _ = folders
+    assert cursor_token(backend, admin_id) == drive.start_page_token()
+
+    drive.add_file('a2.jpg', 'image/jpeg', [a])
+    before = cursor_token(backend, admin_id)
+    listed(client, auth_headers, a)
+    assert int(cursor_token(backend, admin_id)) == int(before) + 1 == int(drive.start_page_token())
+
+    # Lần đồng bộ sau đọc tiếp từ vị trí đã lưu: không nhận lại thay đổi cũ, không liệt kê lại
+    lists = drive.counters['list_requests']
+    assert listed(client, auth_headers, a) == ['a1.jpg', 'a2.jpg']
+    assert cursor_token(backend, admin_id) == drive.start_page_token()
+    assert drive.counters['list_requests'] == lists
+
+
+def test_expired_cursor_relists_watched_folders(backend, drive, client, auth_headers, admin_id, folders):
+    a, _ = folders
+    drive.add_file('a2.jpg', 'image/jpeg', [a])
+    drive.expire_page_tokens()
+    lists = drive.counters['list_requests']
+    assert listed(client, auth_headers, a) == ['a1.jpg', 'a2.jpg']
+    assert drive.counters['list_requests'] == lists + 1
+    assert cursor_token(backend, admin_id) == drive.start_page_token()
+
+
+@pytest.fixture(scope='module')
+def other_headers(backend, client):
+    # Giáo viên thứ hai, có token Drive riêng
+    with backend.app.app_context():
+        teacher = backend.User(email='teacher2@example.com', name='Giáo viên 2', role='User',
+                               password_hash=backend.generate_password_hash('password', method='pbkdf2:sha256'))
+        backend.db.session.add(teacher)
+        backend.db.session.commit()
+        backend.save_user_drive_token(teacher.id, 'other-drive-token')
+        token = backend.issue_api_token(teacher)
+    return {'x-access-token': token}
+
+
+def test_user_without_access_does_not_clear_others_index(drive, client, auth_headers, other_headers, folders,
+                                                        monkeypatch):
+    a, _ = folders
+    import drive_client
+    # Token của giáo viên thứ hai không thấy thư mục: Drive trả danh sách rỗng
+    monkeypatch.setattr(drive_client, 'list_folder', lambda *args, **kwargs: [])
+    assert listed(client, other_headers, a) == []
+    monkeypatch.undo()
+
+    lists = drive.counters['list_requests']
+    assert listed(client, auth_headers, a) == ['a1.jpg']
+    assert drive.counters['list_requests'] == lists
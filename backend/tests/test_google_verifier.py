@@ -0,0 +1,128 @@
+# GoogleTokenVerifier với endpoint chứng chỉ giả lập ở localhost: token ký bằng khoá RSA
+# tạo trong test, chứng chỉ (khoá công khai PEM) phục vụ kèm Cache-Control max-age.
+import http.server
+import json
+import threading
+import time
+
+import pytest
+import rsa
+from google.auth import crypt, exceptions, jwt as google_jwt
+
+import google_verifier
+
+AUDIENCE = 'test-client.apps.googleusercontent.com'
+
+
+class CertServer:
+    def __init__(self):
+        self.keys = {}
+        self.cache_control = 'public, max-age=300'
+        self.requests = 0
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.requests += 1
+                body = json.dumps({kid: public.save_pkcs1().decode() for kid, (public, _) in server.keys.items()})
+                data = body.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.send_header('Cache-Control', server.cache_control)
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_port}/oauth2/v1/certs"
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def add_key(self, kid):
+        public, private = rsa.newkeys(1024)
+        self.keys[kid] = (public, private)
+
+    def token(self, kid, **claims):
+        now = int(time.time())
+        payload = {'iss': 'https://accounts.google.com', 'aud': AUDIENCE, 'sub': '1234',
+                   'email': 'teacher@example.com', 'iat': now, 'exp': now + 600}
+        payload.update(claims)
+        signer = crypt.RSASigner(self.keys[kid][1], key_id=kid)
+        return google_jwt.encode(signer, payload).decode()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+@pytest.fixture
+def certs():
+    server = CertServer()
+    server.add_key('key-1')
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Đồng hồ monotonic của cache chứng chỉ, tua được trong test
+    state = {'now': 1000.0}
+    monkeypatch.setattr(google_verifier.time, 'monotonic', lambda: state['now'])
+    return state
+
+
+def test_verify_reuses_cached_certs(certs, clock):
+    verifier = google_verifier.GoogleTokenVerifier(certs_url=certs.url)
+    for _ in range(3):
+        assert verifier.verify(certs.token('key-1'), AUDIENCE)['sub'] == '1234'
+    assert certs.requests == 1
+    assert verifier.stats() == {'cert_cache_hits': 2, 'cert_fetches': 1}
+
+
+def test_certs_refreshed_after_max_age(certs, clock):
+    verifier = google_verifier.GoogleTokenVerifier(certs_url=certs.url)
+    verifier.verify(certs.token('key-1'), AUDIENCE)
+
+    # Google xoay khoá: token ký bằng khoá mới chỉ xác thực được khi bản cache hết hạn
+    certs.add_key('key-2')
+    clock['now'] += 299
+    with pytest.raises(ValueError):
+        verifier.verify(certs.token('key-2'), AUDIENCE)
+    assert certs.requests == 1
+
+    clock['now'] += 2
+    assert verifier.verify(certs.token('key-2'), AUDIENCE)['email'] == 'teacher@example.com'
+    assert certs.requests == 2
+
+
+def test_no_cache_header_fetches_every_time(certs, clock):
+    certs.cache_control = 'no-cache'
+    verifier = google_verifier.GoogleTokenVerifier(certs_url=certs.url)
+    verifier.verify(certs.token('key-1'), AUDIENCE)
+    verifier.verify(certs.token('key-1'), AUDIENCE)
+    assert certs.requests == 2
+
+
+def test_rejects_wrong_audience(certs, clock):
+    verifier = google_verifier.GoogleTokenVerifier(certs_url=certs.url)
+    with pytest.raises(ValueError):
+        verifier.verify(certs.token('key-1', aud='someone-else.apps.googleusercontent.com'), AUDIENCE)
+
+
+def test_rejects_wrong_issuer(certs, clock):
+    verifier = google_verifier.GoogleTokenVerifier(certs_url=certs.url)
+    with pytest.raises(exceptions.GoogleAuthError):
+        verifier.verify(certs.token('key-1', iss='https://evil.example.com'), AUDIENCE)
+
+
+def test_rejects_token_signed_by_unknown_key(certs, clock):
+    verifier = google_verifier.GoogleTokenVerifier(certs_url=certs.url)
+    other = CertServer()
+    try:
+        other.add_key('key-1')
+        with pytest.raises(ValueError):
+            verifier.verify(other.token('key-1'), AUDIENCE)
+    finally:
+        other.stop()
@@ -0,0 +1,207 @@
+# Job sắp xếp ảnh chạy trên server Drive giả lập: chạy hết, huỷ giữa chừng rồi chạy tiếp,
+# và chạy tiếp job bị ngắt (worker cũ chết) khi worker mới khởi động.
+import datetime
+import io
+import time
+import uuid
+
+import pytest
+from PIL import Image
+
+from fake_drive import SyntheticMP4
+
+# Ảnh chụp 08:30 giờ địa phương; video có creation_time 01:30 UTC (= 08:30 ở UTC+7)
+SCHEDULE = {'schoolName': 'Trường Test', 'className': 'Lớp 1', 'date': '2024-03-05',
+            'startTime': '08:00', 'endTime': '09:00'}
+CLASS_FOLDER = 'Trường Test - Lớp 1'
+OPTIONS = {'removeDuplicates': False, 'filterUnclearSubject': False, 'filterDarkFace': False}
+
+
+def jpeg(seed):
+    image = Image.new('RGB', (64, 64))
+    image.putdata([((x * seed) % 256, (y * 7 + seed) % 256, (x * y) % 256) for y in range(64) for x in range(64)])
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def mp4(size=32 * 1024):
+    video = SyntheticMP4(size)
+    return b''.join(video.read(0, video.size))
+
+
+@pytest.fixture(scope='module', autouse=True)
+def schedule(client, auth_headers):
+    response = client.post('/api/schedules/import', json={'type': 'one-off', 'rows': [SCHEDULE]},
+                           headers=auth_headers)
+    assert response.status_code == 200, response.get_json()
+
+
+@pytest.fixture
+def source(drive):
+    # Thư mục nguồn mới cho mỗi test
+    folder_id = drive.add_folder('Nguồn', 'root')
+    yield folder_id
+    drive.media_delay = 0.0
+
+
+def add_photo(drive, folder_id, n, time_taken='2024:03:05 08:30:00'):
+    return drive.add_file(f"IMG_{n:04d}.jpg", 'image/jpeg', [folder_id], content=jpeg(n + 1),
+                          imageMediaMetadata={'time': time_taken})
+
+
+def start_job(client, auth_headers, folder_id, **options):
+    response = client.post('/api/organize-jobs', headers=auth_headers, json=dict(
+        OPTIONS, sourceFolderId=folder_id, accessToken='drive-token', **options))
+    assert response.status_code == 202, response.get_json()
+    return response.get_json()['id']
+
+
+def job_row(backend, job_id):
+    # Đọc thẳng từ DB (API job cũng tự chạy tiếp job bị ngắt, sẽ làm sai test khởi động)
+    with backend.app.app_context():
+        job = backend.OrganizeJob.query.get(job_id)
+        return {'status': job.status, 'processed': job.processed, 'total': job.total, 'error': job.error}
+
+
+def wait_for(backend, job_id, condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = job_row(backend, job_id)
+        if condition(job):
+            return job
+        assert time.monotonic() < deadline, f"job {job_id} vẫn ở {job}"
+        time.sleep(0.05)
+
+
+def finished(job):
+    return job['status'] in ('completed', 'cancelled', 'failed')
+
+
+def test_job_sorts_folder(backend, drive, client, auth_headers, source):
+    photos = [add_photo(drive, source, n) for n in range(3)]
+    video = drive.add_file('VID_0001.mp4', 'video/mp4', [source], content=mp4())
+    unmatched = add_photo(drive, source, 9, time_taken='2024:03:05 20:00:00')
+
+    job_id = start_job(client, auth_headers, source, workers=2)
+    job = wait_for(backend, job_id, finished)
+    assert job == {'status': 'completed', 'processed': 5, 'total': 5, 'error': None}
+    summary = client.get(f"/api/organize-jobs/{job_id}", headers=auth_headers).get_json()['summary']
+    assert summary == {'selected': 3, 'moved': 1, 'unmatched': 1}
+
+    class_folder = drive.find_folder(CLASS_FOLDER, source)
+    selected = drive.find_folder('Selected Items', class_folder)
+    assert sorted(f['id'] for f in drive.children(selected)) == sorted(photos)
+    assert drive.file_metadata(video)['parents'] == [class_folder]
+    assert drive.file_metadata(unmatched)['parents'] == [source]
+
+
+def test_undecodable_image_is_selected_without_filters(backend, drive, client, auth_headers, source):
+    # Ví dụ HEIC khi server chưa cài pillow-heif: không đo được chất lượng, không loại ảnh
+    photo = drive.add_file('IMG_0001.HEIC', 'image/heic', [source], content=b'ftypheic' + bytes(64),
+                           imageMediaMetadata={'time': '2024:03:05 08:30:00'})
+    job_id = start_job(client, auth_headers, source, removeDuplicates=True, filterUnclearSubject=True,
+                       filterDarkFace=True)
+    assert wait_for(backend, job_id, finished)['status'] == 'completed'
+    selected = drive.find_folder('Selected Items', drive.find_folder(CLASS_FOLDER, source))
+    assert [f['id'] for f in drive.children(selected)] == [photo]
+
+
+def test_quality_thresholds_are_job_options(backend, drive, client, auth_headers, source):
+    response = client.post('/api/organize-jobs', headers=auth_headers, json=dict(
+        OPTIONS, sourceFolderId=source, accessToken='drive-token', minSharpness=-1))
+    assert response.status_code == 400
+
+    photo = add_photo(drive, source, 0)
+    job_id = start_job(client, auth_headers, source, filterUnclearSubject=True, minSharpness=1e9)
+    assert wait_for(backend, job_id, finished)['status'] == 'completed'
+    job = client.get(f"/api/organize-jobs/{job_id}", headers=auth_headers).get_json()
+    assert job['options']['minBrightness'] == backend.ORGANIZE_MIN_BRIGHTNESS
+    assert drive.file_metadata(photo)['parents'] == [drive.find_folder(CLASS_FOLDER, source)]
+
+
+def test_cancel_then_resume(backend, drive, client, auth_headers, source):
+    photos = [add_photo(drive, source, n) for n in range(6)]
+    drive.media_delay = 0.2
+    job_id = start_job(client, auth_headers, source, workers=1)
+    wait_for(backend, job_id, lambda job: job['processed'] >= 1)
+
+    response = client.post(f"/api/organize-jobs/{job_id}/cancel", headers=auth_headers)
+    assert response.status_code == 200, response.get_json()
+    job = wait_for(backend, job_id, finished)
+    assert job['status'] == 'cancelled'
+    assert 1 <= job['processed'] < 6
+
+    drive.media_delay = 0.0
+    response = client.post(f"/api/organize-jobs/{job_id}/resume", headers=auth_headers, json={})
+    assert response.status_code == 202
+    job = wait_for(backend, job_id, finished)
+    assert job == {'status': 'completed', 'processed': 6, 'total': 6, 'error': None}
+    # File đã xử lý trước khi huỷ không bị xử lý lại
+    selected = drive.find_folder('Selected Items', drive.find_folder(CLASS_FOLDER, source))
+    assert sorted(f['id'] for f in drive.children(selected)) == sorted(photos)
+
+
+def insert_job(backend, folder_id, status, owner=None, heartbeat_age=None):
+    now = datetime.datetime.utcnow()
+    with backend.app.app_context():
+        admin = backend.User.query.filter_by(role='Admin').first()
+        backend.save_user_drive_token(admin.id, 'drive-token')
+        job = backend.OrganizeJob(
+            id=uuid.uuid4().hex, user_id=admin.id, status=status, source_folder_id=folder_id,
+            options=backend.parse_organize_options(OPTIONS), total=0, processed=0, owner=owner,
+            heartbeat_at=now - datetime.timedelta(seconds=heartbeat_age) if heartbeat_age is not None else None,
+            created_at=now, updated_at=now)
+        backend.db.session.add(job)
+        backend.db.session.commit()
+        return job.id
+
+
+def test_only_one_worker_claims_a_job(backend, drive, monkeypatch, source):
+    job_id = insert_job(backend, source, 'queued')
+    with backend.app.app_context():
+        monkeypatch.setattr(backend, 'organize_owner', lambda: 'host-a:1')
+        assert backend.claim_organize_job(job_id)
+        monkeypatch.setattr(backend, 'organize_owner', lambda: 'host-b:2')
+        assert not backend.claim_organize_job(job_id)
+        backend.OrganizeJob.query.filter_by(id=job_id).update({'status': 'cancelled', 'owner': None})
+        backend.db.session.commit()
+
+
+def test_interrupted_job_resumes_on_worker_start(backend, drive, source):
+    photos = [add_photo(drive, source, n) for n in range(3)]
+    # Worker cũ chết giữa chừng (deploy): job vẫn 'running' nhưng lease đã hết hạn
+    job_id = insert_job(backend, source, 'running', owner='old-host:1',
+                        heartbeat_age=backend.ORGANIZE_LEASE_SECONDS + 5)
+
+    backend.organize_state['resume_checked_at'] = 0.0
+    backend.start_organize_resumer()
+    job = wait_for(backend, job_id, finished)
+    assert job == {'status': 'completed', 'processed': 3, 'total': 3, 'error': None}
+    selected = drive.find_folder('Selected Items', drive.find_folder(CLASS_FOLDER, source))
+    assert sorted(f['id'] for f in drive.children(selected)) == sorted(photos)
+
+
+def test_event_stream_is_capped_and_closes_periodically(backend, client, auth_headers, monkeypatch, source):
+    # Job của worker khác, đang chạy: stream không tự kết thúc bằng "end"
+    job_id = insert_job(backend, source, 'running', owner='other-host:1', heartbeat_age=0)
+    monkeypatch.setattr(backend, 'ORGANIZE_SSE_MAX_SECONDS', 0.2)
+    monkeypatch.setattr(backend, 'ORGANIZE_SSE_POLL_SECONDS', 0.05)
+    url = f"/api/organize-jobs/{job_id}/events"
+    try:
+        first = client.get(url, headers=auth_headers, buffered=False)
+        assert first.status_code == 200
+        # Mỗi người dùng một stream
+        second = client.get(url, headers=auth_headers)
+        assert second.status_code == 429
+        assert second.get_json()['reason'] == 'too_many_active'
+
+        body = first.get_data(as_text=True)
+        assert 'event: progress' in body and 'event: end' not in body
+        first.close()
+        again = client.get(url, headers=auth_headers)
+        assert again.status_code == 200
+    finally:
+        with backend.app.app_context():
+            backend.OrganizeJob.query.filter_by(id=job_id).update({'status': 'cancelled', 'owner': None})
+            backend.db.session.commit()
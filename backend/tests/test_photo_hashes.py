@@ -0,0 +1,28 @@
+# Lọc ảnh gần trùng: hash chỉ được so với hash cùng thuật toán trong cùng thư mục đích.
+import hash_index
+
+HASH = 'f0e1d2c3b4a59687'
+NEAR = 'f0e1d2c3b4a59686'
+
+
+def query(client, auth_headers, folder_id, algorithm, hashes):
+    return client.post('/api/photo-hashes/query', headers=auth_headers, json={
+        'folderId': folder_id, 'algorithm': algorithm, 'threshold': 5,
+        'hashes': [{'fileId': file_id, 'hash': value} for file_id, value in hashes]})
+
+
+def test_hashes_only_match_same_algorithm(client, auth_headers):
+    response = query(client, auth_headers, 'hash-folder', hash_index.DCT_PHASH, [('a', HASH)])
+    assert response.get_json()['results'] == [{'fileId': 'a', 'duplicate': False}]
+
+    # Cùng giá trị nhưng do phash-js tạo ra: không so với hash của server
+    response = query(client, auth_headers, 'hash-folder', hash_index.PHASH_JS, [('b', NEAR)])
+    assert response.get_json()['results'] == [{'fileId': 'b', 'duplicate': False}]
+
+    response = query(client, auth_headers, 'hash-folder', hash_index.DCT_PHASH, [('c', NEAR)])
+    assert response.get_json()['results'] == [{'fileId': 'c', 'duplicate': True, 'matchFileId': 'a', 'distance': 1}]
+
+
+def test_algorithm_is_required(client, auth_headers):
+    response = query(client, auth_headers, 'hash-folder', None, [('a', HASH)])
+    assert response.status_code == 400
@@ -0,0 +1,21 @@
+# Cache cài đặt: worker khác lưu cài đặt (tăng bộ đếm SETTINGS_REVISION_ID trong DB) thì
+# worker này bỏ bản cache ở lần đọc lại bộ đếm kế tiếp.
+
+
+def test_settings_saved_by_another_worker_are_picked_up(backend, client, auth_headers, monkeypatch):
+    monkeypatch.setattr(backend, 'SETTINGS_REVISION_CHECK_SECONDS', 60)
+    response = client.post('/api/settings', headers=auth_headers,
+                           json={'client_id': 'client-1', 'api_key': 'key', 'source_folder_id': 'folder-1'})
+    assert response.status_code == 200
+    assert client.get('/api/settings').get_json()['source_folder_id'] == 'folder-1'
+
+    # Worker khác ghi thẳng vào DB và tăng bộ đếm; cache của worker này chưa bị đụng
+    with backend.app.app_context():
+        backend.Setting.query.first().source_folder_id = 'folder-2'
+        backend._bump_revision(backend.db.session, backend.SETTINGS_REVISION_ID)
+        backend.db.session.commit()
+    assert client.get('/api/settings').get_json()['source_folder_id'] == 'folder-1'
+
+    backend.settings_revision_state['checked_at'] -= 60
+    assert client.get('/api/settings').get_json()['source_folder_id'] == 'folder-2'
+    assert client.get('/api/settings').get_json()['client_id'] == 'client-1'
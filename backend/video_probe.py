@@ -0,0 +1,245 @@
+# Đọc creation_time của video trên Google Drive mà không tải cả file.
+#
+# Với MP4/MOV, creation_time nằm trong atom moov/mvhd. Atom moov có thể nằm
+# ở đầu file (faststart) hoặc cuối file, nên ta đi lần lượt qua các atom cấp
+# cao nhất bằng HTTP Range request, chỉ đọc header 8-16 byte của mỗi atom,
+# và chỉ tải phần đầu của moov để tìm mvhd. Số request không phụ thuộc kích
+# thước file. Định dạng không phải ISO-BMFF thì quay về ffprobe như cũ.
+import datetime
+import json
+import os
+import struct
+import subprocess
+import tempfile
+import time
+
+import requests
+
+DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files"
+
+# Phần đầu file đọc trong request đầu tiên; thường chứa luôn ftyp và moov
+# (nếu video được ghi kiểu faststart).
+HEAD_PROBE_SIZE = 64 * 1024
+# Số byte đầu của moov cần đọc; mvhd gần như luôn là atom con đầu tiên.
+MOOV_PROBE_SIZE = 16 * 1024
+# Giới hạn số atom duyệt ở mỗi cấp để không lặp vô hạn với file hỏng.
+MAX_ATOMS_PER_LEVEL = 256
+
+# Các atom cấp cao nhất hợp lệ của MP4/MOV; gặp atom khác ở đầu file nghĩa là
+# không phải ISO-BMFF.
+KNOWN_TOP_LEVEL_ATOMS = {
+    b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pnot', b'uuid',
+    b'meta', b'moof', b'mfra', b'pdin', b'styp', b'sidx', b'junk',
+}
+
+# Cách cũ (tải cả file rồi chạy ffprobe): thời gian chờ mỗi lần đọc socket, tổng thời gian
+# tải tối đa và thời gian chạy ffprobe tối đa (giây), để một lượt tải Drive bị treo hay
+# nhỏ giọt không giữ mãi luồng worker và chỗ admission control.
+HTTP_TIMEOUT = 30
+FFPROBE_DOWNLOAD_TIMEOUT = int(os.environ.get('FFPROBE_DOWNLOAD_TIMEOUT', '300'))
+FFPROBE_RUN_TIMEOUT = int(os.environ.get('FFPROBE_RUN_TIMEOUT', '60'))
+
+# Mốc thời gian của MP4: 1904-01-01 UTC.
+MP4_EPOCH = datetime.datetime(1904, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class UnsupportedContainer(Exception):
+    """File không phải MP4/MOV hoặc không đọc được mvhd."""
+
+
+def drive_media_url(file_id):
+    return f"{DRIVE_FILES_URL}/{file_id}?alt=media"
+
+
+def fetch_file_version(file_id, access_token, http=None):
+    # Lấy md5Checksum/modifiedTime của file (request nhỏ, không tải nội dung)
+    # để biết metadata đã lưu còn đúng với file hiện tại hay không.
+    http = http or requests
+    response = http.get(f"{DRIVE_FILES_URL}/{file_id}",
+                        params={'fields': 'md5Checksum,modifiedTime'},
+                        headers={'Authorization': f'Bearer {access_token}'}, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    info = response.json()
+    return info.get('md5Checksum'), info.get('modifiedTime')
+
+
+class _RangeReader:
+    # Đọc file trên Drive theo từng đoạn, giữ lại đoạn vừa tải để các lần đọc
+    # header liền kề không phát sinh thêm request.
+    def __init__(self, http, url, headers):
+        self.http = http
+        self.url = url
+        self.headers = headers
+        self.total_size = None
+        self._buf_start = 0
+        self._buf = b''
+
+    def _fetch(self, start, length):
+        range_headers = dict(self.headers)
+        range_headers['Range'] = f"bytes={start}-{start + length - 1}"
+        response = self.http.get(self.url, headers=range_headers, stream=True, timeout=HTTP_TIMEOUT)
+        try:
+            if response.status_code == 416:
+                return b''
+            response.raise_for_status()
+            if response.status_code == 206:
+                content_range = response.headers.get('Content-Range', '')
+                total_part = content_range.rsplit('/', 1)[-1]
+                if total_part.isdigit():
+                    self.total_size = int(total_part)
+                return response.raw.read(length, decode_content=True)
+
+            # Server bỏ qua Range: chỉ đọc đúng đoạn cần rồi đóng kết nối.
+            content_length = response.headers.get('Content-Length', '')
+            if content_length.isdigit():
+                self.total_size = int(content_length)
+            skipped = 0
+            while skipped < start:
+                chunk = response.raw.read(min(65536, start - skipped), decode_content=True)
+                if not chunk:
+                    return b''
+                skipped += len(chunk)
+            return response.raw.read(length, decode_content=True)
+        finally:
+            response.close()
+
+    def read(self, start, length, prefetch=0):
+        buf_end = self._buf_start + len(self._buf)
+        if self._buf_start <= start and start + length <= buf_end:
+            offset = start - self._buf_start
+            return self._buf[offset:offset + length]
+        data = self._fetch(start, max(length, prefetch))
+        self._buf_start, self._buf = start, data
+        return data[:length]
+
+
+def _parse_atom_header(data):
+    # Trả về (kích thước atom, loại atom, độ dài header) hoặc None nếu thiếu byte.
+    if len(data) < 8:
+        return None
+    size, atom_type = struct.unpack_from('>I4s', data, 0)
+    header_len = 8
+    if size == 1:
+        if len(data) < 16:
+            return None
+        size = struct.unpack_from('>Q', data, 8)[0]
+        header_len = 16
+    return size, atom_type, header_len
+
+
+def _parse_mvhd(payload):
+    version = payload[0] if payload else None
+    if version == 1 and len(payload) >= 12:
+        seconds = struct.unpack_from('>Q', payload, 4)[0]
+    elif version == 0 and len(payload) >= 8:
+        seconds = struct.unpack_from('>I', payload, 4)[0]
+    else:
+        raise UnsupportedContainer("mvhd không hợp lệ")
+    if seconds == 0:
+        # Máy quay không ghi thời gian; ffprobe cũng không trả creation_time.
+        return None
+    created = MP4_EPOCH + datetime.timedelta(seconds=seconds)
+    # Giữ đúng định dạng ffprobe trả về để frontend không phải đổi gì.
+    return created.strftime('%Y-%m-%dT%H:%M:%S.000000Z')
+
+
+def _iter_atoms(reader, start, end, prefetch):
+    # Duyệt các atom liền kề trong [start, end); end=None nghĩa là tới cuối file.
+    offset = start
+    for _ in range(MAX_ATOMS_PER_LEVEL):
+        limit = end if end is not None else reader.total_size
+        if limit is not None and offset + 8 > limit:
+            return
+        parsed = _parse_atom_header(reader.read(offset, 16, prefetch))
+        if parsed is None:
+            return
+        size, atom_type, header_len = parsed
+        if size == 0:
+            # Atom kéo dài tới cuối vùng chứa.
+            limit = end if end is not None else reader.total_size
+            if limit is None:
+                raise UnsupportedContainer("Không xác định được kích thước file")
+            size = limit - offset
+        if size < header_len:
+            raise UnsupportedContainer("Atom có kích thước không hợp lệ")
+        yield offset, size, atom_type, header_len
+        offset += size
+
+
+def probe_creation_time(file_id, access_token, http=None):
+    # Đọc creation_time từ header MP4/MOV bằng Range request.
+    # Ném UnsupportedContainer nếu file không phải định dạng đọc được.
+    reader = _RangeReader(http or requests, drive_media_url(file_id),
+                          {'Authorization': f'Bearer {access_token}'})
+
+    head = reader.read(0, HEAD_PROBE_SIZE)
+    if reader.total_size is None and len(head) < HEAD_PROBE_SIZE:
+        reader.total_size = len(head)
+    first = _parse_atom_header(head)
+    if first is None or first[1] not in KNOWN_TOP_LEVEL_ATOMS:
+        raise UnsupportedContainer("Không phải MP4/MOV")
+
+    for offset, size, atom_type, header_len in _iter_atoms(reader, 0, None, MOOV_PROBE_SIZE):
+        if atom_type != b'moov':
+            continue
+        moov_end = offset + size
+        for child_offset, child_size, child_type, child_header_len in _iter_atoms(
+                reader, offset + header_len, moov_end, MOOV_PROBE_SIZE):
+            if child_type == b'mvhd':
+                payload_len = min(child_size - child_header_len, 12)
+                return _parse_mvhd(reader.read(child_offset + child_header_len, payload_len, MOOV_PROBE_SIZE))
+        raise UnsupportedContainer("Không tìm thấy mvhd trong moov")
+    raise UnsupportedContainer("Không tìm thấy moov")
+
+
+def ffprobe_creation_time(file_id, access_token, http=None, observe=None):
+    # Cách cũ: tải toàn bộ file rồi chạy ffprobe. Chỉ dùng khi không đọc được header.
+    # observe(stage, giây) nhận thời gian tải ('download') và chạy ffprobe ('ffprobe').
+    http = http or requests
+    temp_video_path = ""
+    try:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".tmp") as tmp:
+            temp_video_path = tmp.name
+
+        headers = {'Authorization': f'Bearer {access_token}'}
+        started = time.perf_counter()
+        deadline = started + FFPROBE_DOWNLOAD_TIMEOUT
+        response = http.get(drive_media_url(file_id), headers=headers, stream=True, timeout=HTTP_TIMEOUT)
+        try:
+            response.raise_for_status()
+            with open(temp_video_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    f.write(chunk)
+                    if time.perf_counter() > deadline:
+                        raise requests.Timeout(f"Tải video quá {FFPROBE_DOWNLOAD_TIMEOUT} giây")
+        finally:
+            response.close()
+        if observe:
+            observe('download', time.perf_counter() - started)
+
+        command = ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', temp_video_path]
+        started = time.perf_counter()
+        result = subprocess.run(command, capture_output=True, text=True, check=True,
+                                timeout=FFPROBE_RUN_TIMEOUT)
+        if observe:
+            observe('ffprobe', time.perf_counter() - started)
+        metadata = json.loads(result.stdout)
+        return metadata.get('format', {}).get('tags', {}).get('creation_time')
+    finally:
+        if temp_video_path and os.path.exists(temp_video_path):
+            os.remove(temp_video_path)
+
+
+def get_creation_time(file_id, access_token, http=None, observe=None):
+    # observe(stage, giây), nếu có, nhận thời gian đọc header bằng Range request
+    # ('range_probe') và của cách cũ khi phải quay về ffprobe
+    started = time.perf_counter()
+    try:
+        creation_time = probe_creation_time(file_id, access_token, http=http)
+    except UnsupportedContainer:
+        if observe:
+            observe('range_probe', time.perf_counter() - started)
+        return ffprobe_creation_time(file_id, access_token, http=http, observe=observe)
+    if observe:
+        observe('range_probe', time.perf_counter() - started)
+    return creation_time
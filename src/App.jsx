@@ -9,7 +9,94 @@ import AdminView from './views/Admin/AdminView.jsx';
 import PhotoGalleryView from './views/PhotoGallery/PhotoGalleryView.jsx';
 
 // Import các hàm và hằng số
-import { calculateHammingDistance } from './utils/helpers.js';
+
+// Backend trả 429 kèm Retry-After khi quá tải hoặc gửi quá nhiều request nặng:
+// chờ đúng thời gian đó rồi gửi lại, tối đa maxRetries lần
+const fetchWithRetry = async (url, options, maxRetries = 3) => {
+    for (let attempt = 0; ; attempt++) {
+        const response = await fetch(url, options);
+        if (response.status !== 429 || attempt >= maxRetries) return response;
+        const retryAfter = parseInt(response.headers.get('Retry-After'), 10);
+        await new Promise(resolve => setTimeout(resolve, (Number.isFinite(retryAfter) ? retryAfter : 1) * 1000));
+    }
+};
+
+// Đồng bộ delta (?since=<version>): backend trả { version, full, upserts, deleted }.
+// Giữ bản sao các dòng theo id, áp phần thay đổi rồi sắp xếp lại theo cùng thứ tự với
+// backend. Lần đầu since=0 nên nhận toàn bộ danh sách.
+const compareBy = (...fields) => (a, b) => {
+    for (const field of fields) {
+        const x = a[field] ?? '', y = b[field] ?? '';
+        if (x < y) return -1;
+        if (x > y) return 1;
+    }
+    return 0;
+};
+
+const applyDelta = (state, delta, compare) => {
+    if (delta.full) state.rows = new Map();
+    delta.upserts.forEach(row => state.rows.set(row.id, row));
+    delta.deleted.forEach(id => state.rows.delete(id));
+    state.version = delta.version;
+    return Array.from(state.rows.values()).sort(compare);
+};
+
+const SYNC_ORDER = {
+    '/recurring-schedules': compareBy('schoolName', 'className', 'id'),
+    '/one-off-schedules': compareBy('date', 'startTime', 'id'),
+    '/users': compareBy('id'),
+};
+
+// Đọc response NDJSON (mỗi dòng một object JSON) và gọi onItem ngay khi nhận đủ từng dòng
+const readNdjson = async (response, onItem) => {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    const handleLine = (line) => {
+        if (line.trim()) onItem(JSON.parse(line));
+    };
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split('\n');
+        buffered = lines.pop();
+        lines.forEach(handleLine);
+    }
+    handleLine(buffered);
+};
+
+// Đọc response Server-Sent Events qua fetch (EventSource không gửi được header
+// x-access-token) và gọi onEvent(event, data, id) cho từng sự kiện
+const readSse = async (response, onEvent) => {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    const handleBlock = (block) => {
+        let event = 'message';
+        let id = null;
+        const data = [];
+        block.split('\n').forEach((line) => {
+            if (!line || line.startsWith(':')) return;
+            const sep = line.indexOf(':');
+            const field = sep === -1 ? line : line.slice(0, sep);
+            const value = sep === -1 ? '' : line.slice(sep + 1).replace(/^ /, '');
+            if (field === 'event') event = value;
+            else if (field === 'data') data.push(value);
+            else if (field === 'id') id = value;
+        });
+        if (data.length) onEvent(event, JSON.parse(data.join('\n')), id);
+    };
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffered += decoder.decode(value, { stream: true });
+        const blocks = buffered.split('\n\n');
+        buffered = blocks.pop();
+        blocks.forEach(handleBlock);
+    }
+    handleBlock(buffered);
+};
 
 // --- Main App Component ---
 function App() {
@@ -36,6 +123,8 @@ function App() {
   const [imageAnalyzer, setImageAnalyzer] = useState(null);
 
   const logContainerRef = useRef(null);
+  // Trạng thái đồng bộ delta theo endpoint: { token, version, rows }
+  const syncStateRef = useRef({});
 
   const log = useCallback((message, type = 'info') => {
     const now = new Date().toLocaleTimeString();
@@ -50,7 +139,28 @@ function App() {
       log('Đã đăng xuất.', 'info');
   }, [log]);
 
-  const handleAuthError = useCallback(() => {
+  const handleAuthError = useCallback(async () => {
+    // Thử lấy token mới từ backend (backend tự làm mới bằng refresh token) trước khi
+    // bắt người dùng cấp quyền lại giữa chừng
+    const apiToken = localStorage.getItem('apiToken');
+    if (apiToken) {
+        try {
+            const response = await fetch('/api/drive/token', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json', 'x-access-token': apiToken },
+                body: JSON.stringify({ staleToken: localStorage.getItem('accessToken') }),
+            });
+            if (response.ok) {
+                const data = await response.json();
+                setAccessToken(data.accessToken);
+                localStorage.setItem('accessToken', data.accessToken);
+                log('Đã làm mới quyền truy cập Google Drive.', 'success');
+                return;
+            }
+        } catch (error) {
+            // Không lấy được token mới: quay về yêu cầu cấp quyền lại như cũ
+        }
+    }
     log('Lỗi xác thực Google Drive hoặc phiên đã hết hạn. Yêu cầu cấp quyền lại.', 'error');
     setAccessToken(null);
     localStorage.removeItem('accessToken');
@@ -90,7 +200,7 @@ function App() {
     
     const url = `/api${endpoint}`;
     
-    const response = await fetch(url, options);
+    const response = await fetchWithRetry(url, options);
     if (!response.ok) {
         if (response.status === 401) {
             log('Phiên đăng nhập đã hết hạn hoặc không hợp lệ. Vui lòng đăng nhập lại.', 'error');
@@ -103,6 +213,17 @@ function App() {
     return text ? JSON.parse(text) : {};
   }, [log, handleLogout]);
 
+  // GET danh sách qua đồng bộ delta: chỉ tải các dòng đã đổi từ lần trước. Đổi tài khoản
+  // (token khác) thì bắt đầu lại từ đầu.
+  const fetchSyncedList = useCallback(async (endpoint, token) => {
+    let state = syncStateRef.current[endpoint];
+    if (!state || state.token !== token) {
+        state = syncStateRef.current[endpoint] = { token, version: 0, rows: new Map() };
+    }
+    const delta = await fetchApiData(`${endpoint}?since=${state.version}`, 'GET', null, token);
+    return applyDelta(state, delta, SYNC_ORDER[endpoint]);
+  }, [fetchApiData]);
+
   useEffect(() => {
     const fetchInitialSettings = async () => {
         try {
@@ -110,7 +231,8 @@ function App() {
             setSettings({
                 client_id: settingsData.client_id || '',
                 api_key: settingsData.api_key || '',
-                source_folder_id: settingsData.source_folder_id || ''
+                source_folder_id: settingsData.source_folder_id || '',
+                drive_offline_access: !!settingsData.drive_offline_access
             });
         } catch (error) {
             log(`Lỗi tải cài đặt: ${error.message}`, 'error');
@@ -131,7 +253,8 @@ function App() {
       try {
           await fetchApiData('/save_drive_token', 'POST', { 
             access_token: tokenData.access_token,
-            refresh_token: tokenData.refresh_token 
+            refresh_token: tokenData.refresh_token,
+            expires_in: tokenData.expires_in
           }, apiToken);
           log('Lưu Access Token Drive thành công.', 'success');
       } catch (error) {
@@ -147,6 +270,32 @@ function App() {
     
     log('Yêu cầu cấp quyền Google Drive...', 'info');
     try {
+        if (settings.drive_offline_access) {
+            // Backend có client secret: xin authorization code để backend đổi lấy access
+            // token + refresh token và tự làm mới token khi hết hạn
+            const codeClient = window.google.accounts.oauth2.initCodeClient({
+                client_id: settings.client_id,
+                scope: 'https://www.googleapis.com/auth/drive',
+                ux_mode: 'popup',
+                callback: async (codeResponse) => {
+                    if (codeResponse.error) {
+                        log(`Lỗi lấy quyền truy cập Drive: ${codeResponse.error}. Vui lòng thử lại.`, 'error');
+                        return;
+                    }
+                    try {
+                        const data = await fetchApiData('/drive/oauth-code', 'POST', { code: codeResponse.code }, userApiToken);
+                        setAccessToken(data.accessToken);
+                        localStorage.setItem('accessToken', data.accessToken);
+                        log('Đã có quyền truy cập Google Drive!', 'success');
+                    } catch (error) {
+                        log(`Lỗi lấy quyền truy cập Drive: ${error.message}`, 'error');
+                    }
+                },
+            });
+            codeClient.requestCode();
+            return;
+        }
+
         const client = window.google.accounts.oauth2.initTokenClient({
             client_id: settings.client_id,
             scope: 'https://www.googleapis.com/auth/drive', 
@@ -172,7 +321,7 @@ function App() {
     } catch (err) {
         log(`Lỗi khởi tạo OAuth2 Client: ${err.message}`, 'error');
     }
-  }, [settings?.client_id, log, saveDriveAccessToken]);
+  }, [settings?.client_id, settings?.drive_offline_access, log, saveDriveAccessToken, fetchApiData]);
 
 
   useEffect(() => {
@@ -180,11 +329,12 @@ function App() {
         const fetchSchedules = async () => {
             try {
                 const [recurringRes, oneOffRes] = await Promise.all([
-                    fetchApiData('/recurring-schedules', 'GET', null, currentUser.apiToken),
-                    fetchApiData('/one-off-schedules', 'GET', null, currentUser.apiToken)
+                    fetchSyncedList('/recurring-schedules', currentUser.apiToken),
+                    fetchSyncedList('/one-off-schedules', currentUser.apiToken)
                 ]);
                 setRecurringSchedule(recurringRes);
-                setOneOffSchedule(oneOffRes.sort((a, b) => new Date(a.date) - new Date(b.date)));
+                // applyDelta sắp xếp theo ngày và giờ bắt đầu như backend
+                setOneOffSchedule(oneOffRes);
                 log('Tải dữ liệu lịch học thành công.', 'success');
                 
             } catch (error) {
@@ -196,7 +346,7 @@ function App() {
             requestDriveAccessToken(currentUser.apiToken);
         }
     }
-  }, [currentUser, log, fetchApiData, accessToken, requestDriveAccessToken]);
+  }, [currentUser, log, fetchSyncedList, accessToken, requestDriveAccessToken]);
     
   useEffect(() => {
     const scriptId = 'google-gsi-script';
@@ -306,13 +456,69 @@ function App() {
             return null;
         }
     }, [accessToken, log, fetchApiData, currentUser?.apiToken]); 
+
+    // Danh sách file/thư mục con của một thư mục Drive, đọc từ chỉ mục phía backend
+    // (backend chỉ lấy phần thay đổi từ Drive kể từ lần trước). type: all | media | folders
+    const listDriveFolder = useCallback(async (folderId, type = 'all') => {
+        const response = await fetch(`/api/drive/folders/${encodeURIComponent(folderId)}/files?type=${type}`, {
+            headers: { 'x-access-token': currentUser?.apiToken },
+        });
+        if (!response.ok) {
+            const errorData = await response.json().catch(() => ({}));
+            if (response.status === 401) handleAuthError();
+            throw new Error(errorData.error || `Yêu cầu thất bại với mã trạng thái ${response.status}`);
+        }
+        return (await response.json()).files || [];
+    }, [currentUser?.apiToken, handleAuthError]);
+
+    // Lấy creation_time cho nhiều video trong một request; backend trả NDJSON,
+    // mỗi dòng một video ngay khi xử lý xong. Gửi kèm md5Checksum/modifiedTime để
+    // backend trả luôn từ cache nếu video chưa đổi. Trả về map fileId -> creation_time.
+    const getVideoCreationTimes = useCallback(async (videoFiles, onResult = null) => {
+        const results = {};
+        if (!videoFiles || videoFiles.length === 0) return results;
+        if (!accessToken) {
+            log('Lỗi: Thiếu Access Token Google Drive khi lấy metadata video.', 'error');
+            return results;
+        }
+
+        const BATCH_SIZE = 200;
+        for (let i = 0; i < videoFiles.length; i += BATCH_SIZE) {
+            try {
+                const response = await fetchWithRetry('/api/video-metadata/batch', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json', 'x-access-token': currentUser?.apiToken },
+                    body: JSON.stringify({
+                        files: videoFiles.slice(i, i + BATCH_SIZE).map(f => ({ id: f.id, md5Checksum: f.md5Checksum, modifiedTime: f.modifiedTime })),
+                        accessToken,
+                    }),
+                });
+                if (!response.ok) {
+                    const errorData = await response.json().catch(() => ({}));
+                    throw new Error(errorData.error || `Yêu cầu thất bại với mã trạng thái ${response.status}`);
+                }
+
+                await readNdjson(response, (item) => {
+                    if (item.error) {
+                        log(`Lỗi khi lấy metadata video ${item.fileId}: ${item.error}`, 'warn');
+                        return;
+                    }
+                    results[item.fileId] = item.creation_time;
+                    if (onResult && item.creation_time) onResult(item.fileId, item.creation_time);
+                });
+            } catch (error) {
+                log(`Lỗi khi lấy metadata video: ${error.message}. Vui lòng kiểm tra backend và token.`, 'error');
+            }
+        }
+        return results;
+    }, [accessToken, log, currentUser?.apiToken]);
   
     const toYYYYMMDD = (date) => new Date(date).toISOString().split('T')[0];
     
     const getUsers = useCallback(async () => {
         if (!currentUser?.apiToken) throw new Error("Chưa xác thực hoặc thiếu token API.");
-        return await fetchApiData('/users', 'GET', null, currentUser.apiToken);
-    }, [currentUser?.apiToken, fetchApiData]);
+        return await fetchSyncedList('/users', currentUser.apiToken);
+    }, [currentUser?.apiToken, fetchSyncedList]);
 
     const createUser = useCallback(async (userData) => {
         if (!currentUser?.apiToken) throw new Error("Chưa xác thực hoặc thiếu token API.");
@@ -362,21 +568,6 @@ function App() {
     // MAIN ORGANIZE FUNCTION
     // ------------------
     const organizePhotos = useCallback(async () => {
-      // Normalize imageAnalyzer into an actual analyzer function that accepts (blob, fileName)
-      let analyzerFunc = null;
-      if (typeof imageAnalyzer === 'function') {
-        // If imageAnalyzer was stored directly as analyzer (arity >= 1), use it.
-        // If it is a zero-arg factory (unexpected but possible), call it once.
-        analyzerFunc = (imageAnalyzer.length === 0) ? imageAnalyzer() : imageAnalyzer;
-      }
-
-      if (typeof analyzerFunc !== 'function') {
-          log('Lỗi: Bộ phân tích AI chưa sẵn sàng hoặc không phải là một hàm. Vui lòng đợi model tải xong rồi thử lại.', 'error');
-          console.error('[App.jsx] LỖI NGHIÊM TRỌNG: analyzerFunc không phải là một hàm.', analyzerFunc);
-          setIsProcessing(false);
-          return;
-      }
-
       if (!accessToken) {
           log('Cảnh báo: Frontend chưa có Access Token Drive. Đang thử dựa vào token DB...', 'warn');
       }
@@ -384,17 +575,7 @@ function App() {
       if (!currentUser?.apiToken) {
           log('Lỗi: Thiếu API Token xác thực.', 'error'); setIsProcessing(false); return;
       }
-      
-      log(`Bắt đầu quá trình sắp xếp...`);
-      setIsProcessing(true); setProgress(0);
-      
-      const apiKey = settings?.api_key; 
-      if (!apiKey) {
-          log('Lỗi: Google API Key chưa được cấu hình trong Cài đặt.', 'error');
-          setIsProcessing(false);
-          return;
-      }
-  
+
       const getFolderIdFromInput = (input) => {
         const match = input.match(/[-\w]{25,}/);
         if (match && match[0] !== input) {
@@ -404,224 +585,84 @@ function App() {
         return input;
       };
 
-      const driveApi = async (path, method = 'GET', body = null) => {
-          const headers = { 'Authorization': `Bearer ${accessToken}`, 'Content-Type': 'application/json' };
-          const url = `https://www.googleapis.com/drive/v3/${path}${path.includes('?') ? '&' : '?'}key=${apiKey}`; 
-          const options = { method, headers };
-          if (body) options.body = JSON.stringify(body);
-          
-          if (!accessToken) {
-             throw new Error("Drive Access Token bị thiếu. Vui lòng cấp quyền Drive.");
-          }
-
-          const response = await fetch(url, options);
-          if (!response.ok) {
-              if (response.status === 401 || response.status === 403) {
-                  handleAuthError();
-              }
-              const errorData = await response.json().catch(() => ({}));
-              throw new Error(errorData.error?.message || `Lỗi API: ${response.status}`);
-          }
-          return response.json();
+      // Màu log theo kết quả xử lý từng file của job
+      const outcomeLogTypes = {
+          selected: 'success', moved: 'info', unmatched: 'info', 'invalid-time': 'warn',
+          duplicate: 'error', blurry: 'error', dark: 'error', unreadable: 'warn', error: 'error',
       };
-      
-      const downloadDriveFileAsBlob = async (fileId) => {
-          const url = `https://www.googleapis.com/drive/v3/files/${fileId}?alt=media`;
-          const headers = { 'Authorization': `Bearer ${accessToken}` };
-          const response = await fetch(url, { headers });
-           if (!response.ok) {
-              if (response.status === 401 || response.status === 403) {
-                  handleAuthError();
-              }
-              const errorText = await response.text();
-              throw new Error(`Lỗi tải file ${fileId}: ${response.status} ${errorText}`);
-          }
-          return response.blob();
-      };
-      
+
+      log(`Bắt đầu quá trình sắp xếp...`);
+      setIsProcessing(true); setProgress(0);
+
       try {
-          const actualFolderId = getFolderIdFromInput(settings.source_folder_id);
-          
-          const listFiles = async (folderId) => {
-              let files = [];
-              let pageToken = '';
-              const requiredFields = 'id, name, createdTime, modifiedTime, imageMediaMetadata(time), mimeType, parents';
-              do {
-                  const params = new URLSearchParams({
-                      q: `'${folderId}' in parents and (mimeType contains 'image/' or mimeType contains 'video/') and trashed = false`,
-                      fields: `nextPageToken, files(${requiredFields})`, pageSize: 100,
-                  });
-                  if (pageToken) params.append('pageToken', pageToken);
-                  const data = await driveApi(`files?${params.toString()}`);
-                  if (data.files) files = files.concat(data.files);
-                  pageToken = data.nextPageToken;
-              } while (pageToken);
-              return files;
-          };
-  
-          const findOrCreateFolder = async (folderName, parentId) => {
-              const params = new URLSearchParams({
-                  q: `mimeType='application/vnd.google-apps.folder' and name='${folderName}' and '${parentId}' in parents and trashed = false`,
-                  fields: 'files(id)', pageSize: 1,
-              });
-              const search = await driveApi(`files?${params.toString()}`);
-              if (search.files?.length > 0) return search.files[0].id;
-              log(`Đang tạo thư mục mới: '${folderName}'...`, 'warn');
-              return (await driveApi('files', 'POST', { name: folderName, mimeType: 'application/vnd.google-apps.folder', parents: [parentId] })).id;
-          };
-  
-          const moveFile = (fileId, oldParentId, newParentId) => {
-              const params = new URLSearchParams({ addParents: newParentId, removeParents: oldParentId, fields: 'id, parents' });
-              return driveApi(`files/${fileId}?${params.toString()}`, 'PATCH');
-          };
-  
-          const allFiles = await listFiles(actualFolderId);
-          log(`Tìm thấy ${allFiles.length} file (ảnh & video). Bắt đầu phân loại...`);
-          if (allFiles.length === 0) { setIsProcessing(false); return; }
-  
-          const destinationFolders = {};
-          let processedHashes = [];
-          let filesProcessed = 0;
-  
-          for (let i = 0; i < allFiles.length; i += concurrencyLevel) {
-              const batch = allFiles.slice(i, i + concurrencyLevel);
-              const promises = batch.map(async (file) => {
-                  try {
-                      let timestamp;
-                      let timestampSource = '';
-                      
-                      if (file.mimeType.startsWith('video/')) {
-                          const videoCreationTime = await getVideoCreationTime(file.id);
-                          if (videoCreationTime) {
-                              timestamp = videoCreationTime;
-                              timestampSource = 'Ngày quay (Video)';
-                          } else {
-                              timestamp = file.createdTime;
-                              timestampSource = 'Ngày tạo (Video)';
-                          }
-                      } else { 
-                          if (timeField === 'exifTime' && file.imageMediaMetadata?.time) {
-                              timestamp = file.imageMediaMetadata.time.replace(/(\d{4}):(\d{2}):(\d{2})/, '$1-$2-$3');
-                              timestampSource = 'Ngày chụp (EXIF)';
-                          } else {
-                              timestamp = file[timeField] || file.createdTime;
-                              timestampSource = timeField === 'createdTime' ? 'Ngày tạo' : 'Ngày chỉnh sửa';
-                          }
-                      }
-                      
-                      const fileDate = new Date(timestamp);
-                      if (isNaN(fileDate.getTime())) {
-                          log(`Bỏ qua '${file.name}': giá trị thời gian không hợp lệ.`, 'warn');
-                          return;
-                      }
-                      log(`Sử dụng ${timestampSource}: ${fileDate.toLocaleString('vi-VN')} cho file '${file.name}'.`, 'info');
-  
-                      const fileTime = fileDate.toTimeString().slice(0, 5);
-                      const fileDateString = toYYYYMMDD(fileDate);
-                      let fileDayOfWeek = fileDate.getDay();
-                      if (fileDayOfWeek === 0) fileDayOfWeek = 7;
-  
-                      let matchingEntry = oneOffSchedule.find(entry =>
-                          fileDateString === entry.date && fileTime >= entry.startTime && fileTime <= entry.endTime
-                      );
-                      if (!matchingEntry) {
-                          matchingEntry = recurringSchedule.find(entry => {
-                              const isDayMatch = entry.daysOfWeek.includes(String(fileDayOfWeek));
-                              const isTimeMatch = fileTime >= entry.startTime && fileTime <= entry.endTime;
-                              const isNotExpired = !entry.expiryDate || fileDate <= new Date(entry.expiryDate + 'T23:59:59');
-                              return isDayMatch && isTimeMatch && isNotExpired;
-                          });
-                      }
-                      
-                      if (!matchingEntry) {
-                          log(`'${file.name}' không khớp lịch học.`, 'info');
-                          return;
-                      }
-                      
-                      const folderName = `${matchingEntry.schoolName} - ${matchingEntry.className}`;
-                      if (!destinationFolders[folderName]) {
-                          destinationFolders[folderName] = {
-                              idPromise: findOrCreateFolder(folderName, actualFolderId),
-                              selectedIdPromise: null
-                          };
-                      }
-                      const parentFolderId = await destinationFolders[folderName].idPromise;
-  
-                      if (!file.mimeType.startsWith('image/')) {
-                          await moveFile(file.id, actualFolderId, parentFolderId);
-                          log(`Đã phân loại '${file.name}' vào '${folderName}'.`, 'info');
-                          return;
-                      }
-                      
-                      const imageBlob = await downloadDriveFileAsBlob(file.id);
-                      const analysisResult = await analyzerFunc(imageBlob, file.name);
-                      let meetsCriteria = true;
-  
-                      if (!analysisResult || analysisResult.error) {
-                          meetsCriteria = false;
-                          log(` -> Bỏ qua (${analysisResult?.error || 'lỗi không xác định'}): '${file.name}'.`, 'warn');
-                      } else {
-                           if (removeDuplicates) {
-                              const newHash = analysisResult.hash;
-                              const isSimilar = processedHashes.some(
-                                  (existingHash) => 
-                                      (calculateHammingDistance(newHash, existingHash) <= similarityThreshold)
-                              );
-                              if (isSimilar) {
-                                   meetsCriteria = false;
-                                   log(` -> Loại (tương tự): '${file.name}'.`, 'error');
-                              } else {
-                                  processedHashes = [...processedHashes, newHash]; 
-                              }
-                          }
-                          if (meetsCriteria && filterUnclearSubject) {
-                             if (analysisResult.sharpness < 50) { 
-                                meetsCriteria = false;
-                                log(` -> Loại (không rõ nét): '${file.name}' (Sharpness: ${analysisResult.sharpness.toFixed(2)}).`, 'error');
-                             }
-                          }
-                          if (meetsCriteria && filterDarkFace) {
-                              if (analysisResult.brightness < 85) { 
-                                meetsCriteria = false;
-                                log(` -> Loại (mặt tối): '${file.name}' (Brightness: ${analysisResult.brightness.toFixed(2)}).`, 'error');
-                              }
-                          }
-                      }
-  
-                      if (meetsCriteria) {
-                          if (!destinationFolders[folderName].selectedIdPromise) {
-                              destinationFolders[folderName].selectedIdPromise = findOrCreateFolder('Selected Items', await parentFolderId);
+          // Việc sắp xếp chạy thành job trên server (vẫn chạy tiếp nếu đóng trang);
+          // trình duyệt chỉ theo dõi tiến độ qua Server-Sent Events.
+          const job = await fetchApiData('/organize-jobs', 'POST', {
+              sourceFolderId: getFolderIdFromInput(settings.source_folder_id),
+              accessToken, timeField, removeDuplicates, similarityThreshold,
+              filterUnclearSubject, filterDarkFace, workers: concurrencyLevel,
+          }, currentUser.apiToken);
+          log(`Đã tạo job sắp xếp ${job.id} trên server.`, 'info');
+
+          // Mất kết nối, hoặc server đóng stream định kỳ, thì nối lại: server gửi tiếp từ
+          // sau sự kiện cuối cùng đã nhận
+          let lastEventId = null;
+          let finished = null;
+          let announced = false;
+          let failures = 0;
+          while (!finished) {
+              try {
+                  const headers = { 'x-access-token': currentUser.apiToken };
+                  if (lastEventId) headers['Last-Event-ID'] = lastEventId;
+                  const response = await fetch(`/api/organize-jobs/${job.id}/events`, { headers });
+                  if (response.status === 429) {
+                      // Server giới hạn số stream đang mở: job vẫn chạy, chờ rồi nối lại
+                      const retryAfter = parseInt(response.headers.get('Retry-After'), 10);
+                      await new Promise(resolve => setTimeout(resolve, (Number.isFinite(retryAfter) ? retryAfter : 2) * 1000));
+                      continue;
+                  }
+                  if (!response.ok) {
+                      const errorData = await response.json().catch(() => ({}));
+                      throw new Error(errorData.error || `Yêu cầu thất bại với mã trạng thái ${response.status}`);
+                  }
+                  await readSse(response, (event, data, id) => {
+                      if (id) lastEventId = id;
+                      if (event === 'file') {
+                          log(`'${data.name}': ${data.message}`, outcomeLogTypes[data.outcome] || 'info');
+                      } else if (event === 'progress') {
+                          if (data.total && !announced) {
+                              announced = true;
+                              log(`Tìm thấy ${data.total} file (ảnh & video). Bắt đầu phân loại...`);
                           }
-                          const selectedDestId = await destinationFolders[folderName].selectedIdPromise;
-                          await moveFile(file.id, actualFolderId, selectedDestId);
-                          log(` -> ĐÃ CHỌN: '${file.name}' vào 'Selected Items'.`, 'success');
-                      } else {
-                          await moveFile(file.id, actualFolderId, parentFolderId);
-                          log(` -> Đã phân loại '${file.name}' vào thư mục cha '${folderName}'.`, 'info');
+                          setProgress(data.total ? Math.round((data.processed / data.total) * 100) : 0);
+                      } else if (event === 'end') {
+                          finished = data;
                       }
-                  } catch (err) {
-                      log(`Lỗi khi xử lý file '${file.name}': ${err.message}`, 'error');
-                  }
-              });
-  
-              await Promise.allSettled(promises);
-              filesProcessed += batch.length;
-              setProgress(Math.round((filesProcessed / allFiles.length) * 100));
+                  });
+                  failures = 0;
+              } catch (error) {
+                  failures += 1;
+                  if (failures >= 5) throw error;
+                  log(`Mất kết nối theo dõi tiến độ (${error.message}), đang kết nối lại...`, 'warn');
+                  await new Promise(resolve => setTimeout(resolve, 2000));
+              }
+          }
+
+          if (finished.status === 'completed') {
+              log('Hoàn tất quá trình sắp xếp!', 'success');
+          } else if (finished.status === 'cancelled') {
+              log('Job sắp xếp đã bị huỷ.', 'warn');
+          } else {
+              log(`Job sắp xếp dừng vì lỗi: ${finished.error}`, 'error');
+              if (finished.error?.includes('Token Google Drive')) handleAuthError();
           }
-  
-          log('Hoàn tất quá trình sắp xếp!', 'success');
-          
       } catch (error) {
           log(`Đã xảy ra lỗi nghiêm trọng: ${error.message}`, 'error');
-          if (error.message.includes('Drive Access Token bị thiếu') || error.message.includes('Lỗi API: 401')) {
-              log('Token Drive bị Google từ chối. Vui lòng cấp quyền lại.', 'error');
-              setAccessToken(null); 
-          }
       } finally {
           setIsProcessing(false);
       }
 
-    }, [settings.source_folder_id, log, accessToken, timeField, removeDuplicates, filterUnclearSubject, filterDarkFace, similarityThreshold, imageAnalyzer, recurringSchedule, oneOffSchedule, getVideoCreationTime, concurrencyLevel, settings?.api_key, currentUser?.apiToken, handleAuthError]); 
+    }, [settings.source_folder_id, log, accessToken, timeField, removeDuplicates, filterUnclearSubject, filterDarkFace, similarityThreshold, fetchApiData, concurrencyLevel, currentUser?.apiToken, handleAuthError]);
   
   const renderLog = () => {
     const colorMap = {
@@ -708,7 +749,7 @@ function App() {
 
         <div className="main-content">
             {view === 'schedule' && <ScheduleView recurringSchedule={recurringSchedule} setRecurringSchedule={setRecurringSchedule} oneOffSchedule={oneOffSchedule} setOneOffSchedule={setOneOffSchedule} log={log} currentUser={currentUser}/>}
-            {view === 'gallery' && <PhotoGalleryView accessToken={accessToken} apiKey={settings?.api_key} sourceFolderId={settings?.source_folder_id} log={log} getVideoCreationTime={getVideoCreationTime} getDriveToken={getDriveAccessToken} onAuthError={handleAuthError} />}
+            {view === 'gallery' && <PhotoGalleryView accessToken={accessToken} apiKey={settings?.api_key} sourceFolderId={settings?.source_folder_id} log={log} getVideoCreationTime={getVideoCreationTime} getVideoCreationTimes={getVideoCreationTimes} getDriveToken={getDriveAccessToken} onAuthError={handleAuthError} listDriveFolder={listDriveFolder} />}
             {view === 'organizer' && <OrganizerView {...organizerProps} />} 
             {currentUser.role === 'Admin' && view === 'settings' && <SettingsView {...settingsProps} />}
             {currentUser.role === 'Admin' && view === 'admin' && <AdminView {...adminProps} />}
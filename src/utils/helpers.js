@@ -1,5 +1,12 @@
 export const toYYYYMMDD = (date) => new Date(date).toISOString().split('T')[0];
 
+// Ngày theo giờ địa phương (toYYYYMMDD đổi sang UTC nên lệch một ngày ở múi giờ dương)
+export const toLocalYYYYMMDD = (date) => {
+    const d = new Date(date);
+    const pad = (n) => String(n).padStart(2, '0');
+    return `${d.getFullYear()}-${pad(d.getMonth() + 1)}-${pad(d.getDate())}`;
+};
+
 export const hexToBinary = (hexString) => {
     if (!hexString || typeof hexString !== 'string') return '';
     return hexString.split('').map(c => parseInt(c, 16).toString(2).padStart(4, '0')).join('');
@@ -302,7 +302,7 @@ function OrganizerView({
     
     const sourceFolderId = settings.source_folder_id;
     const isCurrentUserExist = !!currentUser;
-    const isDisabled = isProcessing || !sourceFolderId || !isCurrentUserExist || !isSignedIn || !isAnalyzerReady;
+    const isDisabled = isProcessing || !sourceFolderId || !isCurrentUserExist || !isSignedIn;
     
     const handleOrganizeClick = () => {
         if (typeof organizePhotos === 'function') {
@@ -398,7 +398,7 @@ function OrganizerView({
                 {(!sourceFolderId && isCurrentUserExist) && (
                   <p className="text-center text-sm text-yellow-600 mt-2 font-semibold">Vui lòng nhập ID Thư mục Nguồn trong Cài đặt (Admin) để kích hoạt.</p>
                 )}
-                 {(isSignedIn && sourceFolderId && !isProcessing && isAnalyzerReady) && (
+                 {(isSignedIn && sourceFolderId && !isProcessing) && (
                     <p className="text-center text-sm text-green-600 mt-2 font-semibold">Sẵn sàng để sắp xếp. Nhấp 'Bắt đầu Sắp xếp'.</p>
                 )}
             </div>
@@ -312,7 +312,7 @@ const removeDiacritics = (str) => {
 };
 
 // --- Main Gallery View Component ---
-function PhotoGalleryView({ accessToken, apiKey, sourceFolderId, log, getVideoCreationTime, getDriveToken, onAuthError }) {
+function PhotoGalleryView({ accessToken, apiKey, sourceFolderId, log, getVideoCreationTime, getVideoCreationTimes, getDriveToken, onAuthError, listDriveFolder }) {
     const [tree, setTree] = useState({});
     const [expandedFolders, setExpandedFolders] = useState([]);
     const [currentFiles, setCurrentFiles] = useState([]);
@@ -376,11 +376,7 @@ function PhotoGalleryView({ accessToken, apiKey, sourceFolderId, log, getVideoCr
             
             log('Đang tải cấu trúc thư mục từ Google Drive...', 'info');
             try {
-                const params = new URLSearchParams({
-                    q: `'${actualFolderId}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false`,
-                    fields: 'files(id, name)', pageSize: 1000,
-                });
-                const res = await driveApi(`files?${params.toString()}`);
+                const res = { files: await listDriveFolder(actualFolderId, 'folders') };
                 const folderTree = {};
                 if (res.files) {
                     res.files.forEach(folder => {
@@ -408,7 +404,7 @@ function PhotoGalleryView({ accessToken, apiKey, sourceFolderId, log, getVideoCr
             }
         };
         fetchFolderTree();
-    }, [accessToken, apiKey, sourceFolderId, log, driveApi]);
+    }, [accessToken, sourceFolderId, log, listDriveFolder]);
 
     // MODIFIED: Function now accepts schoolName to store it in state
     const handleClassClick = (schoolName, className, classId) => {
@@ -431,32 +427,12 @@ function PhotoGalleryView({ accessToken, apiKey, sourceFolderId, log, getVideoCr
             setError(null);
             
             try {
-                const listFiles = async (folderId, fields) => {
-                    const params = new URLSearchParams({
-                        q: `'${folderId}' in parents and (mimeType contains 'image/' or mimeType contains 'video/') and trashed=false`,
-                        fields: `files(${fields},createdTime,imageMediaMetadata(time))`,
-                        pageSize: 1000,
-                    });
-                    const res = await driveApi(`files?${params.toString()}`);
-                    return res.files || [];
-                };
-
-                const findSelectedFolderId = async (parentId) => {
-                    const params = new URLSearchParams({
-                        q: `'${parentId}' in parents and name='Selected Items' and mimeType='application/vnd.google-apps.folder' and trashed=false`,
-                        fields: 'files(id)', pageSize: 1,
-                    });
-                    const res = await driveApi(`files?${params.toString()}`);
-                    return res.files.length > 0 ? res.files[0].id : null;
-                };
-                
-                // Fields needed for display and functionality
-                const fields = 'id, name, thumbnailLink, mimeType';
-                const classFilesPromise = listFiles(classId, fields);
-                const selectedFolderId = await findSelectedFolderId(classId);
-                const selectedFilesPromise = selectedFolderId ? listFiles(selectedFolderId, fields) : Promise.resolve([]);
-
-                const [classFiles, selectedFilesResult] = await Promise.all([classFilesPromise, selectedFilesPromise]);
+                // Backend trả cả ảnh/video lẫn thư mục con (trong đó có 'Selected Items')
+                const classEntries = await listDriveFolder(classId, 'all');
+                const isFolder = (f) => f.mimeType === 'application/vnd.google-apps.folder';
+                const classFiles = classEntries.filter(f => !isFolder(f));
+                const selectedFolder = classEntries.find(f => isFolder(f) && f.name === 'Selected Items');
+                const selectedFilesResult = selectedFolder ? await listDriveFolder(selectedFolder.id, 'media') : [];
                 
                 const selectedFileIds = new Set(selectedFilesResult.map(f => f.id));
                 const rawFiles = [
@@ -468,7 +444,20 @@ function PhotoGalleryView({ accessToken, apiKey, sourceFolderId, log, getVideoCr
                 setIsLoading(false);
                 log(`Tìm thấy ${rawFiles.length} tệp. Bắt đầu xử lý metadata...`, 'success');
 
-                if (typeof getVideoCreationTime === 'function') {
+                if (typeof getVideoCreationTimes === 'function') {
+                    const videoFiles = rawFiles.filter(f => f.mimeType.startsWith('video/'));
+                    if (videoFiles.length > 0) {
+                        log(`Đang lấy metadata cho ${videoFiles.length} video...`, 'info');
+                        await getVideoCreationTimes(videoFiles, (fileId, videoTime) => {
+                            setAllLoadedFiles(prevFiles =>
+                                prevFiles.map(f =>
+                                    f.id === fileId ? { ...f, videoCreationTime: videoTime } : f
+                                )
+                            );
+                        });
+                        log('Lấy metadata video hoàn tất.', 'success');
+                    }
+                } else if (typeof getVideoCreationTime === 'function') {
                     const videoFiles = rawFiles.filter(f => f.mimeType.startsWith('video/'));
                     if (videoFiles.length > 0) {
                         log(`Đang lấy metadata cho ${videoFiles.length} video...`, 'info');
@@ -499,7 +488,7 @@ function PhotoGalleryView({ accessToken, apiKey, sourceFolderId, log, getVideoCr
         };
 
         fetchAndEnrichFiles();
-    }, [currentClassInfo, driveApi, log, getVideoCreationTime, accessToken]);
+    }, [currentClassInfo, listDriveFolder, log, getVideoCreationTime, getVideoCreationTimes, accessToken]);
 
     useEffect(() => {
         let filesToFilter = [...allLoadedFiles];
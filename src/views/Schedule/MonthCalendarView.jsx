@@ -1,8 +1,8 @@
 import React, { useMemo } from 'react';
-import { toYYYYMMDD } from '../../utils/helpers';
+import { toLocalYYYYMMDD } from '../../utils/helpers';
 import { weekDayNames } from '../../utils/constants';
 
-const MonthCalendarView = ({ currentDate, recurringSchedule, oneOffSchedule }) => {
+const MonthCalendarView = ({ currentDate, calendarDays }) => {
     const stringToColor = (str) => {
         let hash = 0;
         for (let i = 0; i < str.length; i++) {
@@ -41,18 +41,12 @@ const MonthCalendarView = ({ currentDate, recurringSchedule, oneOffSchedule }) =
             </div>
             <div className="grid grid-cols-7 grid-rows-6 border-l border-gray-200 h-[60vh] overflow-auto">
                 {monthGrid.map((day, index) => {
-                    const dateString = toYYYYMMDD(day);
-                    let dayOfWeek = day.getDay();
-                    if (dayOfWeek === 0) dayOfWeek = 7;
-
-                    const recurringEvents = recurringSchedule.filter(entry => 
-                         entry.daysOfWeek.includes(String(dayOfWeek)) && (!entry.expiryDate || day <= new Date(entry.expiryDate + 'T23:59:59'))
-                    );
-                    const oneOffEvents = oneOffSchedule.filter(entry => entry.date === dateString);
-                    const allEvents = [...recurringEvents, ...oneOffEvents].sort((a,b) => a.startTime.localeCompare(b.startTime));
+                    const dateString = toLocalYYYYMMDD(day);
+                    // Backend đã sắp sẵn theo giờ bắt đầu
+                    const allEvents = calendarDays[dateString] || [];
 
                     const isCurrentMonth = day.getMonth() === currentDate.getMonth();
-                    const isToday = toYYYYMMDD(day) === toYYYYMMDD(new Date());
+                    const isToday = dateString === toLocalYYYYMMDD(new Date());
 
                     return (
                         <div key={index} className={`p-1 border-r border-b border-gray-200 flex flex-col ${!isCurrentMonth ? 'bg-gray-50' : 'bg-white'}`}>
@@ -61,7 +55,7 @@ const MonthCalendarView = ({ currentDate, recurringSchedule, oneOffSchedule }) =
                            </span>
                            <div className="flex-grow overflow-y-auto mt-1 space-y-1">
                                 {allEvents.map(event => (
-                                    <div key={event.id}
+                                    <div key={`${event.type}-${event.id}`}
                                          className="text-white text-xs p-1 rounded truncate"
                                          style={{ backgroundColor: stringToColor(event.schoolName) }}
                                          title={`${event.schoolName} - ${event.className} (${event.startTime})`}
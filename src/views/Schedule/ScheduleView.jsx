@@ -1,7 +1,20 @@
-import React, { useState } from 'react';
+import React, { useState, useEffect } from 'react';
 import WeekCalendarView from './WeekCalendarView';
 import MonthCalendarView from './MonthCalendarView';
 import { BACKEND_URL, dayOfWeekMap } from '../../utils/constants';
+import { toLocalYYYYMMDD } from '../../utils/helpers';
+
+// Khoảng ngày lịch đang hiển thị: tuần từ thứ Hai, hoặc lưới 6 tuần của tháng
+const getCalendarWindow = (currentDate, calendarView) => {
+    const start = calendarView === 'week'
+        ? new Date(currentDate.getFullYear(), currentDate.getMonth(), currentDate.getDate())
+        : new Date(currentDate.getFullYear(), currentDate.getMonth(), 1);
+    const dayOfWeek = start.getDay();
+    start.setDate(start.getDate() - (dayOfWeek === 0 ? 6 : dayOfWeek - 1));
+    const end = new Date(start);
+    end.setDate(start.getDate() + (calendarView === 'week' ? 6 : 41));
+    return { from: toLocalYYYYMMDD(start), to: toLocalYYYYMMDD(end) };
+};
 
 function ScheduleView({ recurringSchedule = [], setRecurringSchedule, oneOffSchedule = [], setOneOffSchedule, log }) {
     const initialRecurringState = { schoolName: '', className: '', daysOfWeek: [], startTime: '08:00', endTime: '09:30', expiryDate: '' };
@@ -14,6 +27,8 @@ function ScheduleView({ recurringSchedule = [], setRecurringSchedule, oneOffSche
     const [currentDate, setCurrentDate] = useState(new Date());
     const [tooltip, setTooltip] = useState({ visible: false, content: null, x: 0, y: 0 });
     const [calendarView, setCalendarView] = useState('week'); // 'week' or 'month'
+    // Các buổi học đã được backend bung sẵn theo ngày: { 'YYYY-MM-DD': [entry, ...] }
+    const [calendarDays, setCalendarDays] = useState({});
 
     // Helper to get headers with Auth token, adjusted for backend requirements
     const getAuthHeaders = () => {
@@ -32,6 +47,29 @@ function ScheduleView({ recurringSchedule = [], setRecurringSchedule, oneOffSche
     };
 
 
+    // Tải lại khi đổi tuần/tháng hoặc khi danh sách lịch thay đổi sau thêm/sửa/xoá
+    const { from: calendarFrom, to: calendarTo } = getCalendarWindow(currentDate, calendarView);
+    useEffect(() => {
+        let cancelled = false;
+        const loadCalendar = async () => {
+            try {
+                const response = await fetch(`/api/schedules/calendar?from=${calendarFrom}&to=${calendarTo}`, {
+                    headers: getAuthHeaders(),
+                });
+                if (!response.ok) {
+                    const errorData = await response.json().catch(() => ({}));
+                    throw new Error(errorData.error || `Lỗi API: ${response.status}`);
+                }
+                const data = await response.json();
+                if (!cancelled) setCalendarDays(data.days || {});
+            } catch (error) {
+                if (!cancelled) log(`Lỗi khi tải lịch: ${error.message}`, 'error');
+            }
+        };
+        loadCalendar();
+        return () => { cancelled = true; };
+    }, [calendarFrom, calendarTo, recurringSchedule, oneOffSchedule]);
+
     const handleEditClick = (entry, type) => {
         setEditingEntry({ type, id: entry.id });
         window.scrollTo({ top: 0, behavior: 'smooth' });
@@ -60,6 +98,20 @@ function ScheduleView({ recurringSchedule = [], setRecurringSchedule, oneOffSche
         });
     };
 
+    // Gửi lịch lên backend; nếu trùng giờ với lịch khác (409) thì hỏi người dùng
+    // rồi gửi lại kèm allowConflicts. Trả về null nếu người dùng huỷ.
+    const sendSchedule = async (url, method, entry) => {
+        const send = (body) => fetch(url, { method, headers: getAuthHeaders(), body: JSON.stringify(body) });
+        const response = await send(entry);
+        if (response.status !== 409) return response;
+        const { conflicts = [] } = await response.json().catch(() => ({}));
+        const details = conflicts.map(c =>
+            `- ${c.schoolName} - ${c.className} (${c.startTime}-${c.endTime}, ${c.date || dayOfWeekMap[String(c.dayOfWeek)]})`
+        ).join('\n');
+        if (!window.confirm(`Lịch này trùng giờ với:\n${details}\n\nVẫn lưu?`)) return null;
+        return send({ ...entry, allowConflicts: true });
+    };
+
     const handleSaveRecurring = async (e) => {
         e.preventDefault();
         if (!currentRecurringEntry.schoolName || !currentRecurringEntry.className || currentRecurringEntry.daysOfWeek.length === 0) {
@@ -72,11 +124,8 @@ function ScheduleView({ recurringSchedule = [], setRecurringSchedule, oneOffSche
         const method = isEditing ? 'PUT' : 'POST';
 
         try {
-            const response = await fetch(url, {
-                method: method,
-                headers: getAuthHeaders(),
-                body: JSON.stringify(currentRecurringEntry),
-            });
+            const response = await sendSchedule(url, method, currentRecurringEntry);
+            if (!response) return;
             if (response.status === 401) {
                  throw new Error('Xác thực không thành công. Vui lòng đăng nhập lại.');
             }
@@ -148,11 +197,8 @@ function ScheduleView({ recurringSchedule = [], setRecurringSchedule, oneOffSche
         const method = isEditing ? 'PUT' : 'POST';
 
         try {
-            const response = await fetch(url, {
-                method: method,
-                headers: getAuthHeaders(),
-                body: JSON.stringify(currentOneOffEntry),
-            });
+            const response = await sendSchedule(url, method, currentOneOffEntry);
+            if (!response) return;
             if (response.status === 401) {
                 throw new Error('Xác thực không thành công. Vui lòng đăng nhập lại.');
             }
@@ -330,8 +376,7 @@ function ScheduleView({ recurringSchedule = [], setRecurringSchedule, oneOffSche
                 {calendarView === 'week' ? (
                     <WeekCalendarView 
                         currentDate={currentDate}
-                        recurringSchedule={recurringSchedule} 
-                        oneOffSchedule={oneOffSchedule} 
+                        calendarDays={calendarDays}
                         handleEditClick={handleEditClick}
                         handleDeleteRecurring={handleDeleteRecurring}
                         handleDeleteOneOff={handleDeleteOneOff}
@@ -340,8 +385,7 @@ function ScheduleView({ recurringSchedule = [], setRecurringSchedule, oneOffSche
                 ) : (
                     <MonthCalendarView 
                         currentDate={currentDate}
-                        recurringSchedule={recurringSchedule} 
-                        oneOffSchedule={oneOffSchedule}
+                        calendarDays={calendarDays}
                     />
                 )}
             </div>
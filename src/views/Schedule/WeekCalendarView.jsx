@@ -1,8 +1,8 @@
 import React, { useState, useEffect, useCallback } from 'react';
-import { toYYYYMMDD } from '../../utils/helpers';
+import { toLocalYYYYMMDD } from '../../utils/helpers';
 import { dayOfWeekMap, dayOfWeekFullNameMap } from '../../utils/constants';
 
-const WeekCalendarView = ({ currentDate, recurringSchedule, oneOffSchedule, handleEditClick, handleDeleteRecurring, handleDeleteOneOff, setTooltip }) => {
+const WeekCalendarView = ({ currentDate, calendarDays, handleEditClick, handleDeleteRecurring, handleDeleteOneOff, setTooltip }) => {
     const [weekDates, setWeekDates] = useState([]);
     const [currentTimePosition, setCurrentTimePosition] = useState(0);
 
@@ -89,7 +89,7 @@ const WeekCalendarView = ({ currentDate, recurringSchedule, oneOffSchedule, hand
                     {weekDates.map(date => (
                         <div key={date.toISOString()} className="bg-gray-100 p-2 border-b-2 border-gray-200">
                             <p className="text-xs">{dayOfWeekFullNameMap[date.getDay() === 0 ? '7' : String(date.getDay())]}</p>
-                            <p className={`text-lg font-bold ${toYYYYMMDD(date) === toYYYYMMDD(new Date()) ? 'text-blue-600' : ''}`}>
+                            <p className={`text-lg font-bold ${toLocalYYYYMMDD(date) === toLocalYYYYMMDD(new Date()) ? 'text-blue-600' : ''}`}>
                                 {date.getDate()}
                             </p>
                         </div>
@@ -109,22 +109,15 @@ const WeekCalendarView = ({ currentDate, recurringSchedule, oneOffSchedule, hand
 
                 <div className="flex-1 grid grid-cols-7 bg-gray-50">
                     {weekDates.map(date => {
-                         const dateString = toYYYYMMDD(date);
-                         let dayOfWeek = date.getDay();
-                         if (dayOfWeek === 0) dayOfWeek = 7;
-                         const recurringEvents = recurringSchedule.filter(entry => 
-                             entry.daysOfWeek.includes(String(dayOfWeek)) && (!entry.expiryDate || date <= new Date(entry.expiryDate + 'T23:59:59'))
-                         );
-                         const oneOffEvents = oneOffSchedule.filter(entry => entry.date === dateString);
-                         const allEvents = [...recurringEvents, ...oneOffEvents];
+                         const allEvents = calendarDays[toLocalYYYYMMDD(date)] || [];
                          return(
                             <div key={date.toISOString()} className="relative border-l border-gray-200">
                                  {Array.from({ length: CALENDAR_END_HOUR - CALENDAR_START_HOUR }).map((_, i) => (
                                      <div key={i} className="border-b border-dashed border-gray-200" style={{ height: `${HOUR_HEIGHT}px` }}></div>
                                  ))}
                                  {allEvents.map(entry => (
-                                     <div key={entry.id}
-                                         onClick={() => handleEditClick(entry, entry.date ? 'one-off' : 'recurring')}
+                                     <div key={`${entry.type}-${entry.id}`}
+                                         onClick={() => handleEditClick(entry, entry.type === 'oneOff' ? 'one-off' : 'recurring')}
                                          onMouseEnter={(e) => handleMouseEnter(e, entry)}
                                          onMouseLeave={handleMouseLeave}
                                          className="absolute left-1 right-1 p-1 rounded-lg text-white text-xs z-10 overflow-hidden cursor-pointer shadow-lg hover:opacity-80 transition-opacity"
@@ -137,7 +130,7 @@ const WeekCalendarView = ({ currentDate, recurringSchedule, oneOffSchedule, hand
                                          <p className="font-bold">{entry.schoolName}</p>
                                          <p>{entry.className}</p>
                                          <p className="text-xs opacity-80">{entry.startTime} - {entry.endTime}</p>
-                                           <button onClick={(e) => { e.stopPropagation(); entry.date ? handleDeleteOneOff(entry.id) : handleDeleteRecurring(entry.id); }}
+                                           <button onClick={(e) => { e.stopPropagation(); entry.type === 'oneOff' ? handleDeleteOneOff(entry.id) : handleDeleteRecurring(entry.id); }}
                                             className="absolute bottom-1 right-1 bg-red-800 bg-opacity-50 text-white rounded-full w-4 h-4 flex items-center justify-center text-xs opacity-0 hover:opacity-100 transition-opacity group-hover:opacity-100"
                                             >
                                                 &times;
@@ -5,13 +5,23 @@ echo "--- Starting Services (Proxy Model) ---"
 echo "Render assigned public PORT: $PORT"
 
 # 1. Khởi động Backend service trên một cổng nội bộ cố định (5001) trong background
+# Số worker/luồng, pool DB... xem backend/gunicorn.conf.py
 echo "Starting Backend service on internal port 5001..."
-(cd backend && gunicorn --bind 0.0.0.0:5001 app:app) &
+(cd backend && gunicorn -c gunicorn.conf.py) &
 
 # Chờ một chút để backend có thời gian khởi động (tùy chọn nhưng được khuyến khích)
 sleep 5
 
-# 2. Khởi động Frontend service (Vite dev server) ở tiền cảnh
+# 2. Khởi động Frontend service ở tiền cảnh
+# Mặc định phục vụ bản build (dist/) bằng vite preview, cùng proxy /api như dev server.
+# FRONTEND_MODE=dev để chạy Vite dev server (hot reload) như trước.
 # Vite sẽ tự động đọc biến môi trường PORT từ file vite.config.js và lắng nghe trên đó.
 echo "Starting Frontend service on public port $PORT..."
-npm run dev
\ No newline at end of file
+if [ "$FRONTEND_MODE" = "dev" ]; then
+  npm run dev
+else
+  if [ ! -f dist/index.html ]; then
+    npm run build
+  fi
+  npm run preview -- --host 0.0.0.0
+fi
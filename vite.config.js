@@ -1,24 +1,34 @@
 import { defineConfig } from 'vite';
 import react from '@vitejs/plugin-react';
 
+const headers = {
+  'Content-Security-Policy': 
+    "default-src 'self'; " +
+    // SỬA LỖI: Thêm https://unpkg.com để cho phép tải thư viện heic2any
+    "script-src 'self' 'unsafe-inline' 'unsafe-eval' https://accounts.google.com https://cdn.jsdelivr.net https://cdnjs.cloudflare.com https://unpkg.com; " +
+    "style-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net; " +
+    "connect-src 'self' http://127.0.0.1:5001 https://www.googleapis.com https://cdn.jsdelivr.net ws:; " +
+    "img-src 'self' data: blob: https://lh3.googleusercontent.com; " + 
+    "frame-src 'self' https://drive.google.com; " +
+    // SỬA LỖI: Đảm bảo có chỉ thị worker-src để thư viện AI hoạt động
+    "worker-src 'self' blob:;"
+};
+
+// Backend gunicorn chạy ở cổng nội bộ 5001 (xem start.sh)
+const proxy = {
+  '/api': {
+    target: 'http://127.0.0.1:5001',
+    changeOrigin: true,
+  },
+};
+
 export default defineConfig({
   plugins: [react()],
   server: {
     host: '0.0.0.0',
     port: process.env.PORT || 5173,
 
-    headers: {
-      'Content-Security-Policy': 
-        "default-src 'self'; " +
-        // SỬA LỖI: Thêm https://unpkg.com để cho phép tải thư viện heic2any
-        "script-src 'self' 'unsafe-inline' 'unsafe-eval' https://accounts.google.com https://cdn.jsdelivr.net https://cdnjs.cloudflare.com https://unpkg.com; " +
-        "style-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net; " +
-        "connect-src 'self' http://127.0.0.1:5001 https://www.googleapis.com https://cdn.jsdelivr.net ws:; " +
-        "img-src 'self' data: blob: https://lh3.googleusercontent.com; " + 
-        "frame-src 'self' https://drive.google.com; " +
-        // SỬA LỖI: Đảm bảo có chỉ thị worker-src để thư viện AI hoạt động
-        "worker-src 'self' blob:;"
-    },
+    headers,
     
     cors: {
       origin: ['http://localhost:5173', 'https://teachersupportapp.onrender.com'],
@@ -30,12 +40,15 @@ export default defineConfig({
       'teachersupportapp.onrender.com',
       'localhost'
     ],
-    proxy: {
-      '/api': {
-        target: 'http://127.0.0.1:5001',
-        changeOrigin: true,
-      },
-    },
+    proxy,
+  },
+  // Bản build cho production (start.sh): cùng header CSP và proxy /api như dev server
+  preview: {
+    host: '0.0.0.0',
+    port: Number(process.env.PORT) || 5173,
+    strictPort: true,
+    headers,
+    proxy,
   },
 });
 